@@ -1,80 +1,202 @@
-from pybloom_live import ScalableBloomFilter
-
-Vehicle_Registration_NumberBF = ScalableBloomFilter()
-Vehicle_Identification_NumberBF = ScalableBloomFilter()
-License_Plate_NumberBF = ScalableBloomFilter()
-Engine_Serial_NumberBF = ScalableBloomFilter()
-Tire_SizeBF = ScalableBloomFilter()
-Vehicle_ClassBF = ScalableBloomFilter()
-Transmission_Serial_NumberBF = ScalableBloomFilter()
-Vehicle_WeightBF = ScalableBloomFilter()
-Axle_RatioBF = ScalableBloomFilter()
-Vehicle_Odometer_ReadingBF = ScalableBloomFilter()
-
-# Define your cars
-car1 = {
-    "Vehicle_Registration_Number": "AB123CD",
-    "Vehicle_Identification_Number": "1HGCM82633A123456",
-    "License_Plate_Number": "XYZ789",
-    "Engine_Serial_Number": "E12345",
-    "Tire_Size": "P215/60R16",
-    "Vehicle_Class": "sedan",
-    "Transmission_Serial_Number": "T1234",
-    "Vehicle_Weight": "3500 lbs",
-    "Axle_Ratio": "3.42",
-    "Vehicle_Odometer_Reading": "65000 miles"
-}
-
-
-car2 = {
-    "Vehicle_Registration_Number": "EF456GH",
-    "Vehicle_Identification_Number": "2T2BK1BA6DC123456",
-    "License_Plate_Number": "ABC123",
-    "Engine_Serial_Number": "F54321",
-    "Tire_Size": "P225/65R17",
-    "Vehicle_Class": "SUV",
-    "Transmission_Serial_Number": "T5678",
-    "Vehicle_Weight": "4200 lbs",
-    "Axle_Ratio": "3.73",
-    "Vehicle_Odometer_Reading": "45000 miles"
-}
-
-car3 = {
-    "Vehicle_Registration_Number": "GH789IJ",
-    "Vehicle_Identification_Number": "1FTFW1EF0BFA12345",
-    "License_Plate_Number": "DEF456",
-    "Engine_Serial_Number": "S67890",
-    "Tire_Size": "LT265/70R17",
-    "Vehicle_Class": "truck",
-    "Transmission_Serial_Number": "T9012",
-    "Vehicle_Weight": "6000 lbs",
-    "Axle_Ratio": "4.10",
-    "Vehicle_Odometer_Reading": "80000 miles"
-}
-
-
-# Insert data into Bloom filters
-for car in [car1, car2, car3]:
-    Vehicle_Registration_NumberBF.add(car["Vehicle_Registration_Number"])
-    Vehicle_Identification_NumberBF.add(car["Vehicle_Identification_Number"])
-    License_Plate_NumberBF.add(car["License_Plate_Number"])
-    Engine_Serial_NumberBF.add(car["Engine_Serial_Number"])
-    Tire_SizeBF.add(car["Tire_Size"])
-    Vehicle_ClassBF.add(car["Vehicle_Class"])
-    Transmission_Serial_NumberBF.add(car["Transmission_Serial_Number"])
-    Vehicle_WeightBF.add(car["Vehicle_Weight"])
-    Axle_RatioBF.add(car["Axle_Ratio"])
-    Vehicle_Odometer_ReadingBF.add(car["Vehicle_Odometer_Reading"])
-
-
-# Save Bloom filters to .blm files
-Vehicle_Registration_NumberBF.tofile(open('bloom-filter/Vehicle_Registration_NumberBF.blm', 'wb'))
-Vehicle_Identification_NumberBF.tofile(open('bloom-filter/Vehicle_Identification_NumberBF.blm', 'wb'))
-License_Plate_NumberBF.tofile(open('bloom-filter/License_Plate_NumberBF.blm', 'wb'))
-Engine_Serial_NumberBF.tofile(open('bloom-filter/Engine_Serial_NumberBF.blm', 'wb'))
-Tire_SizeBF.tofile(open('bloom-filter/Tire_SizeBF.blm', 'wb'))
-Vehicle_ClassBF.tofile(open('bloom-filter/Vehicle_ClassBF.blm', 'wb'))
-Transmission_Serial_NumberBF.tofile(open('bloom-filter/Transmission_Serial_NumberBF.blm', 'wb'))
-Vehicle_WeightBF.tofile(open('bloom-filter/Vehicle_WeightBF.blm', 'wb'))
-Axle_RatioBF.tofile(open('bloom-filter/Axle_RatioBF.blm', 'wb'))
-Vehicle_Odometer_ReadingBF.tofile(open('bloom-filter/Vehicle_Odometer_ReadingBF.blm', 'wb'))
\ No newline at end of file
+"""Bulk import of vehicle records into the feature Bloom filters.
+
+Reads CSV (with a header row naming the features) or JSONL (one object per
+line) records from files or stdin, streaming them in batches so memory use
+does not grow with the input, and adds every feature of every record to its
+filter with ``add_many''. The filters are pre-sized from --count, or from
+an estimate taken from the size of the input files, so a large import fills
+one right-sized filter per feature instead of growing through many small
+ones. Filters are published atomically once the import is done, and are
+not compacted until then; --merge folds their registration logs first. With
+--static a binary fuse filter of every feature is built from the same
+records and published next to it, for authentications until the next
+registration.
+
+    python add.py sample_vehicles.csv
+    python add.py --format jsonl --count 5000000 - < vehicles.jsonl
+"""
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import time
+
+from auth import (FILTER_BACKEND, FILTER_BACKENDS, FILTER_DIR, filter_path,
+                  static_filter_path, vehicle_features)
+from pybloom_live import BinaryFuseBuilder, FilterJournal
+from pybloom_live.journal import publish
+from pybloom_live.pybloom import DOUBLE_HASHING, SALTED_HASHING
+from pybloom_live.utils import chunked
+
+BATCH_SIZE = 10000
+ERROR_RATE = 0.001
+DEFAULT_CAPACITY = 100000  # when nothing is declared and stdin is read
+ESTIMATE_SAMPLE_BYTES = 1024 * 1024
+PROGRESS_EVERY = 1000000
+HASH_MODES = {"salted": SALTED_HASHING, "double": DOUBLE_HASHING}
+
+
+def record_format(path, fmt=None):
+    if fmt is not None:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_records(path, fmt=None):
+    """Yield the records in `path' ("-" for stdin) as dicts, one at a
+    time."""
+    fmt = record_format(path, fmt)
+    if path == "-":
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+    else:
+        f = open(path, encoding="utf-8", newline="")
+    with f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def estimate_records(paths):
+    """Estimate the number of records in `paths' from their sizes and the
+    number of lines in their first megabyte. Returns None if any of them
+    is stdin."""
+    total = 0
+    for path in paths:
+        if path == "-":
+            return None
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            sample = f.read(ESTIMATE_SAMPLE_BYTES)
+        lines = sample.count(b"\n") or 1
+        if record_format(path) == "csv" and size <= len(sample):
+            lines -= 1  # the header row
+        total += int(size * lines / max(len(sample), 1))
+    return total
+
+
+def import_records(records, filters, batch_size=BATCH_SIZE,
+                   progress_every=PROGRESS_EVERY, out=sys.stdout, static=None):
+    """Add every record's features to `filters', a dict of feature to
+    filter, and to `static', a dict of feature to BinaryFuseBuilder, if
+    given. Records missing a feature are skipped. Returns the number of
+    records imported and skipped."""
+    imported = skipped = 0
+    start = time.monotonic()
+    next_report = progress_every
+    for batch in chunked(records, batch_size):
+        columns = dict((feature, []) for feature in filters)
+        for record in batch:
+            if any(record.get(feature) in (None, "") for feature in filters):
+                skipped += 1
+                continue
+            imported += 1
+            for feature, column in columns.items():
+                column.append(str(record[feature]))
+        for feature, column in columns.items():
+            filters[feature].add_many(column, batch_size=batch_size)
+            if static is not None:
+                static[feature].add_many(column, batch_size=batch_size)
+        if progress_every and imported + skipped >= next_report:
+            next_report += progress_every
+            elapsed = time.monotonic() - start
+            print(f"{imported + skipped} records, "
+                  f"{(imported + skipped) / elapsed:.0f} records/s", file=out)
+    return imported, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="+",
+                        help="CSV or JSONL files, - for stdin")
+    parser.add_argument("--format", choices=("csv", "jsonl"),
+                        help="record format, by default from the extension")
+    parser.add_argument("--count", type=int,
+                        help="expected number of records, estimated from "
+                             "the input sizes by default")
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE)
+    parser.add_argument("--backend", choices=sorted(FILTER_BACKENDS),
+                        default=FILTER_BACKEND,
+                        help="filter class, FILTER_BACKEND by default")
+    parser.add_argument("--hash-mode", choices=sorted(HASH_MODES),
+                        default="salted",
+                        help="double hashing imports several times faster; "
+                             "the filters record their mode. Bloom backend "
+                             "only")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--filter-dir", default=FILTER_DIR)
+    parser.add_argument("--merge", action="store_true",
+                        help="add to the existing filters instead of "
+                             "replacing them")
+    parser.add_argument("--compress", action="store_true",
+                        help="encode sparse filters compactly; they are "
+                             "decoded into memory instead of mapped when "
+                             "loaded")
+    parser.add_argument("--static", type=int, choices=(8, 16), nargs="?",
+                        const=8, metavar="BITS",
+                        help="also build binary fuse filters with 8 (about "
+                             "9 bits per key, 0.4%% false positives) or 16 "
+                             "bit fingerprints")
+    args = parser.parse_args(argv)
+    if args.static and args.merge:
+        parser.error("--static builds from all records, it can not be "
+                     "combined with --merge")
+
+    count = args.count
+    if count is None:
+        count = estimate_records(args.inputs) or DEFAULT_CAPACITY
+    filter_class = FILTER_BACKENDS[args.backend]
+    options = {}
+    if args.backend == "bloom":
+        options["hash_mode"] = HASH_MODES[args.hash_mode]
+    os.makedirs(args.filter_dir, exist_ok=True)
+    with contextlib.ExitStack() as locks:
+        # A compaction running meanwhile would publish the old filter over
+        # the imported one. Registrations are only appended to the logs,
+        # so they go on during the import
+        filters = {}
+        for feature in vehicle_features:
+            path = filter_path(feature, args.filter_dir)
+            journal = FilterJournal(path, filter_class)
+            locks.enter_context(journal.compact_lock())
+            if args.merge and os.path.exists(path):
+                # Folds the log, so the keys it holds are not replayed on
+                # top of the merged filter forever
+                journal.compact(lock_held=True)
+                filters[feature] = journal.load()
+            else:
+                filters[feature] = filter_class(
+                    initial_capacity=max(count, 1),
+                    error_rate=args.error_rate, **options)
+
+        start = time.monotonic()
+        records = itertools.chain.from_iterable(
+            read_records(path, args.format) for path in args.inputs)
+        static = None
+        if args.static:
+            static = dict((feature, BinaryFuseBuilder(args.static))
+                          for feature in vehicle_features)
+        imported, skipped = import_records(records, filters, args.batch_size,
+                                           static=static)
+        elapsed = time.monotonic() - start
+
+        for feature, bloom_filter in filters.items():
+            publish(bloom_filter, filter_path(feature, args.filter_dir),
+                    compress=args.compress)
+        # After the Bloom filters, which a static filter must be newer than
+        if static is not None:
+            for feature, builder in static.items():
+                publish(builder.build(),
+                        static_filter_path(feature, args.filter_dir))
+    print(f"Imported {imported} vehicles ({skipped} skipped) in "
+          f"{elapsed:.1f}s, {imported / max(elapsed, 1e-9):.0f} vehicles/s")
+
+
+if __name__ == "__main__":
+    main()
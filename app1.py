@@ -1,64 +1,15 @@
-from email.mime.text import MIMEText
-import smtplib
-import pyotp
 import random
 import time
 from cryptography.fernet import Fernet
 from datetime import datetime, timedelta
-from pybloom_live import ScalableBloomFilter
-import os
-from dotenv import load_dotenv
+from pybloom_live import FilterJournal
+from auth import (filter_path, generate_otp, load_feature_filter, send_email,
+                  vehicle_features)
+from membership import connect_from_env
 
 
 print("Starting Bloomfilter Authentication system......")
 
-# Define a function to load Bloom filters
-def load_bloom_filter(filename):
-    try:
-        with open(f"bloom-filter/{filename}", 'rb') as f: 
-            return ScalableBloomFilter.fromfile(f)
-    except FileNotFoundError:
-        return None
-
-    
-
-# Generate a TOTP secret and a TOTP instance
-def generate_otp():
-    totp_secret = pyotp.random_base32()
-    totp = pyotp.TOTP(totp_secret)
-    return totp.now()
-
-def send_email(recipient_email, OTP):
-    load_dotenv()
-    sender_email = os.getenv("SENDER_EMAIL")
-    sender_password = os.getenv("SENDER_PASSWORD")
-    # Set up the SMTP server for Gmail
-    smtp_server = 'smtp.gmail.com'
-    port = 587
-
-    # Create the email content
-    msg = MIMEText(f"This is your OTP(One time password), please don't share with anyone: {OTP}")
-    msg['Subject'] = "OTP for Bloom-auth"
-    msg['From'] = sender_email
-    msg['To'] = recipient_email
-
-    try:
-        # Connect to the SMTP server
-        server = smtplib.SMTP(smtp_server, port)
-        server.starttls()
-        server.login(sender_email, sender_password)
-
-        # Send the email
-        server.sendmail(sender_email, recipient_email, msg.as_string())
-
-        # Close the server connection
-        server.quit()
-
-        print('Email sent successfully.')
-    except Exception as e:
-        print(f"Error: {e}")
-        return False
-
 expiration_time = datetime.now() + timedelta(minutes=5)
 
 
@@ -71,18 +22,7 @@ r = random.randint(1, 1000)
 t = int(time.time())
 # Use r and t as the seed to randomly permute a set of numbers, choosing the first number as the vehicle feature threshold fi to be considered
 seed = random.seed(str(r) + str(now))
-vehicle_features = [
-    "Vehicle_Registration_Number",
-    "Vehicle_Identification_Number",
-    "License_Plate_Number",
-    "Engine_Serial_Number",
-    "Tire_Size",
-    "Vehicle_Class",
-    "Transmission_Serial_Number",
-    "Vehicle_Weight",
-    "Axle_Ratio",
-    "Vehicle_Odometer_Reading"
-]
+vehicle_features = list(vehicle_features)
 
 random.shuffle(vehicle_features)
 fi = random.randint(2, len(vehicle_features))
@@ -98,9 +38,20 @@ for feature in selected_features:
 # Check all inputs against their respective Bloom filters
 authentication_passed = True
 
+# With MEMBERSHIP_ADDRESS set the filters are checked by the membership
+# server, the whole challenge in one round trip, instead of loaded here
+membership = connect_from_env()
+if membership is not None:
+    found = dict(zip(user_input, membership.contains_many(
+        list(user_input.items()))))
+
 for feature, choice in user_input.items():
-    filename = f"{feature}BF.blm"
-    bloom_filter = load_bloom_filter(filename)
+    if membership is not None:
+        if not found[feature]:
+            authentication_passed = False
+            print(f"Authentication failed for {feature}.")
+        continue
+    bloom_filter = load_feature_filter(feature)
     
     if bloom_filter is not None:
         if choice not in bloom_filter:
@@ -139,12 +90,13 @@ else:
             new_user_input[feature] = input(f"Input your {feature} detail: ")
         # Assuming 'new_user_input' contains the details for all vehicle features
 
-        # Load the Bloom filters for selected features
-        for feature in new_user_input.keys():
-            filename = f"{feature}BF.blm"
-            bloom_filter = ScalableBloomFilter()  # Create a new bloom filter
-            bloom_filter.add(new_user_input[feature])  # Add the user input to the Bloom filter
-            bloom_filter.tofile(open(f"bloom-filter/{filename}", 'wb'))  # Save the bloom filter
-            print("Vehicle added successfully")
+        # Append each detail to its feature's log; the filters are not
+        # rewritten, the logs are folded into them by compaction
+        if membership is not None:
+            membership.add_many(list(new_user_input.items()))
+        else:
+            for feature in new_user_input.keys():
+                FilterJournal(filter_path(feature)).append(new_user_input[feature])
+        print("Vehicle added successfully")
                 
                 
\ No newline at end of file
@@ -0,0 +1,137 @@
+import smtplib
+import pyotp
+import random
+import os
+from dotenv import load_dotenv
+from pybloom_live import (BinaryFuseFilter, FilterJournal, FilterManager,
+                          ScalableBloomFilter, ScalableCuckooFilter)
+from mailer import otp_message
+
+
+FILTER_DIR = "bloom-filter"
+
+vehicle_features = [
+    "Vehicle_Registration_Number",
+    "Vehicle_Identification_Number",
+    "License_Plate_Number",
+    "Engine_Serial_Number",
+    "Tire_Size",
+    "Vehicle_Class",
+    "Transmission_Serial_Number",
+    "Vehicle_Weight",
+    "Axle_Ratio",
+    "Vehicle_Odometer_Reading"
+]
+
+# The class of the feature filters. FILTER_BACKEND=cuckoo switches every
+# script to cuckoo filters; the filter files must then be rebuilt with
+# add.py --backend cuckoo
+FILTER_BACKENDS = {"bloom": ScalableBloomFilter, "cuckoo": ScalableCuckooFilter}
+FILTER_BACKEND = os.getenv("FILTER_BACKEND", "bloom")
+filter_class = FILTER_BACKENDS[FILTER_BACKEND]
+
+# Loaded filters are kept across authentications until their file or its
+# registration log changes. Sub-filters are only loaded once a lookup
+# reaches them
+filter_manager = FilterManager(filter_class=filter_class, mmap=True,
+                               journaled=True, lazy=True)
+
+# add.py --static also builds a binary fuse filter of every feature. It is
+# smaller and faster to query but can not take registrations, so it is only
+# used while nothing was registered or compacted since it was built
+static_manager = FilterManager(filter_class=BinaryFuseFilter, mmap=True)
+
+# Long-running servers reload changed filters from a FilterWatcher every
+# this many seconds, so lookups never wait for a reload
+FILTER_RELOAD_INTERVAL = 1.0
+
+
+def filter_path(feature, filter_dir=FILTER_DIR):
+    return os.path.join(filter_dir, f"{feature}BF.blm")
+
+
+def filter_paths(filter_dir=FILTER_DIR):
+    return [filter_path(feature, filter_dir) for feature in vehicle_features]
+
+
+def static_filter_path(feature, filter_dir=FILTER_DIR):
+    return os.path.join(filter_dir, f"{feature}BF.fuse")
+
+
+def static_filter_is_current(feature, filter_dir=FILTER_DIR):
+    # add.py --static builds from the imported records only, so keys still
+    # in the registration log are missing from it however old the log is.
+    # Ties count as stale, in case the file system keeps coarse mtimes. A
+    # static filter left behind by a removed feature is never current
+    try:
+        built = os.stat(static_filter_path(feature, filter_dir)).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    journal = FilterJournal(filter_path(feature, filter_dir))
+    if journal.log_size():
+        return False
+    try:
+        return os.stat(journal.path).st_mtime_ns < built
+    except FileNotFoundError:
+        return False
+
+
+def load_feature_filter(feature, filter_dir=FILTER_DIR, manager=None):
+    # The static filter of `feature' if it is current, else its Bloom filter
+    if static_filter_is_current(feature, filter_dir):
+        try:
+            return static_manager.get(static_filter_path(feature, filter_dir))
+        except FileNotFoundError:
+            pass
+    if manager is None:
+        manager = filter_manager
+    try:
+        return manager.get(filter_path(feature, filter_dir))
+    except FileNotFoundError:
+        return None
+
+
+def choose_features(rng=random):
+    # Of all available secret vehicle features, a random number (at least 2)
+    # of randomly chosen features make up the challenge
+    features = list(vehicle_features)
+    rng.shuffle(features)
+    fi = rng.randint(2, len(features))
+    return features[:fi]
+
+
+# Generate a TOTP secret and a TOTP instance
+def generate_otp():
+    totp_secret = pyotp.random_base32()
+    totp = pyotp.TOTP(totp_secret)
+    return totp.now()
+
+
+def send_email(recipient_email, OTP):
+    load_dotenv()
+    sender_email = os.getenv("SENDER_EMAIL")
+    sender_password = os.getenv("SENDER_PASSWORD")
+    # Set up the SMTP server for Gmail
+    smtp_server = 'smtp.gmail.com'
+    port = 587
+
+    # Create the email content
+    msg = otp_message(sender_email, recipient_email, OTP)
+
+    try:
+        # Connect to the SMTP server
+        server = smtplib.SMTP(smtp_server, port)
+        server.starttls()
+        server.login(sender_email, sender_password)
+
+        # Send the email
+        server.sendmail(sender_email, recipient_email, msg.as_string())
+
+        # Close the server connection
+        server.quit()
+
+        print('Email sent successfully.')
+        return True
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
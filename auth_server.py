@@ -0,0 +1,274 @@
+"""asyncio authentication service.
+
+Runs the same flow as app1.py - random feature challenge, Bloom filter
+checks, OTP email and OTP verification - for many concurrent sessions on
+one event loop. Filter loads run in a thread pool and OTP emails are
+queued to an OTPMailer, so neither blocks other sessions. Registrations
+logged by app1.py are folded into the filter files by a JournalCompactor,
+and filters whose files or logs change are reloaded in the background by
+a FilterWatcher.
+
+Clients talk newline-delimited JSON over TCP or a Unix socket, one
+response line per request line:
+
+    {"op": "start"}
+        -> {"session": ..., "features": [...]}
+    {"op": "answer", "session": ..., "answers": {feature: value, ...}}
+        -> {"passed": true/false, "failed": [...]}
+    {"op": "email", "session": ..., "email": ...}
+        -> {"queued": true}
+    {"op": "verify", "session": ..., "otp": ...}
+        -> {"valid": true/false}
+
+Errors are answered with {"error": message}.
+
+With --metrics-port, the stats of the loaded filters are served over HTTP
+at /metrics in the Prometheus text format.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import random
+import secrets
+import time
+
+import auth
+from mailer import OTPMailer, check_address
+from pybloom_live import FilterWatcher, JournalCompactor
+from pybloom_live.metrics import prometheus_text
+
+SESSION_TTL = 5 * 60  # seconds, as the OTP expiry in app1.py
+MAX_OTP_ATTEMPTS = 3  # guesses per session, across resends
+MAX_OTP_SENDS = 3
+PURGE_INTERVAL = 30
+MAX_LINE = 64 * 1024
+BACKLOG = 1024
+COMPACT_INTERVAL = 60
+COMPACT_MIN_LOG_BYTES = 64 * 1024
+
+
+class AuthError(Exception):
+    pass
+
+
+class Session(object):
+    def __init__(self, features, ttl):
+        self.features = features
+        self.expires = time.monotonic() + ttl
+        self.passed = False
+        self.otp = None
+        self.otp_attempts = 0
+        self.otp_sends = 0
+        self.email = None
+
+
+class AuthService(object):
+    def __init__(self, filter_dir=auth.FILTER_DIR, manager=None, mailer=None,
+                 session_ttl=SESSION_TTL, executor=None):
+        self.filter_dir = filter_dir
+        self.manager = manager if manager is not None else auth.filter_manager
+        self.mailer = mailer if mailer is not None else OTPMailer()
+        self.session_ttl = session_ttl
+        self.executor = executor
+        self.sessions = {}
+        self.rng = random.SystemRandom()
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn,
+                                                          *args)
+
+    def _session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None or session.expires < time.monotonic():
+            self.sessions.pop(session_id, None)
+            raise AuthError("unknown or expired session")
+        return session
+
+    def purge_expired(self):
+        now = time.monotonic()
+        for session_id in [session_id for session_id, session
+                           in self.sessions.items() if session.expires < now]:
+            del self.sessions[session_id]
+
+    async def start(self):
+        features = auth.choose_features(self.rng)
+        session_id = secrets.token_urlsafe(16)
+        self.sessions[session_id] = Session(features, self.session_ttl)
+        return {"session": session_id, "features": features}
+
+    async def _load_filter(self, feature):
+        return await self._run(auth.load_feature_filter, feature,
+                               self.filter_dir, self.manager)
+
+    async def answer(self, session_id, answers):
+        session = self._session(session_id)
+        if session.passed:
+            raise AuthError("challenge already answered")
+        if set(answers) != set(session.features):
+            raise AuthError("answers must cover exactly the challenged features")
+        filters = await asyncio.gather(*[self._load_filter(feature)
+                                         for feature in session.features])
+        failed = [feature for feature, bloom_filter
+                  in zip(session.features, filters)
+                  if bloom_filter is None or answers[feature] not in bloom_filter]
+        if failed:
+            del self.sessions[session_id]
+            return {"passed": False, "failed": failed}
+        session.passed = True
+        return {"passed": True, "failed": []}
+
+    async def email(self, session_id, email):
+        session = self._session(session_id)
+        if not session.passed:
+            raise AuthError("challenge not passed")
+        if session.otp_sends >= MAX_OTP_SENDS:
+            raise AuthError("OTP send limit reached")
+        if session.email is not None and email != session.email:
+            raise AuthError("OTP already sent to another address")
+        try:
+            check_address(email)
+        except ValueError as e:
+            raise AuthError(str(e))
+        if session.otp is None:
+            # The OTP is valid for one session TTL from the first email;
+            # resends don't extend it
+            session.expires = time.monotonic() + self.session_ttl
+        session.email = email
+        session.otp = auth.generate_otp()
+        session.otp_sends += 1
+        self.mailer.enqueue(email, session.otp)
+        return {"queued": True}
+
+    async def verify(self, session_id, otp):
+        session = self._session(session_id)
+        if session.otp is None:
+            raise AuthError("no OTP sent")
+        session.otp_attempts += 1
+        valid = hmac.compare_digest(str(otp).encode(), session.otp.encode())
+        if valid or session.otp_attempts >= MAX_OTP_ATTEMPTS:
+            del self.sessions[session_id]
+        return {"valid": valid}
+
+    async def handle(self, request):
+        op = request.get("op")
+        if op == "start":
+            return await self.start()
+        if op == "answer":
+            return await self.answer(request.get("session"),
+                                     dict(request.get("answers") or {}))
+        if op == "email":
+            return await self.email(request.get("session"),
+                                    request.get("email"))
+        if op == "verify":
+            return await self.verify(request.get("session"),
+                                     request.get("otp"))
+        raise AuthError(f"unknown op {op!r}")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.handle(json.loads(line))
+                except (AuthError, ValueError, TypeError, AttributeError) as e:
+                    response = {"error": str(e)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def metrics(self):
+        """Return the stats of the loaded filters, labelled by feature,
+        in the Prometheus text format."""
+        paths = dict((auth.filter_path(feature, self.filter_dir), feature)
+                     for feature in auth.vehicle_features)
+        filters = dict((paths[path], bloom_filter) for path, bloom_filter
+                       in self.manager.filters().items() if path in paths)
+        return prometheus_text(filters)
+
+    async def handle_metrics(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # headers
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1] == b"/metrics":
+                body = self.metrics().encode()
+                status = b"200 OK"
+            else:
+                body = b"not found\n"
+                status = b"404 Not Found"
+            writer.write(b"HTTP/1.0 " + status + b"\r\n"
+                         b"Content-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: " + str(len(body)).encode() +
+                         b"\r\n\r\n" + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _purge_periodically(self):
+        while True:
+            await asyncio.sleep(PURGE_INTERVAL)
+            self.purge_expired()
+
+    async def serve(self, host="127.0.0.1", port=8750, path=None,
+                    metrics_port=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(
+                self.handle_connection, path, limit=MAX_LINE, backlog=BACKLOG)
+        else:
+            server = await asyncio.start_server(
+                self.handle_connection, host, port, limit=MAX_LINE,
+                backlog=BACKLOG)
+        metrics_server = None
+        if metrics_port is not None:
+            self.manager.op_counters = True
+            self.manager.clear()  # reload with counters enabled
+            metrics_server = await asyncio.start_server(
+                self.handle_metrics, host, metrics_port, limit=MAX_LINE)
+        purger = asyncio.ensure_future(self._purge_periodically())
+        compactor = JournalCompactor(auth.filter_paths(self.filter_dir),
+                                     interval=COMPACT_INTERVAL,
+                                     min_log_bytes=COMPACT_MIN_LOG_BYTES,
+                                     filter_class=auth.filter_class)
+        compactor.start()
+        watcher = FilterWatcher([self.manager, auth.static_manager],
+                                interval=auth.FILTER_RELOAD_INTERVAL)
+        watcher.start()
+        self.mailer.start()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            purger.cancel()
+            compactor.stop()
+            watcher.stop()
+            if metrics_server is not None:
+                metrics_server.close()
+            await self._run(self.mailer.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8750)
+    parser.add_argument("--unix", help="serve on this Unix socket path")
+    parser.add_argument("--filter-dir", default=auth.FILTER_DIR)
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve filter metrics over HTTP on this port")
+    args = parser.parse_args()
+    print("Starting Bloomfilter Authentication service......")
+    service = AuthService(filter_dir=args.filter_dir)
+    asyncio.run(service.serve(args.host, args.port, args.unix,
+                              args.metrics_port))
+
+
+if __name__ == "__main__":
+    main()
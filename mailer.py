@@ -0,0 +1,228 @@
+"""Queued OTP email delivery over persistent SMTP connections.
+
+OTPMailer.enqueue() returns at once with a future. Worker threads each keep
+one SMTP connection open across messages, drain the queue in batches and
+retry transient failures on a fresh connection, so the connect, STARTTLS
+and login handshake is paid once per connection instead of once per OTP.
+
+Point SMTP_HOST/SMTP_PORT at a local stand-in server (for instance
+``python -m aiosmtpd -n -l localhost:8025``) with SMTP_STARTTLS=0 to test
+without a real mail account.
+"""
+from concurrent.futures import Future
+from email.mime.text import MIMEText
+from email.utils import parseaddr
+import os
+import queue
+import smtplib
+import threading
+import time
+
+from dotenv import load_dotenv
+
+_STOP = object()
+
+# Failures of the message itself; retrying on a new connection won't help.
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                    smtplib.SMTPNotSupportedError)
+TRANSIENT_ERRORS = (smtplib.SMTPException, OSError)
+
+
+def check_address(address):
+    """Raise ValueError unless `address' is a plain ASCII address such as
+    user@example.com, which SMTP servers without SMTPUTF8 accept."""
+    if not isinstance(address, str) or not address.isascii() or \
+            parseaddr(address)[1] != address or \
+            any(c.isspace() for c in address) or \
+            address.count("@") != 1 or not all(address.split("@")):
+        raise ValueError(f"invalid email address {address!r}")
+    return address
+
+
+def otp_message(sender_email, recipient_email, OTP):
+    msg = MIMEText(f"This is your OTP(One time password), please don't share with anyone: {OTP}")
+    msg['Subject'] = "OTP for Bloom-auth"
+    msg['From'] = sender_email
+    msg['To'] = recipient_email
+    return msg
+
+
+class SMTPSettings(object):
+    def __init__(self, host='smtp.gmail.com', port=587, sender_email=None,
+                 password=None, starttls=True, timeout=30):
+        self.host = host
+        self.port = port
+        self.sender_email = sender_email
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls):
+        """Read the settings from the environment and .env, once."""
+        load_dotenv()
+        return cls(host=os.getenv("SMTP_HOST", "smtp.gmail.com"),
+                   port=int(os.getenv("SMTP_PORT", "587")),
+                   sender_email=os.getenv("SENDER_EMAIL"),
+                   password=os.getenv("SENDER_PASSWORD"),
+                   starttls=os.getenv("SMTP_STARTTLS", "1") != "0")
+
+    def connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.password:
+                server.login(self.sender_email, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+
+class OTPMailer(object):
+    def __init__(self, settings=None, connections=2, batch_size=20,
+                 max_retries=3, retry_delay=0.5, idle_timeout=60):
+        """Sends OTP emails from a queue
+
+        settings
+            the SMTPSettings to connect with, read from the environment by
+            default
+        connections
+            the number of worker threads, each with its own connection
+        batch_size
+            the most messages a worker takes off the queue at once
+        max_retries
+            how often a message is retried after a transient failure, on a
+            new connection and after retry_delay * 2 ** attempt seconds
+        idle_timeout
+            connections idle for longer are reopened rather than reused,
+            as servers drop idle clients
+        """
+        self.settings = settings if settings is not None else SMTPSettings.from_env()
+        self.connections = connections
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.idle_timeout = idle_timeout
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.connects = 0
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._workers:
+            return self
+        for i in range(self.connections):
+            worker = threading.Thread(target=self._work,
+                                      name=f"otp-mailer-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def stop(self, timeout=None):
+        """Send what is queued, then close the connections."""
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def enqueue(self, recipient_email, OTP):
+        """Queue an OTP email without blocking. Returns a
+        concurrent.futures.Future resolving to True once the email is sent,
+        or False if it could not be. Raises ValueError for an address
+        ``check_address'' rejects."""
+        check_address(recipient_email)
+        future = Future()
+        msg = otp_message(self.settings.sender_email, recipient_email, OTP)
+        self._queue.put((recipient_email, msg.as_string(), future))
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self._queue.qsize(), 'sent': self.sent,
+                    'failed': self.failed, 'retries': self.retries,
+                    'connects': self.connects}
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _work(self):
+        server = None
+        last_used = 0
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            if server is not None and time.monotonic() - last_used > self.idle_timeout:
+                server = self._close(server)
+            for recipient_email, message, future in batch:
+                server = self._send(server, recipient_email, message, future)
+            last_used = time.monotonic()
+        if server is not None:
+            self._close(server, quit=True)
+
+    def _send(self, server, recipient_email, message, future):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count('retries')
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                if server is None:
+                    server = self.settings.connect()
+                    self._count('connects')
+                server.sendmail(self.settings.sender_email, recipient_email,
+                                message)
+            except PERMANENT_ERRORS as e:
+                print(f"Error: {e}")
+                break
+            except TRANSIENT_ERRORS as e:
+                print(f"Error: {e}")
+                if server is not None:
+                    server = self._close(server)
+                continue
+            except Exception as e:
+                # Anything else is a bad message; the connection may be
+                # left mid-transaction, so open a new one for the next.
+                print(f"Error: {e!r}")
+                if server is not None:
+                    server = self._close(server)
+                break
+            self._count('sent')
+            future.set_result(True)
+            return server
+        self._count('failed')
+        future.set_result(False)
+        return server
+
+    def _close(self, server, quit=False):
+        try:
+            if quit:
+                server.quit()
+            else:
+                server.close()
+        except TRANSIENT_ERRORS:
+            server.close()
+        return None
@@ -0,0 +1,392 @@
+"""Membership server: one process owns the feature filters and answers
+lookups and registrations for every auth worker.
+
+Without it every app1.py process loads its own copy of the ten filters.
+With it they share the server's copy, and a whole challenge - one key per
+challenged feature - is checked in a single round trip. Additions are
+appended to the filters' journals, as app1.py does, so they reach every
+reader and are folded into the filter files by a JournalCompactor. The
+server adds them to its own copy of the filters at the same time, and a
+FilterWatcher reloads filters whose files other writers change.
+
+Clients speak a compact binary protocol over TCP or a Unix socket. All
+integers are little-endian:
+
+    request:  <IBI length of the rest, op, request id, then
+              FILTERS:        nothing
+              CONTAINS / ADD: <H number of keys, then per key
+                              <BH filter index and key length, the key
+                              encoded as UTF-8
+    response: <IIB length of the rest, request id, status, then
+              FILTERS:        the filter names, newline separated
+              CONTAINS / ADD: one bit per key in request order, least
+                              significant bit first: whether the key is
+                              in the filter, or was before the ADD
+              ERROR status:   the message encoded as UTF-8
+
+Filter indices are positions in the FILTERS list. Requests can be
+pipelined: a client may send any number of them before reading, and they
+are answered in order.
+
+    python membership.py --unix /tmp/membership.sock
+    MEMBERSHIP_ADDRESS=/tmp/membership.sock python app1.py
+"""
+import argparse
+import asyncio
+import os
+import socket
+import struct
+from collections import defaultdict
+
+import numpy
+
+import auth
+from pybloom_live import FilterManager, FilterWatcher, JournalCompactor
+
+OP_FILTERS = 0
+OP_CONTAINS = 1
+OP_ADD = 2
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+REQUEST_HEADER = struct.Struct("<IBI")
+RESPONSE_HEADER = struct.Struct("<IIB")
+COUNT = struct.Struct("<H")
+ITEM = struct.Struct("<BH")
+MAX_FRAME = 16 * 1024 * 1024
+MAX_KEYS = 0xFFFF
+BACKLOG = 1024
+COMPACT_INTERVAL = 60
+COMPACT_MIN_LOG_BYTES = 64 * 1024
+
+
+class MembershipError(Exception):
+    pass
+
+
+def encode_items(indices_and_keys):
+    """Encode the (filter index, key) pairs of a CONTAINS or ADD request."""
+    parts = [COUNT.pack(len(indices_and_keys))]
+    for index, key in indices_and_keys:
+        data = str(key).encode("utf-8")
+        parts.append(ITEM.pack(index, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def decode_items(body):
+    """Return the (filter index, key) pairs encoded by ``encode_items''."""
+    count, = COUNT.unpack_from(body)
+    offset = COUNT.size
+    items = []
+    for _ in range(count):
+        index, length = ITEM.unpack_from(body, offset)
+        offset += ITEM.size
+        if offset + length > len(body):
+            raise MembershipError("truncated request")
+        items.append((index, body[offset:offset + length].decode("utf-8")))
+        offset += length
+    if offset != len(body):
+        raise MembershipError("trailing bytes in request")
+    return items
+
+
+def encode_bits(found):
+    return numpy.packbits(numpy.asarray(found, dtype=bool),
+                          bitorder="little").tobytes()
+
+
+def decode_bits(data, count):
+    bits = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8),
+                            count=count, bitorder="little")
+    return bits.astype(bool).tolist()
+
+
+def parse_address(address):
+    """Return (host, port, path) of "host:port", or of a Unix socket
+    path, which is anything containing a "/"."""
+    if "/" in address:
+        return None, None, address
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port), None
+
+
+class MembershipServer(object):
+    def __init__(self, filter_dir=auth.FILTER_DIR, manager=None,
+                 names=auth.vehicle_features, executor=None):
+        self.filter_dir = filter_dir
+        # Not memory mapped, so that ADD can add to the loaded filters
+        self.manager = manager if manager is not None else FilterManager(
+            filter_class=auth.filter_class, journaled=True, lazy=True)
+        self.names = list(names)
+        self.executor = executor
+
+    def _check(self, items):
+        for index, _ in items:
+            if index >= len(self.names):
+                raise MembershipError(f"unknown filter index {index}")
+
+    def _by_filter(self, items):
+        groups = defaultdict(list)
+        for i, (index, key) in enumerate(items):
+            groups[index].append(i)
+        return groups
+
+    def contains(self, items):
+        """Return whether every (filter index, key) pair in `items' is in
+        its filter, a lookup of all keys of a filter at once. Keys of a
+        filter that does not exist are not in it."""
+        self._check(items)
+        found = [False] * len(items)
+        for index, positions in self._by_filter(items).items():
+            bloom_filter = auth.load_feature_filter(
+                self.names[index], self.filter_dir, self.manager)
+            if bloom_filter is None:
+                continue
+            hits = bloom_filter.contains_many([items[i][1] for i in positions])
+            for i, hit in zip(positions, hits):
+                found[i] = bool(hit)
+        return found
+
+    def add(self, items):
+        """Append the keys of `items' to their filters' journals, one write
+        per filter, and add them to the loaded filters, so that lookups see
+        them at once. Returns whether every key was already in its filter."""
+        found = self.contains(items)
+        for index, positions in self._by_filter(items).items():
+            path = auth.filter_path(self.names[index], self.filter_dir)
+            self.manager.add_many(path, [items[i][1] for i in positions])
+        return found
+
+    def handle(self, op, body):
+        if op == OP_FILTERS:
+            return "\n".join(self.names).encode("utf-8")
+        if op == OP_CONTAINS:
+            return encode_bits(self.contains(decode_items(body)))
+        if op == OP_ADD:
+            return encode_bits(self.add(decode_items(body)))
+        raise MembershipError(f"unknown op {op}")
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(REQUEST_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                length, op, request_id = REQUEST_HEADER.unpack(header)
+                if not 5 <= length <= MAX_FRAME:
+                    break
+                body = await reader.readexactly(length - 5)
+                try:
+                    # Filter loads and lookups stay off the event loop.
+                    payload = await loop.run_in_executor(
+                        self.executor, self.handle, op, body)
+                    status = STATUS_OK
+                except (MembershipError, struct.error, UnicodeDecodeError) as e:
+                    payload = str(e).encode("utf-8")
+                    status = STATUS_ERROR
+                except Exception as e:
+                    # Such as a full filter or an unreadable filter file.
+                    # Failing the request alone keeps the connection, and
+                    # the requests pipelined after it, alive
+                    print(f"Error: op {op}: {e!r}")
+                    payload = f"internal error: {e!r}".encode("utf-8")
+                    status = STATUS_ERROR
+                writer.write(RESPONSE_HEADER.pack(len(payload) + 5,
+                                                  request_id, status) +
+                             payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8751, path=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(
+                self.handle_connection, path, backlog=BACKLOG)
+        else:
+            server = await asyncio.start_server(
+                self.handle_connection, host, port, backlog=BACKLOG)
+        compactor = JournalCompactor(auth.filter_paths(self.filter_dir),
+                                     interval=COMPACT_INTERVAL,
+                                     min_log_bytes=COMPACT_MIN_LOG_BYTES,
+                                     filter_class=auth.filter_class)
+        compactor.start()
+        watcher = FilterWatcher([self.manager, auth.static_manager],
+                                interval=auth.FILTER_RELOAD_INTERVAL)
+        watcher.start()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            compactor.stop()
+            watcher.stop()
+
+
+class RemoteFilter(object):
+    """A feature filter held by a membership server, usable where a loaded
+    filter is: ``key in filter''."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __contains__(self, key):
+        return self.client.contains_many([(self.name, key)])[0]
+
+    def contains_many(self, keys):
+        return self.client.contains_many([(self.name, key) for key in keys])
+
+
+class MembershipClient(object):
+    def __init__(self, host="127.0.0.1", port=8751, path=None, timeout=5.0):
+        """A blocking client of a membership server, connected on first
+        use. Not thread safe; use one client per thread."""
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._next_id = 0
+        self.names = None
+
+    @classmethod
+    def from_address(cls, address, **kwargs):
+        host, port, path = parse_address(address)
+        return cls(host, port, path, **kwargs)
+
+    def connect(self):
+        if self.path is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path if self.path is not None
+                         else (self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._file = sock.makefile("rb")
+        filters, = self._roundtrip([(OP_FILTERS, b"")])
+        self.names = filters.decode("utf-8").split("\n")
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def _read_exactly(self, n):
+        data = self._file.read(n)
+        if len(data) != n:
+            raise ConnectionError("membership server closed the connection")
+        return data
+
+    def _roundtrip(self, requests):
+        """Send every (op, body) request, then read their responses."""
+        if self._sock is None:
+            self.connect()
+        frames = []
+        ids = []
+        for op, body in requests:
+            self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+            ids.append(self._next_id)
+            frames.append(REQUEST_HEADER.pack(len(body) + 5, op,
+                                              self._next_id) + body)
+        try:
+            self._sock.sendall(b"".join(frames))
+            payloads = []
+            for request_id in ids:
+                length, response_id, status = RESPONSE_HEADER.unpack(
+                    self._read_exactly(RESPONSE_HEADER.size))
+                payload = self._read_exactly(length - 5)
+                if response_id != request_id:
+                    raise ConnectionError("out of order response")
+                payloads.append((status, payload))
+        except (OSError, struct.error):
+            self.close()
+            raise
+        results = []
+        for status, payload in payloads:
+            if status != STATUS_OK:
+                raise MembershipError(payload.decode("utf-8", "replace"))
+            results.append(payload)
+        return results
+
+    def _items(self, items):
+        if self.names is None:
+            self.connect()
+        indices = dict((name, i) for i, name in enumerate(self.names))
+        try:
+            return [(indices[name], key) for name, key in items]
+        except KeyError as e:
+            raise MembershipError(f"no filter {e.args[0]!r} on the server")
+
+    def _batched(self, op, batches):
+        batches = [self._items(items) for items in batches]
+        requests = []
+        for items in batches:
+            for start in range(0, max(len(items), 1), MAX_KEYS):
+                requests.append((op, encode_items(items[start:start + MAX_KEYS])))
+        payloads = iter(self._roundtrip(requests))
+        results = []
+        for items in batches:
+            found = []
+            for start in range(0, max(len(items), 1), MAX_KEYS):
+                found.extend(decode_bits(next(payloads),
+                                         len(items[start:start + MAX_KEYS])))
+            results.append(found)
+        return results
+
+    def contains_many(self, items):
+        """Return whether every (filter name, key) pair in `items' is in
+        its filter, in one round trip."""
+        return self._batched(OP_CONTAINS, [items])[0]
+
+    def add_many(self, items):
+        """Add every (filter name, key) pair in `items' to its filter, in
+        one round trip. Returns whether each key was already in it."""
+        return self._batched(OP_ADD, [items])[0]
+
+    def pipeline(self, batches, op=OP_CONTAINS):
+        """Send a request for every list of (filter name, key) pairs in
+        `batches' before reading any response. Returns a list of results
+        per batch, as ``contains_many'' or ``add_many'' with OP_ADD."""
+        return self._batched(op, list(batches))
+
+    def filter(self, name):
+        """Return a RemoteFilter for `name', or None if the server has no
+        such filter, as ``auth.load_feature_filter'' returns None."""
+        if self.names is None:
+            self.connect()
+        return RemoteFilter(self, name) if name in self.names else None
+
+
+def connect_from_env():
+    """Return a MembershipClient of the server at MEMBERSHIP_ADDRESS, or
+    None if it is not set."""
+    address = os.getenv("MEMBERSHIP_ADDRESS")
+    return MembershipClient.from_address(address) if address else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8751)
+    parser.add_argument("--unix", help="serve on this Unix socket path")
+    parser.add_argument("--filter-dir", default=auth.FILTER_DIR)
+    args = parser.parse_args()
+    print("Starting Bloomfilter membership server......")
+    server = MembershipServer(filter_dir=args.filter_dir)
+    asyncio.run(server.serve(args.host, args.port, args.unix))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,4 +3,15 @@
 """
 
 from .pybloom import BloomFilter, ScalableBloomFilter
-
+from .blocked import BlockedBloomFilter, ScalableBlockedBloomFilter
+from .counting import CountingBloomFilter, ScalableCountingBloomFilter
+from .cuckoo import CuckooFilter, ScalableCuckooFilter
+from .fuse import BinaryFuseBuilder, BinaryFuseFilter
+from .journal import FilterJournal, JournalCompactor
+from .manager import FilterManager, FilterWatcher
+from .metrics import prometheus_text
+from .parallel import build_parallel, parallel_add
+from .shared import SharedBloomFilter, SharedScalableBloomFilter
+from .sharded import ShardedBloomFilter
+from .snapshot import ConcurrentBloomFilter
+from .container import FilterContainer, write_container
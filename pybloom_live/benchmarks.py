@@ -1,47 +1,345 @@
 #!/usr/bin/env python
 #
-"""Test performance of BloomFilter at a set capacity and error rate."""
+"""Benchmark suite for pybloom_live.
+
+Times adding and lookups at several capacities and error rates, the
+growth of ScalableBloomFilters in both modes, serialization, union and
+intersection, and the feature check loop of app1.py. Results can be
+written as JSON and compared against a saved baseline:
+
+    python -m pybloom_live.benchmarks --json baseline.json
+    python -m pybloom_live.benchmarks --baseline baseline.json
+
+The comparison exits with status 1 if a benchmark got slower by more than
+--threshold.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import io
+import json
 import math
+import os
+import platform
+import random
+import shutil
 import sys
+import tempfile
 import time
 
 import bitarray
+import numpy
+
+from pybloom_live.blocked import BlockedBloomFilter
+from pybloom_live.manager import FilterManager
+from pybloom_live.pybloom import BloomFilter, ScalableBloomFilter
+from pybloom_live.utils import range_fn
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
+# Sizes per scale; "quick" is for smoke runs and tests.
+SCALES = {
+    'full': {
+        'capacities': (10000, 100000, 1000000),
+        'error_rates': (0.1, 0.001),
+        'sbf_keys': (10000, 100000, 1000000),
+        'io_capacity': 1000000,
+        'set_capacity': 1000000,
+        'app_keys': 100000,
+        'app_checks': 2000,
+        'repeat': 3,
+        'min_time': 0.2,
+    },
+    'quick': {
+        'capacities': (1000,),
+        'error_rates': (0.01,),
+        'sbf_keys': (1000, 5000),
+        'io_capacity': 10000,
+        'set_capacity': 10000,
+        'app_keys': 1000,
+        'app_checks': 50,
+        'repeat': 1,
+        'min_time': 0.01,
+    },
+}
+APP_FEATURES = ['feature_%d' % i for i in range_fn(0, 10)]
+DEFAULT_THRESHOLD = 0.2
+
+
+def _measure(prepare, repeat, min_time):
+    """Time the benchmark `prepare' sets up `repeat' times and keep the
+    fastest. Each time it is run again until `min_time' has passed, so that
+    short benchmarks are averaged over many runs. `prepare' returns a
+    callable to time, the number of operations it performs and a dict of
+    extra figures, or a callable returning that dict."""
+    best = None
+    for _ in range_fn(0, repeat):
+        runs = 0
+        total = 0.0
+        while runs == 0 or total < min_time:
+            run, ops, extra = prepare()
+            start = clock()
+            result = run()
+            total += clock() - start
+            runs += 1
+        seconds = total / runs
+        if callable(extra):
+            extra = extra(result)
+        if best is None or seconds < best['seconds']:
+            best = dict(extra, ops=ops, seconds=seconds,
+                        ops_per_sec=ops / seconds if seconds else float('inf'))
+    return best
+
+
+def _filled(cls, capacity, error_rate):
+    f = cls(capacity=capacity, error_rate=error_rate)
+    f.add_many(range_fn(0, capacity), skip_check=True)
+    return f
+
+
+def filter_cases(scale):
+    """add and contains, one key at a time and batched."""
+    for capacity in scale['capacities']:
+        for error_rate in scale['error_rates']:
+            for cls in (BloomFilter, BlockedBloomFilter):
+                label = '%s[capacity=%d,error_rate=%g]' % (
+                    cls.__name__, capacity, error_rate)
+
+                def add(cls=cls, capacity=capacity, error_rate=error_rate):
+                    f = cls(capacity=capacity, error_rate=error_rate)
+
+                    def run():
+                        for i in range_fn(0, capacity):
+                            f.add(i, skip_check=True)
+                    return run, capacity, {}
+
+                def add_many(cls=cls, capacity=capacity, error_rate=error_rate):
+                    f = cls(capacity=capacity, error_rate=error_rate)
+                    return (lambda: f.add_many(range_fn(0, capacity),
+                                               skip_check=True),
+                            capacity, {})
+
+                def contains(cls=cls, capacity=capacity, error_rate=error_rate):
+                    f = _filled(cls, capacity, error_rate)
+
+                    def run():
+                        return sum(1 for i in range_fn(capacity, 2 * capacity)
+                                   if i in f)
+                    return run, capacity, lambda fp: {
+                        'false_positive_rate': fp / capacity}
+
+                def contains_many(cls=cls, capacity=capacity,
+                                  error_rate=error_rate):
+                    f = _filled(cls, capacity, error_rate)
+                    return (lambda: f.contains_many(
+                        range_fn(capacity, 2 * capacity)), capacity, {})
+
+                yield label + '.add', add
+                yield label + '.add_many', add_many
+                yield label + '.contains', contains
+                yield label + '.contains_many', contains_many
+
+
+def scalable_cases(scale):
+    """ScalableBloomFilter in both growth modes as sub-filters are added."""
+    modes = (('small', ScalableBloomFilter.SMALL_SET_GROWTH),
+             ('large', ScalableBloomFilter.LARGE_SET_GROWTH))
+    for mode_name, mode in modes:
+        for n in scale['sbf_keys']:
+            label = 'ScalableBloomFilter[mode=%s,keys=%d]' % (mode_name, n)
+
+            def add(mode=mode, n=n):
+                f = ScalableBloomFilter(initial_capacity=1000, mode=mode)
+
+                def run():
+                    for i in range_fn(0, n):
+                        f.add(i)
+                    return len(f.filters)
+                return run, n, lambda filters: {'filters': filters}
+
+            def contains(mode=mode, n=n):
+                f = ScalableBloomFilter(initial_capacity=1000, mode=mode)
+                f.add_many(range_fn(0, n))
+
+                def run():
+                    hits = sum(1 for i in range_fn(0, 2 * n) if i in f)
+                    return hits - n
+                return run, 2 * n, lambda fp: {
+                    'filters': len(f.filters), 'false_positive_rate': fp / n}
+
+            yield label + '.add', add
+            yield label + '.contains', contains
+
 
-from pybloom import BloomFilter
-from utils import range_fn
-
-
-def main(capacity=100000, request_error_rate=0.1):
-    f = BloomFilter(capacity=capacity, error_rate=request_error_rate)
-    assert (capacity == f.capacity)
-    start = time.time()
-    for i in range_fn(0, f.capacity):
-        f.add(i, skip_check=True)
-    end = time.time()
-    print("{:5.3f} seconds to add to capacity, {:10.2f} entries/second".format(
-            end - start, f.capacity / (end - start)))
-    oneBits = f.bitarray.count(True)
-    zeroBits = f.bitarray.count(False)
-    print("Number of 1 bits:", oneBits)
-    print("Number of 0 bits:", zeroBits)
+def io_cases(scale):
+    """tofile and fromfile, union and intersection."""
+    capacity = scale['io_capacity']
+    bloom = _filled(BloomFilter, capacity, 0.001)
+    sbf = ScalableBloomFilter(initial_capacity=capacity // 100)
+    sbf.add_many(range_fn(0, capacity))
+    for name, f in (('BloomFilter', bloom), ('ScalableBloomFilter', sbf)):
+        label = '%s[keys=%d]' % (name, capacity)
+        data = io.BytesIO()
+        f.tofile(data)
+        data = data.getvalue()
+
+        def tofile(f=f, data=data):
+            return (lambda: f.tofile(io.BytesIO()), 1,
+                    {'bytes': len(data)})
+
+        def fromfile(f=f, data=data):
+            return (lambda: type(f).fromfile(io.BytesIO(data)), 1,
+                    {'bytes': len(data)})
+
+        yield label + '.tofile', tofile
+        yield label + '.fromfile', fromfile
+
+        compressed = io.BytesIO()
+        f.tofile(compressed, compress=True)
+        compressed = compressed.getvalue()
+
+        def tofile_compressed(f=f, data=compressed):
+            return (lambda: f.tofile(io.BytesIO(), compress=True), 1,
+                    {'bytes': len(data)})
+
+        def fromfile_compressed(f=f, data=compressed):
+            return (lambda: type(f).fromfile(io.BytesIO(data)), 1,
+                    {'bytes': len(data)})
+
+        yield label + '.tofile_compressed', tofile_compressed
+        yield label + '.fromfile_compressed', fromfile_compressed
+
+    capacity = scale['set_capacity']
+    one = _filled(BloomFilter, capacity, 0.001)
+    two = BloomFilter(capacity, 0.001)
+    two.add_many(range_fn(capacity // 2, capacity + capacity // 2),
+                 skip_check=True)
+    label = 'BloomFilter[capacity=%d]' % capacity
+    yield label + '.union', lambda: (lambda: one | two, 1, {})
+    yield label + '.intersection', lambda: (lambda: one & two, 1, {})
+
+
+def app_cases(scale):
+    """The check loop of app1.py: a random selection of at least two
+    features, each looked up in the filter file of its feature. Cold loads
+    every filter file as app1.py does on every run, cold_lazy only the
+    sub-filters the lookups reach; cached goes through a FilterManager as
+    the auth service does."""
+    directory = tempfile.mkdtemp()
+    paths = {}
+    for feature in APP_FEATURES:
+        f = ScalableBloomFilter()
+        f.add_many('%s-%d' % (feature, i)
+                   for i in range_fn(0, scale['app_keys']))
+        paths[feature] = os.path.join(directory, '%sBF.blm' % feature)
+        with open(paths[feature], 'wb') as fh:
+            f.tofile(fh)
+    rng = random.Random(0)
+    challenges = []
+    for _ in range_fn(0, scale['app_checks']):
+        features = list(APP_FEATURES)
+        rng.shuffle(features)
+        user = rng.randrange(scale['app_keys'])
+        challenges.append([(feature, '%s-%d' % (feature, user)) for feature
+                           in features[:rng.randint(2, len(features))]])
+    checks = len(challenges)
+
+    def cold(lazy=False):
+        def load(path):
+            with open(path, 'rb') as fh:
+                return ScalableBloomFilter.fromfile(fh, lazy=lazy)
+
+        def run():
+            return all(value in load(paths[feature])
+                       for challenge in challenges
+                       for feature, value in challenge)
+        return run, checks, {}
+
+    def cached():
+        manager = FilterManager(mmap=True, journaled=True)
+
+        def run():
+            return all(value in manager.get(paths[feature])
+                       for challenge in challenges
+                       for feature, value in challenge)
+        return run, checks, {}
+
+    try:
+        label = 'app1.check[keys=%d]' % scale['app_keys']
+        yield label + '.cold', cold
+        yield label + '.cold_lazy', lambda: cold(lazy=True)
+        yield label + '.cached', cached
+    finally:
+        shutil.rmtree(directory)
+
+
+CASES = (filter_cases, scalable_cases, io_cases, app_cases)
+
+
+def run_suite(scale='full', match=None, out=sys.stdout):
+    """Run every benchmark whose name contains `match' at the sizes of
+    `scale', printing progress to `out'. Returns the results as a dict
+    ready for JSON."""
+    sizes = SCALES[scale]
+    results = {}
+    for cases in CASES:
+        for name, prepare in cases(sizes):
+            if match and match not in name:
+                continue
+            results[name] = result = _measure(prepare, sizes['repeat'],
+                                              sizes['min_time'])
+            if out is not None:
+                print('{:<70} {:>14.1f} ops/s'.format(
+                    name, result['ops_per_sec']), file=out)
+    return {
+        'meta': {
+            'scale': scale,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'bitarray': bitarray.__version__,
+            'numpy': numpy.__version__,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare two run_suite results. Returns a list of (name, baseline
+    ops/s, current ops/s, ratio) for the benchmarks in both, and the names
+    of those slower than the baseline by more than `threshold'."""
+    rows = []
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['ops_per_sec'] / base['ops_per_sec']
+        rows.append((name, base['ops_per_sec'], result['ops_per_sec'], ratio))
+        if ratio < 1 - threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def fp_report(capacity=100000, request_error_rate=0.1):
+    """Print the bit usage and the measured and projected false positive
+    rates of a BloomFilter at capacity."""
+    f = _filled(BloomFilter, capacity, request_error_rate)
+    ones = f.bitarray.count(True)
+    print("Number of 1 bits:", ones)
+    print("Number of 0 bits:", f.bitarray.count(False))
     print("Number of Filter Bits:", f.num_bits)
     print("Number of slices:", f.num_slices)
     print("Bits per slice:", f.bits_per_slice)
-    print("------")
     print("Fraction of 1 bits at capacity: {:5.3f}".format(
-            oneBits / float(f.num_bits)))
-    # Look for false positives and measure the actual fp rate
-    trials = f.capacity
-    fp = 0
-    start = time.time()
-    for i in range_fn(f.capacity, f.capacity + trials + 1):
-        if i in f:
-            fp += 1
-    end = time.time()
-    print(("{:5.3f} seconds to check false positives, "
-           "{:10.2f} checks/second".format(end - start, trials / (end - start))))
+        ones / float(f.num_bits)))
+    fp = sum(1 for i in range_fn(capacity, 2 * capacity) if i in f)
     print("Requested FP rate: {:2.4f}".format(request_error_rate))
-    print("Experimental false positive rate: {:2.4f}".format(fp / float(trials)))
+    print("Experimental false positive rate: {:2.4f}".format(
+        fp / float(capacity)))
     # Compute theoretical fp max (Goel/Gupta)
     k = f.num_slices
     m = f.num_bits
@@ -49,5 +347,44 @@ def main(capacity=100000, request_error_rate=0.1):
     fp_theory = math.pow((1 - math.exp(-k * (n + 0.5) / (m - 1))), k)
     print("Projected FP rate (Goel/Gupta): {:2.6f}".format(fp_theory))
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='full')
+    parser.add_argument('--match', help='only run benchmarks whose name '
+                                        'contains this')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against the results in '
+                                           'this file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='the slowdown that counts as a regression')
+    parser.add_argument('--fp-report', action='store_true',
+                        help='print the false positive report instead')
+    args = parser.parse_args(argv)
+
+    if args.fp_report:
+        fp_report()
+        return 0
+    current = run_suite(args.scale, args.match)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows, regressions = compare(current, baseline, args.threshold)
+    print()
+    for name, base, now, ratio in rows:
+        print('{:<70} {:>14.1f} {:>14.1f} {:>7.2f}x{}'.format(
+            name, base, now, ratio, '  REGRESSION' if name in regressions
+            else ''))
+    if regressions:
+        print('%d of %d benchmarks regressed by more than %d%%' % (
+            len(regressions), len(rows), args.threshold * 100))
+        return 1
+    return 0
+
+
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""This module implements a cache-line blocked bloom filter. Every key is
+mapped to a single 512-bit block and all of its bits are set inside that
+block, so a lookup touches one block instead of one cache line per hash.
+"""
+from __future__ import absolute_import
+
+import math
+from struct import unpack
+
+import bitarray
+import numpy
+import xxhash
+
+from pybloom_live.pybloom import (BLOCKED_HASHING, MASK64, BloomFilter,
+                                  ScalableBloomFilter, _key_to_bytes)
+from pybloom_live.utils import range_fn
+
+BLOCK_SHIFT = 9
+BLOCK_BITS = 1 << BLOCK_SHIFT  # 64 bytes, one cache line
+
+
+def blocked_error_rate(capacity, num_hashes, num_blocks):
+    """Return the false positive rate of a blocked filter holding
+    `capacity' keys. Keys land in blocks following a Poisson distribution
+    and a block holding i keys answers like a classic filter of
+    BLOCK_BITS bits holding i keys."""
+    load = float(capacity) / num_blocks
+    spread = 10 * math.sqrt(load) + 10
+    error_rate = 0.0
+    for i in range_fn(int(max(0, load - spread)), int(load + spread) + 1):
+        weight = math.exp(-load + i * math.log(load) - math.lgamma(i + 1))
+        error_rate += weight * (1 - (1 - 1.0 / BLOCK_BITS) ** (num_hashes * i)) ** num_hashes
+    return error_rate
+
+
+def _block_salts(num_hashes):
+    """Return `num_hashes' odd 64-bit multipliers (splitmix64 outputs)."""
+    salts = []
+    state = 0
+    for _ in range_fn(0, num_hashes):
+        state = (state + 0x9E3779B97F4A7C15) & MASK64
+        z = state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        salts.append((z ^ (z >> 31)) | 1)
+    return salts
+
+
+def make_blocked_hashfuncs(num_hashes, num_blocks):
+    """Return functions mapping a key, a ``KeyDigest'' and a sequence of
+    keys to the absolute bit positions of the key(s). The low 64 bits of
+    the key's xxh128 pick the block; the high 64 bits times one odd salt
+    per hash, keeping the top 9 bits (multiply-shift), pick the bits in it.
+    """
+    salts = _block_salts(num_hashes)
+    shift = 64 - BLOCK_SHIFT
+
+    def _positions(h1, h2):
+        base = (h1 % num_blocks) << BLOCK_SHIFT
+        for salt in salts:
+            yield base + (((h2 * salt) & MASK64) >> shift)
+
+    def _hash_maker(key):
+        return _positions(*unpack('<QQ', xxhash.xxh128_digest(_key_to_bytes(key))))
+
+    def _hashes_from(digest):
+        return _positions(*digest.double())
+
+    salt_array = numpy.array(salts, dtype=numpy.uint64)
+
+    def _hash_many(keys):
+        digests = b''.join(xxhash.xxh128_digest(_key_to_bytes(key))
+                           for key in keys)
+        hashes = numpy.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+        base = (hashes[:, :1] % numpy.uint64(num_blocks)) << numpy.uint64(BLOCK_SHIFT)
+        # uint64 multiplication wraps just like the & MASK64 above.
+        return base + ((hashes[:, 1:] * salt_array) >> numpy.uint64(shift))
+
+    return _hash_maker, _hashes_from, _hash_many
+
+
+class BlockedBloomFilter(BloomFilter):
+    """A BloomFilter laid out as 512-bit blocks, one per key.
+
+    It has the same surface and file format header as BloomFilter, with
+    the header's slice fields holding the number of hashes and blocks, and
+    the mode byte set to BLOCKED_HASHING so neither class loads the
+    other's files."""
+    HASH_MODES = (BLOCKED_HASHING,)
+
+    def __init__(self, capacity, error_rate=0.001, hash_mode=BLOCKED_HASHING):
+        """Implements a blocked bloom filter
+
+        capacity
+            this BlockedBloomFilter must be able to store at least
+            *capacity* elements while maintaining no more than *error_rate*
+            chance of false positives
+        error_rate
+            the error_rate of the filter returning false positives. Blocking
+            skews how bits are spread, so the filter is sized up from the
+            classic layout until the expected error rate is met.
+        """
+        self._check_hash_mode(hash_mode)
+        if not (0 < error_rate < 1):
+            raise ValueError("Error_Rate must be between 0 and 1.")
+        if not capacity > 0:
+            raise ValueError("Capacity must be > 0")
+        num_hashes = int(math.ceil(math.log(1.0 / error_rate, 2)))
+        num_bits = capacity * abs(math.log(error_rate)) / (math.log(2) ** 2)
+        num_blocks = int(math.ceil(num_bits / BLOCK_BITS))
+        while blocked_error_rate(capacity, num_hashes, num_blocks) > error_rate:
+            num_blocks = int(num_blocks * 1.02) + 1
+        self._setup(error_rate, num_hashes, num_blocks, capacity, 0, hash_mode)
+        self.bitarray = bitarray.bitarray(self.num_bits, endian='little')
+        self.bitarray.setall(False)
+
+    def _setup(self, error_rate, num_hashes, num_blocks, capacity, count,
+               hash_mode=BLOCKED_HASHING):
+        self.error_rate = error_rate
+        self.num_hashes = num_hashes
+        self.num_blocks = num_blocks
+        self.capacity = capacity
+        self.num_bits = num_blocks * BLOCK_BITS
+        self.count = count
+        self.hash_mode = hash_mode
+        self._make_hashfuncs()
+
+    # BloomFilter.tofile writes these two as its slice fields.
+    @property
+    def num_slices(self):
+        return self.num_hashes
+
+    @property
+    def bits_per_slice(self):
+        return self.num_blocks
+
+    def _make_hashfuncs(self):
+        self.hashfn = xxhash.xxh128
+        (self.make_hashes, self.hashes_from_digest,
+         self.make_hashes_many) = make_blocked_hashfuncs(self.num_hashes,
+                                                         self.num_blocks)
+
+    def __contains__(self, key):
+        """Tests a key's membership in this bloom filter.
+        """
+        op_counters = self.op_counters
+        if op_counters is not None:
+            op_counters.lookups += 1
+        bitarray = self.bitarray
+        for position in self.make_hashes(key):
+            if not bitarray[position]:
+                return False
+        if op_counters is not None:
+            op_counters.hits += 1
+        return True
+
+    def add(self, key, skip_check=False):
+        """ Adds a key to this bloom filter. If the key already exists in this
+        filter it will return True. Otherwise False.
+        """
+        if self.count > self.capacity:
+            raise IndexError("BloomFilter is at capacity")
+        if self.op_counters is not None:
+            self.op_counters.inserts += 1
+        bitarray = self.bitarray
+        positions = list(self.make_hashes(key))
+        if not skip_check and all(bitarray[p] for p in positions):
+            return True
+        for position in positions:
+            bitarray[position] = True
+        self.count += 1
+        return False
+
+    def _contains_digest(self, digest):
+        op_counters = self.op_counters
+        if op_counters is not None:
+            op_counters.lookups += 1
+        bitarray = self.bitarray
+        for position in self.hashes_from_digest(digest):
+            if not bitarray[position]:
+                return False
+        if op_counters is not None:
+            op_counters.hits += 1
+        return True
+
+    def _digest_positions(self, digest):
+        return list(self.hashes_from_digest(digest))
+
+    def _bit_indices(self, keys):
+        return self.make_hashes_many(keys)
+
+    def _estimated_fpr(self):
+        """Return the mean over blocks of the chance that all of a key's
+        bits in the block are set, given the bits set now."""
+        bits = numpy.frombuffer(self.bitarray, dtype=numpy.uint8)
+        bits = bits[:self.num_bits // 8].reshape(self.num_blocks, -1)
+        fill = numpy.unpackbits(bits, axis=1).sum(axis=1) / float(BLOCK_BITS)
+        return float((fill ** self.num_hashes).mean())
+
+
+class ScalableBlockedBloomFilter(ScalableBloomFilter):
+    """A ScalableBloomFilter whose sub-filters are BlockedBloomFilters."""
+    FILTER_CLASS = BlockedBloomFilter
+
+    def __init__(self, initial_capacity=100, error_rate=0.001,
+                 mode=ScalableBloomFilter.LARGE_SET_GROWTH,
+                 hash_mode=BLOCKED_HASHING):
+        super(ScalableBlockedBloomFilter, self).__init__(
+            initial_capacity, error_rate, mode, hash_mode)
@@ -0,0 +1,150 @@
+"""This module implements a container format holding several named filters
+in one file. The file starts with an index of every filter's name, class,
+offset and length, so a reader opens the file once and seeks, or maps,
+straight to the filters it needs.
+
+Layout, all integers little-endian::
+
+    CONTAINER_MAGIC, <I number of entries
+    per entry: <HH name and class name lengths, name, class name,
+               <QQ offset from the start of the container and length
+    the filters, each as written by its class' ``tofile''
+"""
+from __future__ import absolute_import
+
+import mmap as mmap_module
+from struct import calcsize, pack, unpack
+
+from pybloom_live.blocked import BlockedBloomFilter, ScalableBlockedBloomFilter
+from pybloom_live.counting import (CountingBloomFilter,
+                                   ScalableCountingBloomFilter)
+from pybloom_live.pybloom import BloomFilter, ScalableBloomFilter
+
+CONTAINER_MAGIC = b'pybloomc'
+COUNT_FMT = b'<I'
+NAMES_FMT = b'<HH'
+SPAN_FMT = b'<QQ'
+
+FILTER_CLASSES = dict((cls.__name__, cls) for cls in (
+    BloomFilter, ScalableBloomFilter,
+    BlockedBloomFilter, ScalableBlockedBloomFilter,
+    CountingBloomFilter, ScalableCountingBloomFilter,
+))
+
+
+def write_container(f, filters):
+    """Write the named filters to file object `f' as one container.
+    `filters' is a mapping or an iterable of (name, filter) pairs. `f'
+    must be seekable: the index is patched once the filters are written.
+    """
+    if hasattr(filters, 'items'):
+        filters = filters.items()
+    entries = []
+    for name, filter in filters:
+        class_name = type(filter).__name__
+        if FILTER_CLASSES.get(class_name) is not type(filter):
+            raise ValueError("Can not store a %s in a container" % class_name)
+        entries.append((name.encode('utf-8'), class_name.encode('ascii'),
+                        filter))
+
+    start = f.tell()
+    f.write(CONTAINER_MAGIC + pack(COUNT_FMT, len(entries)))
+    index_pos = f.tell()
+    index_len = sum(calcsize(NAMES_FMT) + len(name) + len(class_name) +
+                    calcsize(SPAN_FMT) for name, class_name, _ in entries)
+    f.write(b'.' * index_len)
+    index = []
+    for name, class_name, filter in entries:
+        begin = f.tell()
+        filter.tofile(f)
+        end = f.tell()
+        index.append(pack(NAMES_FMT, len(name), len(class_name)) + name +
+                     class_name + pack(SPAN_FMT, begin - start, end - begin))
+    f.seek(index_pos)
+    f.write(b''.join(index))
+    f.seek(end if entries else index_pos)
+
+
+def _read_index(f):
+    head = f.read(len(CONTAINER_MAGIC) + calcsize(COUNT_FMT))
+    if head[:len(CONTAINER_MAGIC)] != CONTAINER_MAGIC:
+        raise ValueError("Not a filter container")
+    count, = unpack(COUNT_FMT, head[len(CONTAINER_MAGIC):])
+    index = {}
+    for _ in range(count):
+        name_len, class_len = unpack(NAMES_FMT, f.read(calcsize(NAMES_FMT)))
+        name = f.read(name_len).decode('utf-8')
+        class_name = f.read(class_len).decode('ascii')
+        if class_name not in FILTER_CLASSES:
+            raise ValueError("Unknown filter class %r" % class_name)
+        offset, length = unpack(SPAN_FMT, f.read(calcsize(SPAN_FMT)))
+        index[name] = (FILTER_CLASSES[class_name], offset, length)
+    return index
+
+
+class FilterContainer(object):
+    def __init__(self, path, mmap=False):
+        """Opens the container at `path' and reads its index. Filters are
+        only read when asked for by name.
+
+        With `mmap' the file is mapped once and filters are built over
+        their slice of the read-only map without copying, as in
+        ``BloomFilter.fromfile''; the file is not kept open.
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self.index = _read_index(self._file)
+            self._view = None
+            if mmap:
+                self._view = memoryview(mmap_module.mmap(
+                    self._file.fileno(), 0, access=mmap_module.ACCESS_READ))
+                self._file.close()
+        except Exception:
+            self._file.close()
+            raise
+
+    def names(self):
+        """Return the names of the filters in this container."""
+        return list(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, name):
+        """Read the filter stored under `name'. Raises KeyError if there is
+        none."""
+        cls, offset, length = self.index[name]
+        if self._view is not None:
+            return cls.frombuffer(self._view[offset:offset + length])
+        if self._file.closed:
+            raise ValueError("I/O operation on closed container")
+        self._file.seek(offset)
+        if issubclass(cls, ScalableBloomFilter):
+            return cls.fromfile(self._file)
+        return cls.fromfile(self._file, length)
+
+    def get(self, name, default=None):
+        """Read the filter stored under `name', or return `default'."""
+        if name not in self.index:
+            return default
+        return self[name]
+
+    def load(self, names):
+        """Read the filters stored under `names' into a dict. Raises
+        KeyError for a missing name."""
+        return dict((name, self[name]) for name in names)
+
+    def close(self):
+        """Close the file. Filters read through a memory map stay valid."""
+        self._file.close()
+        self._view = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,303 @@
+"""This module implements a counting bloom filter, which replaces every bit
+of a BloomFilter by a 4-bit counter so keys can be removed again, and its
+scalable counterpart. Both can be exported to the plain filters for the
+read path.
+"""
+from __future__ import absolute_import
+
+import io
+from struct import calcsize
+
+import bitarray
+import numpy
+
+from pybloom_live.pybloom import (COUNTING_FLAG, SALTED_HASHING, BloomFilter,
+                                  KeyDigest, ScalableBloomFilter,
+                                  _pack_header, _read_header, _readinto,
+                                  _write_chunks, make_digest_hashfuncs, make_hashfuncs,
+                                  slice_params)
+
+COUNTER_MAX = 15
+
+
+class CountingBloomFilter(object):
+    FILE_FMT = BloomFilter.FILE_FMT
+    HASH_MODES = BloomFilter.HASH_MODES
+    op_counters = None
+
+    def __init__(self, capacity, error_rate=0.001, hash_mode=SALTED_HASHING):
+        """Implements a bloom filter supporting removal
+
+        Takes the same arguments as BloomFilter and hashes keys the same
+        way, but keeps a 4-bit counter per bit, two to a byte. Counters
+        saturate at 15 and are never decremented from there, so a
+        saturated position can not produce false negatives.
+
+        Every add is counted, whether or not the key looked present, so a
+        key added twice has to be removed twice.
+        """
+        self._check_hash_mode(hash_mode)
+        num_slices, bits_per_slice = slice_params(capacity, error_rate)
+        self._setup(error_rate, num_slices, bits_per_slice, capacity, 0,
+                    hash_mode)
+        self.counters = bytearray((self.num_bits + 1) // 2)
+
+    @classmethod
+    def _check_hash_mode(cls, hash_mode):
+        if hash_mode not in cls.HASH_MODES:
+            raise ValueError("Unknown hash mode %r for %s" %
+                             (hash_mode, cls.__name__))
+
+    def _setup(self, error_rate, num_slices, bits_per_slice, capacity, count,
+               hash_mode=SALTED_HASHING):
+        self.error_rate = error_rate
+        self.num_slices = num_slices
+        self.bits_per_slice = bits_per_slice
+        self.capacity = capacity
+        self.num_bits = num_slices * bits_per_slice
+        self.count = count
+        self.hash_mode = hash_mode
+        self._make_hashfuncs()
+
+    def _make_hashfuncs(self):
+        self.make_hashes, self.hashfn = make_hashfuncs(
+            self.num_slices, self.bits_per_slice, self.hash_mode)
+        self.hashes_from_digest = make_digest_hashfuncs(
+            self.num_slices, self.bits_per_slice, self.hash_mode)
+
+    def _positions(self, hashes):
+        bits_per_slice = self.bits_per_slice
+        return [i * bits_per_slice + k for i, k in enumerate(hashes)]
+
+    def _contains_positions(self, positions):
+        counters = self.counters
+        for p in positions:
+            if not (counters[p >> 1] >> ((p & 1) << 2)) & 0xF:
+                return False
+        return True
+
+    def _add_positions(self, positions):
+        counters = self.counters
+        for p in positions:
+            shift = (p & 1) << 2
+            byte = counters[p >> 1]
+            if (byte >> shift) & 0xF < COUNTER_MAX:
+                counters[p >> 1] = byte + (1 << shift)
+        self.count += 1
+
+    def _remove_positions(self, positions):
+        counters = self.counters
+        for p in positions:
+            shift = (p & 1) << 2
+            byte = counters[p >> 1]
+            if 0 < (byte >> shift) & 0xF < COUNTER_MAX:
+                counters[p >> 1] = byte - (1 << shift)
+        self.count -= 1
+
+    def __contains__(self, key):
+        """Tests a key's membership in this bloom filter.
+        """
+        counters = self.counters
+        offset = 0
+        for k in self.make_hashes(key):
+            p = offset + k
+            if not (counters[p >> 1] >> ((p & 1) << 2)) & 0xF:
+                return False
+            offset += self.bits_per_slice
+        return True
+
+    def __len__(self):
+        """Return the number of keys stored by this bloom filter."""
+        return self.count
+
+    def add(self, key, skip_check=False):
+        """ Adds a key to this bloom filter. Returns True if the key
+        already seemed to exist in this filter, otherwise False. The key is
+        counted either way.
+        """
+        if self.count > self.capacity:
+            raise IndexError("BloomFilter is at capacity")
+        positions = self._positions(self.make_hashes(key))
+        found = not skip_check and self._contains_positions(positions)
+        self._add_positions(positions)
+        return found
+
+    def remove(self, key):
+        """Removes one occurrence of a key added to this bloom filter.
+        Raises KeyError if the key is not in the filter. Removing a key
+        that was never added, but is a false positive, removes the bits of
+        other keys.
+        """
+        positions = self._positions(self.make_hashes(key))
+        if not self._contains_positions(positions):
+            raise KeyError(key)
+        self._remove_positions(positions)
+
+    def _contains_digest(self, digest):
+        return self._contains_positions(
+            self._positions(self.hashes_from_digest(digest)))
+
+    def _digest_positions(self, digest):
+        return self._positions(self.hashes_from_digest(digest))
+
+    def _nonzero(self):
+        """Return a boolean numpy array, True where a counter is set."""
+        counters = numpy.frombuffer(self.counters, dtype=numpy.uint8)
+        nibbles = numpy.empty(2 * len(counters), dtype=numpy.uint8)
+        nibbles[0::2] = counters & 0xF
+        nibbles[1::2] = counters >> 4
+        return nibbles[:self.num_bits] != 0
+
+    def to_bloom_filter(self):
+        """Return a BloomFilter with a bit set wherever a counter is, which
+        answers lookups exactly like this filter."""
+        filter = BloomFilter(self.capacity, self.error_rate, self.hash_mode)
+        filter.count = self.count
+        bits = bitarray.bitarray(endian='little')
+        bits.frombytes(numpy.packbits(self._nonzero(),
+                                      bitorder='little').tobytes())
+        del bits[self.num_bits:]
+        filter.bitarray = bits
+        return filter
+
+    def stats(self):
+        """Return a dict describing the size and fill of this filter as
+        ``BloomFilter.stats'' does, with set counters counted as set bits.
+        """
+        per_slice = self._nonzero().reshape(self.num_slices,
+                                            self.bits_per_slice).sum(axis=1)
+        bits_set = int(per_slice.sum())
+        return {
+            'capacity': self.capacity,
+            'count': self.count,
+            'error_rate': self.error_rate,
+            'hash_mode': self.hash_mode,
+            'num_hashes': self.num_slices,
+            'num_bits': self.num_bits,
+            'bits_set': bits_set,
+            'fill_ratio': bits_set / float(self.num_bits),
+            'estimated_fpr': float(numpy.prod(per_slice /
+                                              float(self.bits_per_slice))),
+        }
+
+    def copy(self):
+        """Return a copy of this counting bloom filter.
+        """
+        new_filter = self.__class__(self.capacity, self.error_rate,
+                                    self.hash_mode)
+        new_filter.count = self.count
+        new_filter.counters = bytearray(self.counters)
+        return new_filter
+
+    def tofile(self, f, compress=False):
+        """Write the counting bloom filter to file object `f'. The header
+        is BloomFilter's with COUNTING_FLAG set in the mode byte, followed
+        by the packed counters. Counters can not be compressed."""
+        _write_chunks(f, self._chunks(compress))
+
+    def _chunks(self, compress=False):
+        if compress:
+            raise ValueError(
+                "Counting bloom filters can not be compressed")
+        return [_pack_header(self.FILE_FMT, COUNTING_FLAG | self.hash_mode,
+                             self.error_rate, self.num_slices,
+                             self.bits_per_slice, self.capacity, self.count),
+                self.counters]
+
+    @classmethod
+    def fromfile(cls, f, n=-1, mmap=False):
+        """Read a counting bloom filter from file-object `f' serialized
+        with ``CountingBloomFilter.tofile''. If `n' > 0 read only so many
+        bytes. Counters are always read into memory, as the filter is
+        writable; `mmap' is accepted for ScalableBloomFilter.fromfile."""
+        if 0 < n < calcsize(cls.FILE_FMT):
+            raise ValueError('n too small!')
+        hash_mode, header, headerlen = _read_header(f, cls.FILE_FMT)
+        filter = cls._from_header(hash_mode, header)
+        filter.counters = bytearray(n - headerlen if n > 0
+                                    else (filter.num_bits + 1) // 2)
+        filter._check_counters_length()
+        _readinto(f, filter.counters)
+        return filter
+
+    @classmethod
+    def frombuffer(cls, buf):
+        """Return a copy of the counting bloom filter held in `buf'."""
+        return cls.fromfile(io.BytesIO(memoryview(buf)))
+
+    @classmethod
+    def _from_header(cls, mode, header):
+        if not mode & COUNTING_FLAG:
+            raise ValueError("Not a %s file" % cls.__name__)
+        hash_mode = mode & ~COUNTING_FLAG
+        cls._check_hash_mode(hash_mode)
+        filter = cls(1)  # Bogus instantiation, we will `_setup'.
+        filter._setup(*header, hash_mode=hash_mode)
+        return filter
+
+    def _check_counters_length(self):
+        if len(self.counters) != (self.num_bits + 1) // 2:
+            raise ValueError('Counter length mismatch!')
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        del d['make_hashes']
+        del d['hashes_from_digest']
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self._make_hashfuncs()
+
+
+class ScalableCountingBloomFilter(ScalableBloomFilter):
+    """A ScalableBloomFilter of CountingBloomFilters. Keys are always added
+    to the newest filter and removed from the newest filter holding them.
+    """
+    FILTER_CLASS = CountingBloomFilter
+
+    def add(self, key):
+        """Adds a key to this bloom filter. Returns True if the key already
+        seemed to exist in this filter, otherwise False. The key is counted
+        either way, as in CountingBloomFilter.add.
+        """
+        digest = KeyDigest(key)
+        found = any(f._contains_digest(digest) for f in reversed(self.filters))
+        filter = self._filter_for_insert()
+        filter._add_positions(filter._digest_positions(digest))
+        return found
+
+    def remove(self, key):
+        """Removes one occurrence of a key from the newest filter holding
+        it. Raises KeyError if no filter holds the key.
+        """
+        digest = KeyDigest(key)
+        for f in reversed(self.filters):
+            positions = f._digest_positions(digest)
+            if f._contains_positions(positions):
+                f._remove_positions(positions)
+                return
+        raise KeyError(key)
+
+    def contains_many(self, keys, batch_size=4096):
+        return numpy.fromiter((key in self for key in keys), dtype=bool)
+
+    def add_many(self, keys, batch_size=4096):
+        return numpy.fromiter((self.add(key) for key in keys), dtype=bool)
+
+    def union(self, other):
+        raise TypeError(
+            "Counting bloom filters can not be unioned")
+
+    def enable_op_counters(self):
+        raise TypeError(
+            "Counting bloom filters do not keep operation counters")
+
+    def to_bloom_filter(self):
+        """Return a ScalableBloomFilter answering lookups exactly like this
+        filter, to be served on the read path."""
+        filter = ScalableBloomFilter(hash_mode=self.hash_mode)
+        filter._setup(self.scale, self.ratio, self.initial_capacity,
+                      self.error_rate, self.hash_mode)
+        filter.filters = [f.to_bloom_filter() for f in self.filters]
+        return filter
@@ -0,0 +1,439 @@
+"""This module implements a cuckoo filter, which keeps a short fingerprint of
+every key in one of two buckets, and its scalable counterpart. A lookup
+compares the fingerprints of two buckets whatever the error rate, and keys
+can be removed again.
+"""
+from __future__ import absolute_import
+
+import array
+import io
+import math
+import random
+from struct import calcsize
+
+import numpy
+import xxhash
+
+from pybloom_live.pybloom import (CUCKOO_HASHING, MASK64, KeyDigest,
+                                  OpCounters, ScalableBloomFilter,
+                                  _key_to_bytes, _pack_header, _read_exactly,
+                                  _read_header, _write_chunks)
+from pybloom_live.utils import chunked, range_fn
+
+BUCKET_SIZE = 4
+# Share of the slots `capacity' keys fill. Cuckoo hashing with buckets of
+# four slots reliably finds room up to about 95%.
+MAX_LOAD = 0.95
+MAX_KICKS = 500
+# Odd multiplier hashing a fingerprint to the offset of its other bucket.
+FINGERPRINT_MULTIPLIER = 0xC2B2AE3D27D4EB4F
+# Fingerprints are packed this many at a time; a multiple of 8, so every
+# chunk but the last ends on a byte.
+PACK_CHUNK = 1 << 16
+
+
+def cuckoo_params(capacity, error_rate):
+    """Return (fingerprint_bits, num_buckets) of a cuckoo filter holding
+    `capacity' keys with at most `error_rate' false positives. A lookup
+    compares 2 * BUCKET_SIZE fingerprints, each matching by chance with a
+    probability of about 1 / 2 ** fingerprint_bits."""
+    if not (0 < error_rate < 1):
+        raise ValueError("Error_Rate must be between 0 and 1.")
+    if not capacity > 0:
+        raise ValueError("Capacity must be > 0")
+    fingerprint_bits = int(math.ceil(math.log(2.0 * BUCKET_SIZE / error_rate,
+                                              2)))
+    if fingerprint_bits > 32:
+        raise ValueError("Error_Rate too small for 32-bit fingerprints")
+    num_buckets = int(math.ceil(capacity / (BUCKET_SIZE * MAX_LOAD)))
+    return fingerprint_bits, num_buckets
+
+
+def _hash_keys(keys):
+    """Return the xxh128 of every key in `keys' as an (n, 2) uint64 array of
+    the (h1, h2) of ``KeyDigest.double''."""
+    digests = b''.join(xxhash.xxh128_digest(_key_to_bytes(key))
+                       for key in keys)
+    return numpy.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+
+
+class CuckooFilter(object):
+    FILE_FMT = b'<dQQQQ'
+    HASH_MODES = (CUCKOO_HASHING,)
+    op_counters = None
+
+    def __init__(self, capacity, error_rate=0.001, hash_mode=CUCKOO_HASHING):
+        """Implements a cuckoo filter supporting removal
+
+        Takes the same arguments as BloomFilter. Every key is stored as a
+        fingerprint of `fingerprint_bits' bits in one of two buckets of
+        BUCKET_SIZE slots, moving other fingerprints to their other bucket
+        to make room. `capacity' keys fill MAX_LOAD of the slots; adding
+        keys past that works until no room can be made.
+
+        The key's xxh128 picks its first bucket and fingerprint, and the
+        fingerprint the offset of the second bucket, so a fingerprint can
+        be moved without knowing its key.
+        """
+        self._check_hash_mode(hash_mode)
+        fingerprint_bits, num_buckets = cuckoo_params(capacity, error_rate)
+        self._setup(error_rate, fingerprint_bits, num_buckets, capacity, 0,
+                    hash_mode)
+        self.buckets = array.array(self.typecode, [0]) * self.num_slots
+
+    @classmethod
+    def _check_hash_mode(cls, hash_mode):
+        if hash_mode not in cls.HASH_MODES:
+            raise ValueError("Unknown hash mode %r for %s" %
+                             (hash_mode, cls.__name__))
+
+    def _setup(self, error_rate, fingerprint_bits, num_buckets, capacity,
+               count, hash_mode=CUCKOO_HASHING):
+        self.error_rate = error_rate
+        self.fingerprint_bits = fingerprint_bits
+        self.num_buckets = num_buckets
+        self.num_slots = num_buckets * BUCKET_SIZE
+        self.capacity = capacity
+        self.count = count
+        self.hash_mode = hash_mode
+        self.typecode = 'H' if fingerprint_bits <= 16 else 'I'
+        self._mask = (1 << fingerprint_bits) - 1
+        self._random = random.Random(0)
+
+    def _locate(self, h1, h2):
+        """Return the two buckets and the fingerprint of a key whose xxh128
+        is (h1, h2). Fingerprints are never 0, which marks empty slots."""
+        fingerprint = (h2 & self._mask) or 1
+        bucket = h1 % self.num_buckets
+        return bucket, self._other_bucket(bucket, fingerprint), fingerprint
+
+    def _other_bucket(self, bucket, fingerprint):
+        return ((((fingerprint * FINGERPRINT_MULTIPLIER) & MASK64) - bucket) %
+                self.num_buckets)
+
+    def _contains_location(self, i1, i2, fingerprint):
+        buckets = self.buckets
+        start = i1 * BUCKET_SIZE
+        if fingerprint in buckets[start:start + BUCKET_SIZE]:
+            return True
+        start = i2 * BUCKET_SIZE
+        return fingerprint in buckets[start:start + BUCKET_SIZE]
+
+    def __contains__(self, key):
+        """Tests a key's membership in this cuckoo filter.
+        """
+        return self._contains_digest(KeyDigest(key))
+
+    def _contains_digest(self, digest):
+        """Like ``__contains__'' for a key's ``KeyDigest''."""
+        found = self._contains_location(*self._locate(*digest.double()))
+        op_counters = self.op_counters
+        if op_counters is not None:
+            op_counters.lookups += 1
+            op_counters.hits += found
+        return found
+
+    def __len__(self):
+        """Return the number of keys stored by this cuckoo filter."""
+        return self.count
+
+    def _put(self, bucket, fingerprint):
+        buckets = self.buckets
+        start = bucket * BUCKET_SIZE
+        for slot in range_fn(start, start + BUCKET_SIZE):
+            if not buckets[slot]:
+                buckets[slot] = fingerprint
+                return True
+        return False
+
+    def _insert(self, i1, i2, fingerprint):
+        """Store `fingerprint' in bucket `i1' or `i2', moving fingerprints
+        out of the way for up to MAX_KICKS moves. Returns False, with every
+        move undone, if no room was made."""
+        if self._put(i1, fingerprint) or self._put(i2, fingerprint):
+            return True
+        buckets = self.buckets
+        rng = self._random
+        bucket = rng.choice((i1, i2))
+        path = []
+        for _ in range_fn(0, MAX_KICKS):
+            slot = bucket * BUCKET_SIZE + rng.randrange(BUCKET_SIZE)
+            fingerprint, buckets[slot] = buckets[slot], fingerprint
+            path.append(slot)
+            bucket = self._other_bucket(bucket, fingerprint)
+            if self._put(bucket, fingerprint):
+                return True
+        for slot in reversed(path):
+            fingerprint, buckets[slot] = buckets[slot], fingerprint
+        return False
+
+    def _add_location(self, location, skip_check=False):
+        if not skip_check and self._contains_location(*location):
+            return True
+        if not self._insert(*location):
+            raise IndexError("CuckooFilter is at capacity")
+        self.count += 1
+        if self.op_counters is not None:
+            self.op_counters.inserts += 1
+        return False
+
+    def add(self, key, skip_check=False):
+        """ Adds a key to this cuckoo filter. If the key already seemed to
+        exist in this filter it is not added again and True is returned,
+        otherwise False. Raises IndexError, leaving the filter unchanged,
+        if no room can be made for the key.
+        """
+        return self._add_location(self._locate(*KeyDigest(key).double()),
+                                  skip_check)
+
+    def _remove_location(self, i1, i2, fingerprint):
+        buckets = self.buckets
+        for bucket in (i1, i2):
+            start = bucket * BUCKET_SIZE
+            for slot in range_fn(start, start + BUCKET_SIZE):
+                if buckets[slot] == fingerprint:
+                    buckets[slot] = 0
+                    self.count -= 1
+                    return True
+        return False
+
+    def remove(self, key):
+        """Removes a key added to this cuckoo filter. Raises KeyError if the
+        key is not in the filter. Removing a key that was never added, but
+        is a false positive, removes another key.
+        """
+        if not self._remove_location(*self._locate(*KeyDigest(key).double())):
+            raise KeyError(key)
+
+    def _table(self):
+        """Return the slots as a (num_buckets, BUCKET_SIZE) numpy view."""
+        return numpy.frombuffer(self.buckets, dtype=self.typecode).reshape(
+            -1, BUCKET_SIZE)
+
+    def _contains_hashes(self, hashes):
+        """Return a boolean array, True for every row (h1, h2) of `hashes'
+        whose fingerprint is in one of its buckets."""
+        num_buckets = numpy.uint64(self.num_buckets)
+        fingerprints = hashes[:, 1] & numpy.uint64(self._mask)
+        fingerprints[fingerprints == 0] = 1
+        i1 = hashes[:, 0] % num_buckets
+        # As _other_bucket, without letting the uint64 subtraction wrap.
+        i2 = ((fingerprints * numpy.uint64(FINGERPRINT_MULTIPLIER)) %
+              num_buckets + num_buckets - i1) % num_buckets
+        table = self._table()
+        fingerprints = fingerprints.astype(table.dtype)[:, None]
+        found = ((table[i1] == fingerprints).any(axis=1) |
+                 (table[i2] == fingerprints).any(axis=1))
+        if self.op_counters is not None:
+            self.op_counters.lookups += len(found)
+            self.op_counters.hits += int(found.sum())
+        return found
+
+    def contains_many(self, keys, batch_size=4096):
+        """Tests the membership of every key in the iterable `keys', a batch
+        at a time with numpy. Returns a boolean numpy array in the order of
+        `keys'.
+        """
+        results = [self._contains_hashes(_hash_keys(batch))
+                   for batch in chunked(keys, batch_size)]
+        if not results:
+            return numpy.zeros(0, dtype=bool)
+        return numpy.concatenate(results)
+
+    def add_many(self, keys, skip_check=False, batch_size=4096):
+        """Adds every key in the iterable `keys' to this cuckoo filter,
+        hashing a batch at a time. Returns a boolean numpy array which is
+        True for every key that already existed in the filter, as ``add''
+        does for a single key.
+        """
+        results = []
+        for batch in chunked(keys, batch_size):
+            results.append(numpy.fromiter(
+                (self._add_location(self._locate(h1, h2), skip_check)
+                 for h1, h2 in _hash_keys(batch).tolist()),
+                dtype=bool, count=len(batch)))
+        if not results:
+            return numpy.zeros(0, dtype=bool)
+        return numpy.concatenate(results)
+
+    def enable_op_counters(self):
+        """Start counting lookups, hits and inserts in ``op_counters''. The
+        hashing time is not measured."""
+        if self.op_counters is None:
+            self.op_counters = OpCounters()
+
+    def stats(self):
+        """Return a dict describing the size and load of this filter, and
+        the ``op_counters'' if they are enabled. `estimated_fpr' is the
+        false positive rate at the current load."""
+        occupied = int(numpy.count_nonzero(self._table()))
+        load_factor = occupied / float(self.num_slots)
+        match = 1.0 / self._mask
+        stats = {
+            'capacity': self.capacity,
+            'count': self.count,
+            'error_rate': self.error_rate,
+            'hash_mode': self.hash_mode,
+            'fingerprint_bits': self.fingerprint_bits,
+            'num_buckets': self.num_buckets,
+            'num_bits': self.num_slots * self.fingerprint_bits,
+            'load_factor': load_factor,
+            'estimated_fpr': 1.0 - (1.0 - match) ** (2 * BUCKET_SIZE *
+                                                     load_factor),
+        }
+        if self.op_counters is not None:
+            stats.update(self.op_counters.as_dict())
+        return stats
+
+    def copy(self):
+        """Return a copy of this cuckoo filter.
+        """
+        new_filter = self.__class__(self.capacity, self.error_rate,
+                                    self.hash_mode)
+        new_filter.count = self.count
+        new_filter.buckets = array.array(self.typecode, self.buckets)
+        return new_filter
+
+    def union(self, other):
+        raise TypeError("Cuckoo filters can not be unioned")
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def tofile(self, f, compress=False):
+        """Write the cuckoo filter to file object `f'. The header is
+        BloomFilter's with the mode byte set to CUCKOO_HASHING and the
+        slice fields holding the fingerprint bits and number of buckets,
+        followed by the fingerprints packed to `fingerprint_bits' bits
+        each. `compress' is accepted for ScalableBloomFilter.tofile;
+        fingerprints are always packed."""
+        _write_chunks(f, self._chunks(compress))
+
+    def _chunks(self, compress=False):
+        chunks = [_pack_header(self.FILE_FMT, self.hash_mode, self.error_rate,
+                               self.fingerprint_bits, self.num_buckets,
+                               self.capacity, self.count)]
+        fingerprints = numpy.frombuffer(self.buckets, dtype=self.typecode)
+        shifts = numpy.arange(self.fingerprint_bits, dtype=numpy.uint32)
+        for start in range(0, self.num_slots, PACK_CHUNK):
+            chunk = fingerprints[start:start + PACK_CHUNK].astype(numpy.uint32)
+            bits = ((chunk[:, None] >> shifts) & 1).astype(numpy.uint8)
+            chunks.append(numpy.packbits(bits, bitorder='little'))
+        return chunks
+
+    @classmethod
+    def fromfile(cls, f, n=-1, mmap=False):
+        """Read a cuckoo filter from file-object `f' serialized with
+        ``CuckooFilter.tofile''. If `n' > 0 read only so many bytes.
+        Fingerprints are always unpacked into memory, as the filter is
+        writable; `mmap' is accepted for ScalableBloomFilter.fromfile."""
+        if 0 < n < calcsize(cls.FILE_FMT):
+            raise ValueError('n too small!')
+        hash_mode, header, headerlen = _read_header(f, cls.FILE_FMT)
+        cls._check_hash_mode(hash_mode)
+        filter = cls(1)  # Bogus instantiation, we will `_setup'.
+        filter._setup(*header, hash_mode=hash_mode)
+        filter._unpack(_read_exactly(
+            f, n - headerlen if n > 0
+            else (filter.num_slots * filter.fingerprint_bits + 7) // 8))
+        return filter
+
+    @classmethod
+    def frombuffer(cls, buf):
+        """Return a copy of the cuckoo filter held in `buf'."""
+        return cls.fromfile(io.BytesIO(memoryview(buf)))
+
+    def _unpack(self, data):
+        bits_per = self.fingerprint_bits
+        if len(data) != (self.num_slots * bits_per + 7) // 8:
+            raise ValueError('Fingerprint length mismatch!')
+        self.buckets = array.array(self.typecode, [0]) * self.num_slots
+        fingerprints = numpy.frombuffer(self.buckets, dtype=self.typecode)
+        data = numpy.frombuffer(data, dtype=numpy.uint8)
+        shifts = numpy.arange(bits_per, dtype=numpy.uint32)
+        for start in range(0, self.num_slots, PACK_CHUNK):
+            size = min(PACK_CHUNK, self.num_slots - start)
+            offset = start * bits_per // 8
+            bits = numpy.unpackbits(
+                data[offset:offset + (size * bits_per + 7) // 8],
+                bitorder='little')[:size * bits_per].reshape(size, bits_per)
+            fingerprints[start:start + size] = (
+                bits.astype(numpy.uint32) << shifts).sum(axis=1)
+
+
+class ScalableCuckooFilter(ScalableBloomFilter):
+    """A ScalableBloomFilter of CuckooFilters. Keys are added to the newest
+    filter, which is replaced by a larger one once it holds its capacity or
+    no room can be made in it, and removed from the newest filter holding
+    them.
+    """
+    FILTER_CLASS = CuckooFilter
+
+    def __init__(self, initial_capacity=100, error_rate=0.001,
+                 mode=ScalableBloomFilter.LARGE_SET_GROWTH,
+                 hash_mode=CUCKOO_HASHING):
+        super(ScalableCuckooFilter, self).__init__(
+            initial_capacity, error_rate, mode, hash_mode)
+
+    def add(self, key):
+        """Adds a key to this cuckoo filter.
+        If the key already exists in this filter it will return True.
+        Otherwise False.
+        """
+        if self.op_counters is not None:
+            self.op_counters.inserts += 1
+        digest = KeyDigest(key)
+        if any(f._contains_digest(digest) for f in reversed(self.filters)):
+            return True
+        h1, h2 = digest.double()
+        filter = self._filter_for_insert()
+        try:
+            filter._add_location(filter._locate(h1, h2), skip_check=True)
+        except IndexError:
+            filter = self._filter_for_insert(grow=True)
+            filter._add_location(filter._locate(h1, h2), skip_check=True)
+        return False
+
+    def add_many(self, keys, batch_size=4096):
+        return numpy.fromiter((self.add(key) for key in keys), dtype=bool)
+
+    def remove(self, key):
+        """Removes a key from the newest filter holding it. Raises KeyError
+        if no filter holds the key.
+        """
+        h1, h2 = KeyDigest(key).double()
+        for f in reversed(self.filters):
+            if f._remove_location(*f._locate(h1, h2)):
+                return
+        raise KeyError(key)
+
+    def union(self, other):
+        raise TypeError("Cuckoo filters can not be unioned")
+
+    def stats(self):
+        """Return a dict describing this filter as
+        ``ScalableBloomFilter.stats'' does, with the load factor of the
+        sub-filters in place of their set bits."""
+        filters = [f.stats() for f in self.filters]
+        num_slots = sum(f.num_slots for f in self.filters)
+        no_fp = 1.0
+        for f in filters:
+            no_fp *= 1.0 - f['estimated_fpr']
+        stats = {
+            'capacity': self.capacity,
+            'count': len(self),
+            'error_rate': self.error_rate,
+            'hash_mode': self.hash_mode,
+            'mode': self.scale,
+            'filters': len(filters),
+            'num_bits': sum(f['num_bits'] for f in filters),
+            'load_factor': len(self) / float(num_slots) if num_slots else 0.0,
+            'estimated_fpr': 1.0 - no_fp,
+            'sub_filters': filters,
+        }
+        if self.op_counters is not None:
+            stats.update(self.op_counters.as_dict())
+            stats['probes'] = sum(f['lookups'] for f in filters)
+            stats['hits_by_filter'] = [f['hits'] for f in filters]
+            stats['hash_seconds'] = 0.0
+        return stats
@@ -0,0 +1,368 @@
+"""This module implements a binary fuse filter, a static filter built once
+from a set of keys. It stores one 8 or 16-bit fingerprint per slot in about
+1.125 slots per key, and a lookup XORs the fingerprints of exactly three
+slots, one in each of three consecutive segments.
+
+See Graf and Lemire, "Binary Fuse Filters: Fast and Smaller Than Xor
+Filters", 2022.
+"""
+from __future__ import absolute_import
+
+import io
+import math
+import random
+import sys
+from struct import calcsize
+
+import numpy
+import xxhash
+
+from pybloom_live.pybloom import (FILE_MAGIC, FUSE_HASHING, MASK64,
+                                  _key_to_bytes, _map_file, _mappable,
+                                  _pack_header, _read_exactly, _read_header,
+                                  _write_chunks)
+from pybloom_live.utils import chunked, range_fn
+
+ARITY = 3
+MAX_SEGMENT_LENGTH = 1 << 18
+MAX_ATTEMPTS = 100
+FINGERPRINT_TYPES = {8: 'B', 16: 'H'}
+
+
+def key_hashes(keys, batch_size=4096):
+    """Return the 64-bit hashes binary fuse filters are built from of every
+    key in the iterable `keys', as a uint64 numpy array. Only the hashes
+    are kept, 8 bytes per key."""
+    batches = [numpy.fromiter((xxhash.xxh3_64_intdigest(_key_to_bytes(key))
+                               for key in batch), dtype=numpy.uint64,
+                              count=len(batch))
+               for batch in chunked(keys, batch_size)]
+    if not batches:
+        return numpy.zeros(0, dtype=numpy.uint64)
+    return numpy.concatenate(batches)
+
+
+def fuse_params(size):
+    """Return (segment_length, segment_count) of a binary fuse filter of
+    `size' keys, as chosen by the reference implementation: small filters
+    get relatively more slots so that they can be built at all."""
+    if size == 0:
+        segment_length = 4
+    else:
+        segment_length = min(MAX_SEGMENT_LENGTH, 1 << int(
+            math.floor(math.log(size) / math.log(3.33) + 2.25)))
+    if size <= 1:
+        capacity = 0
+    else:
+        size_factor = max(1.125, 0.875 + 0.25 * math.log(1000000.0) /
+                          math.log(size))
+        capacity = int(round(size * size_factor))
+    segment_count = max(1, -(-capacity // segment_length) - (ARITY - 1))
+    return segment_length, segment_count
+
+
+def _mix(h):
+    """The murmur3 64-bit finalizer."""
+    h ^= h >> 33
+    h = (h * 0xFF51AFD7ED558CCD) & MASK64
+    h ^= h >> 33
+    h = (h * 0xC4CEB9FE1A85EC53) & MASK64
+    return h ^ (h >> 33)
+
+
+def _mix_many(h):
+    """``_mix'' of a uint64 numpy array; uint64 multiplication wraps just
+    like the & MASK64."""
+    h = h ^ (h >> numpy.uint64(33))
+    h = h * numpy.uint64(0xFF51AFD7ED558CCD)
+    h ^= h >> numpy.uint64(33)
+    h = h * numpy.uint64(0xC4CEB9FE1A85EC53)
+    return h ^ (h >> numpy.uint64(33))
+
+
+class BinaryFuseFilter(object):
+    FILE_FMT = b'<QQQQQ'
+
+    def __init__(self, keys=(), fingerprint_bits=8):
+        """Implements a static binary fuse filter
+
+        keys
+            the keys to build the filter from, read once. Duplicates are
+            allowed; only their 64-bit hashes are kept while building.
+        fingerprint_bits
+            8, for about 9 bits per key and a false positive rate of
+            1 / 256, or 16, for about 18 bits per key and 1 / 65536.
+
+        Keys can not be added afterwards: build a new filter instead.
+        """
+        self._build(key_hashes(keys), fingerprint_bits)
+
+    @classmethod
+    def from_hashes(cls, hashes, fingerprint_bits=8):
+        """Return a filter of the keys whose ``key_hashes'' are `hashes'."""
+        filter = cls.__new__(cls)
+        filter._build(numpy.asarray(hashes, dtype=numpy.uint64),
+                      fingerprint_bits)
+        return filter
+
+    def _setup(self, seed, fingerprint_bits, segment_length, segment_count,
+               count):
+        if fingerprint_bits not in FINGERPRINT_TYPES:
+            raise ValueError("fingerprint_bits must be 8 or 16")
+        self.seed = seed
+        self.fingerprint_bits = fingerprint_bits
+        self.segment_length = segment_length
+        self.segment_count = segment_count
+        self.count = count
+        self.error_rate = 1.0 / (1 << fingerprint_bits)
+        self.array_length = (segment_count + ARITY - 1) * segment_length
+        self.num_bits = self.array_length * fingerprint_bits
+        self._segment_count_length = segment_count * segment_length
+        self._segment_mask = segment_length - 1
+        self._fingerprint_mask = (1 << fingerprint_bits) - 1
+        self._dtype = '<u%d' % (fingerprint_bits // 8)
+
+    def _positions(self, h):
+        """Return the three slots of every mixed hash in the uint64 numpy
+        array `h', as ``__contains__'' computes them."""
+        scl = numpy.uint64(self._segment_count_length)
+        low32 = numpy.uint64(0xFFFFFFFF)
+        shift32 = numpy.uint64(32)
+        # The high 64 bits of h * scl, with scl < 2 ** 32.
+        h0 = (((h >> shift32) * scl + (((h & low32) * scl) >> shift32)) >>
+              shift32)
+        length = numpy.uint64(self.segment_length)
+        mask = numpy.uint64(self._segment_mask)
+        h1 = (h0 + length) ^ ((h >> numpy.uint64(18)) & mask)
+        h2 = (h0 + length + length) ^ (h & mask)
+        return (h0.astype(numpy.int64), h1.astype(numpy.int64),
+                h2.astype(numpy.int64))
+
+    def _fingerprints_of(self, h):
+        return ((h ^ (h >> numpy.uint64(32))) &
+                numpy.uint64(self._fingerprint_mask)).astype(self._dtype)
+
+    def _build(self, hashes, fingerprint_bits):
+        hashes = numpy.unique(hashes)
+        size = len(hashes)
+        segment_length, segment_count = fuse_params(size)
+        if (segment_count + ARITY - 1) * segment_length >= 1 << 32:
+            raise ValueError("Too many keys for a binary fuse filter")
+        rng = random.Random(size)
+        for _ in range_fn(0, MAX_ATTEMPTS):
+            self._setup(rng.getrandbits(64), fingerprint_bits, segment_length,
+                        segment_count, size)
+            mixed = _mix_many(hashes + numpy.uint64(self.seed))
+            positions = self._positions(mixed)
+            order = self._peel(positions)
+            if order is not None:
+                break
+        else:
+            raise ValueError("Could not build a binary fuse filter")
+        self._assign(order, positions, self._fingerprints_of(mixed))
+
+    def _peel(self, positions):
+        """Return the (key, slot) pairs in the order the keys were peeled
+        off the slots they are alone in, or None if some keys can not be.
+        """
+        h0, h1, h2 = positions
+        size = len(h0)
+        counts = numpy.bincount(numpy.concatenate(positions),
+                                minlength=self.array_length)
+        xors = numpy.zeros(self.array_length, dtype=numpy.int64)
+        keys = numpy.arange(size, dtype=numpy.int64)
+        for h in positions:
+            numpy.bitwise_xor.at(xors, h, keys)
+        counts = counts.tolist()
+        xors = xors.tolist()
+        h0, h1, h2 = h0.tolist(), h1.tolist(), h2.tolist()
+        stack = [slot for slot, count in enumerate(counts) if count == 1]
+        order = []
+        while stack:
+            slot = stack.pop()
+            if counts[slot] != 1:
+                continue
+            key = xors[slot]
+            order.append((key, slot))
+            for other in (h0[key], h1[key], h2[key]):
+                counts[other] -= 1
+                xors[other] ^= key
+                if counts[other] == 1:
+                    stack.append(other)
+        return order if len(order) == size else None
+
+    def _assign(self, order, positions, fingerprints):
+        """Set the slot every key was peeled from, in reverse, so that the
+        key's three slots XOR to its fingerprint."""
+        h0, h1, h2 = (h.tolist() for h in positions)
+        fingerprints = fingerprints.tolist()
+        slots = [0] * self.array_length
+        for key, slot in reversed(order):
+            slots[slot] = (fingerprints[key] ^ slots[h0[key]] ^
+                           slots[h1[key]] ^ slots[h2[key]])
+        self._set_fingerprints(numpy.array(slots, dtype=self._dtype))
+
+    def _set_fingerprints(self, data):
+        """Set the fingerprints from `data', a buffer of little-endian
+        fingerprints, without copying it where possible."""
+        data = memoryview(data).cast('B')
+        if len(data) != self.array_length * self.fingerprint_bits // 8:
+            raise ValueError('Fingerprint length mismatch!')
+        typecode = FINGERPRINT_TYPES[self.fingerprint_bits]
+        if typecode != 'B' and sys.byteorder != 'little':
+            data = memoryview(numpy.frombuffer(data, dtype=self._dtype)
+                              .astype(typecode)).cast('B')
+        self.fingerprints = data.cast(typecode)
+
+    def _table(self):
+        """Return the fingerprints as a numpy array sharing their memory."""
+        return numpy.frombuffer(self.fingerprints,
+                                dtype=FINGERPRINT_TYPES[self.fingerprint_bits])
+
+    def __contains__(self, key):
+        """Tests a key's membership in this binary fuse filter.
+        """
+        h = _mix((xxhash.xxh3_64_intdigest(_key_to_bytes(key)) + self.seed) &
+                 MASK64)
+        h0 = (h * self._segment_count_length) >> 64
+        h1 = (h0 + self.segment_length) ^ ((h >> 18) & self._segment_mask)
+        h2 = (h0 + 2 * self.segment_length) ^ (h & self._segment_mask)
+        fingerprints = self.fingerprints
+        return (((h ^ (h >> 32)) & self._fingerprint_mask) ==
+                fingerprints[h0] ^ fingerprints[h1] ^ fingerprints[h2])
+
+    def contains_many(self, keys, batch_size=4096):
+        """Tests the membership of every key in the iterable `keys', a batch
+        at a time with numpy. Returns a boolean numpy array in the order of
+        `keys'.
+        """
+        table = self._table()
+        results = []
+        for batch in chunked(keys, batch_size):
+            mixed = _mix_many(key_hashes(batch, batch_size) +
+                              numpy.uint64(self.seed))
+            h0, h1, h2 = self._positions(mixed)
+            results.append(self._fingerprints_of(mixed) ==
+                           table[h0] ^ table[h1] ^ table[h2])
+        if not results:
+            return numpy.zeros(0, dtype=bool)
+        return numpy.concatenate(results)
+
+    def __len__(self):
+        """Return the number of distinct keys this filter was built from."""
+        return self.count
+
+    def stats(self):
+        """Return a dict describing the size of this filter."""
+        return {
+            'count': self.count,
+            'error_rate': self.error_rate,
+            'estimated_fpr': self.error_rate,
+            'hash_mode': FUSE_HASHING,
+            'fingerprint_bits': self.fingerprint_bits,
+            'num_bits': self.num_bits,
+            'bits_per_key': self.num_bits / float(max(self.count, 1)),
+        }
+
+    def tofile(self, f, compress=False):
+        """Write the binary fuse filter to file object `f': a header with
+        the mode byte set to FUSE_HASHING, followed by the little-endian
+        fingerprints. `compress' is accepted for ``journal.publish'';
+        fingerprints look random and are not worth compressing."""
+        _write_chunks(f, self._chunks(compress))
+
+    def _chunks(self, compress=False):
+        return [_pack_header(self.FILE_FMT, FUSE_HASHING, self.seed,
+                             self.fingerprint_bits, self.segment_length,
+                             self.segment_count, self.count),
+                self._table().astype(self._dtype, copy=False)]
+
+    @classmethod
+    def fromfile(cls, f, n=-1, mmap=False):
+        """Read a binary fuse filter from file-object `f' serialized with
+        ``BinaryFuseFilter.tofile''. If `n' > 0 read only so many bytes.
+        With `mmap' the fingerprints are backed by a read-only memory map
+        of the file, as in ``BloomFilter.fromfile''."""
+        if 0 < n < calcsize(cls.FILE_FMT):
+            raise ValueError('n too small!')
+        if mmap and _mappable(f):
+            view = _map_file(f)
+            start = f.tell()
+            end = start + n if n > 0 else len(view)
+            f.seek(end)
+            return cls.frombuffer(view[start:end])
+        hash_mode, header, headerlen = _read_header(f, cls.FILE_FMT)
+        filter = cls._from_header(hash_mode, header)
+        filter._set_fingerprints(_read_exactly(
+            f, n - headerlen if n > 0
+            else filter.array_length * filter.fingerprint_bits // 8))
+        return filter
+
+    @classmethod
+    def frombuffer(cls, buf):
+        """Return a binary fuse filter over `buf', an object supporting the
+        buffer protocol that holds exactly one filter serialized with
+        ``BinaryFuseFilter.tofile''. The fingerprints are not copied."""
+        buf = memoryview(buf)
+        hash_mode, header, headerlen = _read_header(
+            io.BytesIO(buf[:len(FILE_MAGIC) + 1 +
+                           calcsize(cls.FILE_FMT)].tobytes()),
+            cls.FILE_FMT)
+        filter = cls._from_header(hash_mode, header)
+        filter._set_fingerprints(buf[headerlen:])
+        return filter
+
+    @classmethod
+    def _from_header(cls, hash_mode, header):
+        if hash_mode != FUSE_HASHING:
+            raise ValueError("Not a %s file" % cls.__name__)
+        filter = cls.__new__(cls)
+        filter._setup(*header)
+        return filter
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['fingerprints'] = self._table().astype(self._dtype).tobytes()
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self._set_fingerprints(bytearray(d['fingerprints']))
+
+
+class BinaryFuseBuilder(object):
+    def __init__(self, fingerprint_bits=8):
+        """Collects the keys of a BinaryFuseFilter from a stream, such as
+        the keys added to a ScalableBloomFilter during an import, keeping
+        only their 64-bit hashes until ``build'' is called.
+        """
+        if fingerprint_bits not in FINGERPRINT_TYPES:
+            raise ValueError("fingerprint_bits must be 8 or 16")
+        self.fingerprint_bits = fingerprint_bits
+        self._batches = []
+        self._pending = []
+
+    def add(self, key):
+        self._pending.append(key)
+        if len(self._pending) >= 4096:
+            self._flush()
+
+    def add_many(self, keys, batch_size=4096):
+        self._flush()
+        self._batches.append(key_hashes(keys, batch_size))
+
+    def _flush(self):
+        if self._pending:
+            self._batches.append(key_hashes(self._pending))
+            self._pending = []
+
+    def __len__(self):
+        """Return the number of keys collected, duplicates included."""
+        return sum(len(batch) for batch in self._batches) + len(self._pending)
+
+    def build(self):
+        """Return a BinaryFuseFilter of the keys collected so far."""
+        self._flush()
+        hashes = (numpy.concatenate(self._batches) if self._batches
+                  else numpy.zeros(0, dtype=numpy.uint64))
+        return BinaryFuseFilter.from_hashes(hashes, self.fingerprint_bits)
@@ -0,0 +1,324 @@
+"""This module implements incremental persistence for filters: a snapshot
+file written with ``tofile'' plus an append-only log of keys added since.
+
+Adding a key costs one small sequential write to the log. Loading replays
+the log onto the snapshot, and compaction folds the log into a new
+snapshot. Compaction first renames the log aside, so appends never wait
+for it, and publishes the snapshot atomically. Replaying a key twice is
+harmless since adding a key to a bloom filter is idempotent, so a reader
+racing a compaction, or a compaction interrupted half way, never loses
+keys as long as logs are read before the snapshot.
+
+Log records are ``<II'' length and crc32 of the key, then the key encoded
+as the filters encode it; a torn record at the end of a log is ignored.
+"""
+from __future__ import absolute_import
+
+import errno
+import os
+import stat
+import sys
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+from struct import calcsize, pack, unpack
+
+from pybloom_live.pybloom import ScalableBloomFilter, _key_to_bytes
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+RECORD_FMT = b'<II'
+LOG_SUFFIX = '.log'
+COMPACTING_SUFFIX = '.log.compacting'
+LOCK_SUFFIX = '.lock'
+COMPACT_LOCK_SUFFIX = '.compact.lock'
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+@contextmanager
+def _locked(path, blocking=True):
+    """Hold an exclusive lock on the lock file `path', across processes
+    where fcntl is available. Yields whether the lock was taken, which is
+    only ever False if not `blocking'."""
+    if fcntl is None:
+        with _thread_locks_lock:
+            lock = _thread_locks.setdefault(path, threading.Lock())
+        acquired = lock.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+        return
+    with open(path, 'ab') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except (IOError, OSError) as e:
+            if blocking or e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _encode_record(key):
+    data = _key_to_bytes(key)
+    return pack(RECORD_FMT, len(data), zlib.crc32(data) & 0xffffffff) + data
+
+
+def read_log(path):
+    """Return the keys logged in `path', or [] if there is no such file."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError) as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+    keys = []
+    offset = 0
+    headerlen = calcsize(RECORD_FMT)
+    while offset + headerlen <= len(data):
+        length, crc = unpack(RECORD_FMT, data[offset:offset + headerlen])
+        key = data[offset + headerlen:offset + headerlen + length]
+        if len(key) != length or zlib.crc32(key) & 0xffffffff != crc:
+            break  # torn write at the end of the log
+        keys.append(key.decode('utf-8'))
+        offset += headerlen + length
+    return keys
+
+
+def _fsync_directory(directory):
+    """Make the renames in `directory' durable, where directories can be
+    opened and fsynced."""
+    try:
+        fd = os.open(directory, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    except (IOError, OSError):
+        return
+    try:
+        os.fsync(fd)
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.EINVAL, errno.EBADF):
+            raise
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_file(path):
+    """Yield a binary file that replaces `path' once the block exits: it
+    is written next to `path', fsynced and renamed over it, and the rename
+    fsynced. Readers see either the old or the new file, never a partial
+    one, and those that opened or mapped the old file keep reading it. The
+    new file keeps the old one's permissions. If the block raises, `path'
+    is left alone."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory,
+                                    prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _fsync_directory(directory)
+
+
+def publish(filter, path, compress=False):
+    """Write `filter' to `path' atomically with ``atomic_file''.
+    `compress' is passed on to ``tofile''."""
+    with atomic_file(path) as f:
+        filter.tofile(f, compress=compress)
+
+
+def _remove(path):
+    """Remove `path' if it exists."""
+    try:
+        os.remove(path)
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class FilterJournal(object):
+    def __init__(self, path, filter_class=ScalableBloomFilter, fsync=False):
+        """Incremental persistence of the filter whose snapshot is `path'
+
+        filter_class
+            the class of the snapshot, used to load it and to start one
+            if there is none yet
+        fsync
+            whether every append is fsynced before it returns
+        """
+        self.path = path
+        self.filter_class = filter_class
+        self.fsync = fsync
+        self.log_path = path + LOG_SUFFIX
+        self.compacting_path = path + COMPACTING_SUFFIX
+        self.lock_path = path + LOCK_SUFFIX
+        self.compact_lock_path = path + COMPACT_LOCK_SUFFIX
+
+    def paths(self):
+        """Return the files the filter is loaded from, logs first."""
+        return [self.log_path, self.compacting_path, self.path]
+
+    def append(self, key):
+        """Log `key' as added to the filter."""
+        self.append_many([key])
+
+    def append_many(self, keys):
+        """Log every key in `keys' with a single write. Returns the
+        offsets in the log at which the records start and end."""
+        records = b''.join(_encode_record(key) for key in keys)
+        with _locked(self.lock_path):
+            with open(self.log_path, 'ab') as f:
+                f.seek(0, os.SEEK_END)
+                start = f.tell()
+                f.write(records)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+        return start, start + len(records)
+
+    def log_size(self):
+        """Return the number of bytes logged and not yet compacted."""
+        size = 0
+        for path in (self.log_path, self.compacting_path):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def load(self, mmap=False, lazy=False):
+        """Return the snapshot with the logged keys added. Raises
+        FileNotFoundError (IOError on Python 2) if there is neither a
+        snapshot nor a log. `mmap' is passed on to ``fromfile'' if nothing
+        is logged; a filter with keys to replay must be writable. `lazy',
+        for scalable filters, is passed on as well."""
+        keys = read_log(self.log_path) + read_log(self.compacting_path)
+        options = {'lazy': True} if lazy else {}
+        try:
+            with open(self.path, 'rb') as f:
+                filter = self.filter_class.fromfile(f, mmap=mmap and not keys,
+                                                    **options)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            if not (os.path.exists(self.log_path) or
+                    os.path.exists(self.compacting_path)):
+                raise
+            filter = self.filter_class()
+        for key in keys:
+            filter.add(key)
+        return filter
+
+    def delete(self):
+        """Remove the snapshot, the logs and the lock files of the filter,
+        so ``load'' raises FileNotFoundError again. A running compaction
+        is waited for, so it can not publish the filter back."""
+        with _locked(self.compact_lock_path):
+            with _locked(self.lock_path):
+                for path in (self.log_path, self.compacting_path, self.path,
+                             self.lock_path):
+                    _remove(path)
+            _remove(self.compact_lock_path)
+
+    @contextmanager
+    def compact_lock(self):
+        """Hold the lock compactions of the filter take, waiting for a
+        running one. Writers of the snapshot other than ``compact'', such
+        as bulk imports, must hold it from loading the filter to publishing
+        it, or a compaction may publish the old filter over theirs."""
+        with _locked(self.compact_lock_path):
+            yield
+
+    def compact(self, lock_held=False):
+        """Fold the log into a new snapshot. Returns False without doing
+        anything if another compaction of this filter is running, or if
+        nothing is logged. `lock_held' if the caller holds
+        ``compact_lock'' already."""
+        if lock_held:
+            return self._compact()
+        with _locked(self.compact_lock_path, blocking=False) as acquired:
+            if not acquired:
+                return False
+            return self._compact()
+
+    def _compact(self):
+        # A leftover .compacting log means an earlier compaction was
+        # interrupted; fold it before taking the current log.
+        if not os.path.exists(self.compacting_path):
+            with _locked(self.lock_path):
+                if not os.path.exists(self.log_path):
+                    return False
+                os.replace(self.log_path, self.compacting_path)
+        keys = read_log(self.compacting_path)
+        try:
+            with open(self.path, 'rb') as f:
+                filter = self.filter_class.fromfile(f)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            filter = self.filter_class()
+        for key in keys:
+            filter.add(key)
+        publish(filter, self.path)
+        os.remove(self.compacting_path)
+        return True
+
+
+class JournalCompactor(threading.Thread):
+    def __init__(self, paths, interval=60, min_log_bytes=0,
+                 filter_class=ScalableBloomFilter):
+        """Compacts the journals of the snapshots `paths' in the background
+        every `interval' seconds, once at least `min_log_bytes' are logged.
+        Call ``stop'' to end it."""
+        super(JournalCompactor, self).__init__(name='journal-compactor')
+        self.daemon = True
+        self.journals = [FilterJournal(path, filter_class) for path in paths]
+        self.interval = interval
+        self.min_log_bytes = min_log_bytes
+        self.compactions = 0
+        self._stopped = threading.Event()
+
+    def compact_all(self):
+        for journal in self.journals:
+            if journal.log_size() > self.min_log_bytes or \
+                    os.path.exists(journal.compacting_path):
+                if journal.compact():
+                    self.compactions += 1
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.compact_all()
+            except (IOError, OSError) as e:
+                sys.stderr.write('journal compaction failed: %s\n' % e)
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self.join(timeout)
+
+
+if __name__ == '__main__':
+    # Compact the journals of the snapshots named on the command line.
+    for path in sys.argv[1:]:
+        FilterJournal(path).compact()
@@ -0,0 +1,279 @@
+"""This module implements a FilterManager, a cache of filters loaded from
+disk that is bounded by a byte budget and evicts the least recently used
+filters first, and a FilterWatcher, which reloads cached filters whose
+files changed in the background.
+
+Filter files are replaced atomically (see ``journal.publish''), so a
+filter is reloaded from a complete file, and lookups running on the
+filter it replaces finish on it undisturbed.
+"""
+from __future__ import absolute_import
+
+import errno
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from pybloom_live.journal import FilterJournal
+from pybloom_live.pybloom import ScalableBloomFilter
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class FilterManager(object):
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES,
+                 filter_class=ScalableBloomFilter, mmap=False, journaled=False,
+                 op_counters=False, lazy=False, revalidate=True):
+        """Keeps filters loaded from files, keyed by path
+
+        max_bytes
+            the budget for all cached filters, counted as the size of the
+            files they were loaded from. Least recently used filters are
+            evicted to stay within it; a filter larger than the budget is
+            loaded but not cached.
+        filter_class
+            the class whose ``fromfile'' loads the files
+        mmap
+            passed on to ``fromfile''
+        lazy
+            passed on to the ``fromfile'' of scalable filters, which then
+            load their sub-filters when lookups first reach them
+        journaled
+            load the files through a FilterJournal, replaying their logs.
+            Appending to a log then also reloads the filter.
+        op_counters
+            call ``enable_op_counters'' on every filter loaded, so that
+            their ``stats'' count lookups. A reloaded filter starts from
+            zero again.
+        revalidate
+            whether ``get'' checks the files of a cached filter and reloads
+            it if they changed. Without, changed filters are only reloaded
+            by ``refresh'', e.g. from a FilterWatcher, so lookups never
+            wait for a load but may see a filter a refresh interval old.
+        """
+        if max_bytes < 0:
+            raise ValueError("max_bytes must be >= 0")
+        self.max_bytes = max_bytes
+        self.filter_class = filter_class
+        self.mmap = mmap
+        self.journaled = journaled
+        self.op_counters = op_counters
+        self.lazy = lazy
+        self.revalidate = revalidate
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+        self._entries = OrderedDict()  # path -> (stamp, nbytes, filter)
+        self._lock = threading.Lock()
+        self._add_locks = {}  # path -> lock serializing ``add_many''
+
+    def get(self, path):
+        """Return the filter stored at `path', loading it unless a filter
+        loaded from the same file (same mtime and size) is cached. Raises
+        the OSError of a missing or unreadable file. Without `revalidate'
+        any cached filter is returned.
+        """
+        stamp = size = None
+        if self.revalidate:
+            stamp, size = self._stamp(path)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                if stamp is None or entry[0] == stamp:
+                    self._entries[path] = entry
+                    self.hits += 1
+                    return entry[2]
+                self.nbytes -= entry[1]
+            self.misses += 1
+        if stamp is None:
+            stamp, size = self._stamp(path)
+        filter = self._load(path)
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            if size <= self.max_bytes:
+                self._entries[path] = (stamp, size, filter)
+                self.nbytes += size
+                self._evict()
+        return filter
+
+    def _stamp(self, path):
+        if not self.journaled:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size), st.st_size
+        stamp = []
+        for file_path in FilterJournal(path).paths():
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_mtime_ns, st.st_size))
+        if not any(stamp):
+            os.stat(path)  # raise for the missing snapshot
+        return tuple(stamp), sum(s[1] for s in stamp if s)
+
+    def _load(self, path):
+        if self.journaled:
+            filter = FilterJournal(path, self.filter_class).load(
+                mmap=self.mmap, lazy=self.lazy)
+        else:
+            options = {'lazy': True} if self.lazy else {}
+            with open(path, 'rb') as f:
+                filter = self.filter_class.fromfile(f, mmap=self.mmap,
+                                                    **options)
+        if self.op_counters:
+            filter.enable_op_counters()
+        return filter
+
+    def refresh(self, path):
+        """Reload the filter cached for `path' if its files changed since
+        it was loaded, then swap it in. Until then ``get'' returns the
+        cached filter. A filter whose files are gone is dropped. Returns
+        whether the filter was reloaded."""
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None:
+            return False
+        try:
+            stamp, size = self._stamp(path)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            with self._lock:
+                if self._entries.get(path) is entry:
+                    del self._entries[path]
+                    self.nbytes -= entry[1]
+            return False
+        if stamp == entry[0]:
+            return False
+        filter = self._load(path)
+        with self._lock:
+            # Unless ``get'' reloaded or evicted it meanwhile.
+            if self._entries.get(path) is not entry:
+                return False
+            self._entries[path] = (stamp, size, filter)
+            self.nbytes += size - entry[1]
+            self.reloads += 1
+            self._evict()
+        return True
+
+    def add_many(self, path, keys):
+        """Log every key in `keys' to the journal of the snapshot `path'
+        and add them to the filter cached for it, instead of reloading it.
+        If anything else changed the journal since the filter was loaded,
+        it is left to ``get'' or ``refresh'' to reload. Needs a journaled
+        manager without `mmap', whose filters can be added to. Calls for
+        the same path run one at a time, since filters are not safe for
+        concurrent adds."""
+        if not self.journaled or self.mmap:
+            raise ValueError("Adding needs a journaled manager without mmap")
+        keys = list(keys)
+        with self._lock:
+            add_lock = self._add_locks.setdefault(path, threading.Lock())
+        with add_lock:
+            with self._lock:
+                entry = self._entries.get(path)
+            start, end = FilterJournal(path,
+                                       self.filter_class).append_many(keys)
+            if entry is None or (entry[0][0] or (0, 0))[1] != start:
+                return
+            entry[2].add_many(keys)
+            stamp, size = self._stamp(path)
+            with self._lock:
+                if self._entries.get(path) is entry and \
+                        stamp[1:] == entry[0][1:] and stamp[0][1] == end:
+                    self._entries[path] = (stamp, size, entry[2])
+                    self.nbytes += size - entry[1]
+                    self._evict()
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            _, (_, nbytes, _) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+    def invalidate(self, path):
+        """Drop the filter cached for `path', if any."""
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.nbytes -= entry[1]
+
+    def clear(self):
+        """Drop every cached filter."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def filters(self):
+        """Return a dict of the cached filters, keyed by path."""
+        with self._lock:
+            return dict((path, entry[2])
+                        for path, entry in self._entries.items())
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return the cache statistics as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'reloads': self.reloads,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            }
+
+
+class FilterWatcher(threading.Thread):
+    def __init__(self, managers, interval=1.0):
+        """Refreshes the filters cached by every FilterManager in
+        `managers' every `interval' seconds, so that long-running readers
+        pick up published filters and logged keys without ever waiting for
+        a load. While it runs the managers do not ``revalidate''. Call
+        ``stop'' to end it."""
+        super(FilterWatcher, self).__init__(name='filter-watcher')
+        self.daemon = True
+        self.managers = list(managers)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def refresh_all(self):
+        """Refresh every cached filter once. Returns the number reloaded."""
+        reloaded = 0
+        for manager in self.managers:
+            for path in manager.filters():
+                try:
+                    reloaded += manager.refresh(path)
+                except (IOError, OSError, ValueError) as e:
+                    # Keep serving the filter loaded last.
+                    sys.stderr.write('reloading %s failed: %s\n' % (path, e))
+        return reloaded
+
+    def start(self):
+        for manager in self.managers:
+            manager.revalidate = False
+        super(FilterWatcher, self).start()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.refresh_all()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self.join(timeout)
+        for manager in self.managers:
+            manager.revalidate = True
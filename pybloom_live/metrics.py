@@ -0,0 +1,92 @@
+"""This module exports the ``stats'' of filters in the Prometheus text
+exposition format, so that a filter whose estimated false positive rate
+drifts above its error rate can be alerted on.
+
+Every filter is labelled by name; sub-filters of a ScalableBloomFilter
+are additionally labelled by their position, oldest first.
+"""
+from __future__ import absolute_import
+
+DEFAULT_PREFIX = 'pybloom'
+
+# stats() key, metric name, type, help
+FILTER_METRICS = (
+    ('capacity', 'capacity', 'gauge', 'Keys the filter is sized for.'),
+    ('count', 'keys', 'gauge', 'Keys added to the filter.'),
+    ('error_rate', 'error_rate', 'gauge', 'False positive rate the filter '
+                                          'is sized for.'),
+    ('estimated_fpr', 'estimated_fpr', 'gauge', 'False positive rate given '
+                                                'the bits set now.'),
+    ('num_bits', 'bits', 'gauge', 'Bits in the filter.'),
+    ('bits_set', 'bits_set', 'gauge', 'Bits set in the filter.'),
+    ('fill_ratio', 'fill_ratio', 'gauge', 'Fraction of the bits set.'),
+    ('filters', 'sub_filters', 'gauge', 'Sub-filters of a scalable filter.'),
+    ('lookups', 'lookups_total', 'counter', 'Lookups made.'),
+    ('hits', 'hits_total', 'counter', 'Lookups that found the key.'),
+    ('inserts', 'inserts_total', 'counter', 'Keys added.'),
+    ('probes', 'probes_total', 'counter', 'Sub-filter lookups made by '
+                                          'lookups and inserts.'),
+    ('hash_seconds', 'hash_seconds_total', 'counter', 'Time spent hashing.'),
+)
+SUB_FILTER_METRICS = (
+    ('capacity', 'sub_filter_capacity', 'gauge', 'Keys the sub-filter is '
+                                                 'sized for.'),
+    ('count', 'sub_filter_keys', 'gauge', 'Keys added to the sub-filter.'),
+    ('num_bits', 'sub_filter_bits', 'gauge', 'Bits in the sub-filter.'),
+    ('fill_ratio', 'sub_filter_fill_ratio', 'gauge', 'Fraction of the '
+                                                     'sub-filter bits set.'),
+    ('estimated_fpr', 'sub_filter_estimated_fpr', 'gauge', 'False positive '
+                                                           'rate of the '
+                                                           'sub-filter.'),
+    ('lookups', 'sub_filter_lookups_total', 'counter', 'Lookups of the '
+                                                       'sub-filter.'),
+    ('hits', 'sub_filter_hits_total', 'counter', 'Lookups the sub-filter '
+                                                 'answered.'),
+)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in labels)
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+def _emit(lines, prefix, table, samples):
+    """Append the samples, a list of (labels, stats) pairs, of every metric
+    in `table' that any of them has."""
+    for key, name, kind, help in table:
+        rows = [(labels, stats[key]) for labels, stats in samples
+                if key in stats]
+        if not rows:
+            continue
+        lines.append('# HELP %s_%s %s' % (prefix, name, help))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+        for labels, value in rows:
+            lines.append('%s_%s%s %s' % (prefix, name, _labels(labels),
+                                          _format(value)))
+
+
+def prometheus_text(filters, prefix=DEFAULT_PREFIX):
+    """Return the stats of `filters', a mapping of names to filters or to
+    the dicts their ``stats'' returned, in the Prometheus text format."""
+    samples = []
+    sub_samples = []
+    for name, filter in sorted(filters.items()):
+        stats = filter if isinstance(filter, dict) else filter.stats()
+        samples.append(((('filter', name),), stats))
+        for index, sub in enumerate(stats.get('sub_filters', ())):
+            sub_samples.append(((('filter', name), ('index', index)), sub))
+    lines = []
+    _emit(lines, prefix, FILTER_METRICS, samples)
+    _emit(lines, prefix, SUB_FILTER_METRICS, sub_samples)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,115 @@
+"""This module builds filters in parallel. The key stream is split into
+chunks that worker processes hash into shards, bloom filters with the
+parameters of the target filter, and the shards are ORed into the target
+as they come back. Setting bits commutes, so the result has the same bits
+as adding every key in one process.
+
+Counts are summed over shards, so a key sent to two shards, or already in
+an older sub-filter of a ScalableBloomFilter, is counted twice; membership
+is unaffected.
+"""
+from __future__ import absolute_import
+
+import itertools
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy
+
+from pybloom_live.pybloom import BloomFilter, ScalableBloomFilter
+
+
+def _build_shard(filter_class, capacity, error_rate, hash_mode, keys):
+    shard = filter_class(capacity, error_rate, hash_mode=hash_mode)
+    shard.add_many(keys)
+    return shard.bitarray.tobytes(), shard.count
+
+
+def _merge_shard(filter, result):
+    data, count = result
+    bits = numpy.frombuffer(filter.bitarray, dtype=numpy.uint8)
+    numpy.bitwise_or(bits, numpy.frombuffer(data, dtype=numpy.uint8),
+                     out=bits)
+    filter.count += count
+
+
+def _peek(keys):
+    """Return an iterator over `keys', or None if there are none left."""
+    first = list(itertools.islice(keys, 1))
+    return itertools.chain(first, keys) if first else None
+
+
+def _fill(filter, keys, executor, workers, chunk_size):
+    """Add keys from the iterator `keys' to the bloom filter `filter' until
+    it is at capacity or `keys' runs out. Returns an iterator over the keys
+    left, or None if there are none."""
+    room = filter.capacity - filter.count
+    if chunk_size is None:
+        chunk_size = max(1, -(-room // workers))
+    pending = set()
+    while True:
+        chunk = list(itertools.islice(keys, min(chunk_size, room)))
+        if not chunk:
+            break
+        room -= len(chunk)
+        pending.add(executor.submit(
+            _build_shard, type(filter), filter.capacity, filter.error_rate,
+            filter.hash_mode, chunk))
+        # Bound the keys and shards in flight.
+        while len(pending) >= 2 * workers:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                _merge_shard(filter, future.result())
+    for future in pending:
+        _merge_shard(filter, future.result())
+    return _peek(keys)
+
+
+def parallel_add(filter, keys, workers=None, chunk_size=None, executor=None):
+    """Adds every key in the iterable `keys' to `filter', a BloomFilter or
+    a ScalableBloomFilter, hashing them in a process pool. Keys must be
+    picklable. Returns `filter'.
+
+    workers
+        the number of processes, os.cpu_count() by default
+    chunk_size
+        the number of keys per shard. By default the room left in the
+        filter is split evenly over the workers, so each filter is built
+        from about one shard per worker.
+    executor
+        a concurrent.futures executor to use instead of a new process pool
+
+    Raises IndexError if a BloomFilter runs out of capacity; the keys added
+    until then are kept. A ScalableBloomFilter fills its newest sub-filter
+    and adds larger ones as ``add'' does.
+    """
+    workers = workers or os.cpu_count() or 1
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(workers)
+    try:
+        keys = _peek(iter(keys))
+        if keys is None:
+            pass
+        elif isinstance(filter, ScalableBloomFilter):
+            while keys is not None:
+                keys = _fill(filter._filter_for_insert(), keys, executor,
+                             workers, chunk_size)
+        elif _fill(filter, keys, executor, workers, chunk_size) is not None:
+            raise IndexError("BloomFilter is at capacity")
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return filter
+
+
+def build_parallel(keys, capacity, error_rate=0.001, hash_mode=None,
+                   filter_class=BloomFilter, **kwargs):
+    """Return a new `filter_class' of `capacity' and `error_rate' holding
+    every key in `keys', built with ``parallel_add''. `hash_mode' defaults
+    to the class' default."""
+    if hash_mode is None:
+        filter = filter_class(capacity, error_rate)
+    else:
+        filter = filter_class(capacity, error_rate, hash_mode=hash_mode)
+    return parallel_add(filter, keys, **kwargs)
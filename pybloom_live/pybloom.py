@@ -6,20 +6,87 @@ from __future__ import absolute_import
 
 import copy
 import hashlib
+import io
 import math
-from struct import calcsize, pack, unpack
+import mmap
+import os
+import zlib
+from struct import calcsize, pack, unpack, unpack_from
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
 
 import xxhash
 
-from pybloom_live.utils import is_string_io, range_fn, running_python_3
+from pybloom_live.utils import chunked, range_fn, running_python_3
 
 try:
     import bitarray
 except ImportError:
     raise ImportError('pybloom_live requires bitarray >= 0.3.4')
 
+try:
+    import numpy
+except ImportError:
+    raise ImportError('pybloom_live requires numpy')
+
+# Index derivation schemes. SALTED_HASHING is the original scheme: one
+# salted digest per group of slices, switching to sha* for wide filters.
+# DOUBLE_HASHING derives all k indices from a single 128-bit xxhash as
+# h1 + i * h2 (Kirsch-Mitzenmacher).
+SALTED_HASHING = 0
+DOUBLE_HASHING = 1
+HASH_MODES = (SALTED_HASHING, DOUBLE_HASHING)
+# Mode byte of BlockedBloomFilter headers, see pybloom_live.blocked.
+BLOCKED_HASHING = 2
+# Mode byte of CuckooFilter headers, see pybloom_live.cuckoo.
+CUCKOO_HASHING = 3
+# Mode byte of BinaryFuseFilter headers, see pybloom_live.fuse.
+FUSE_HASHING = 4
+# Set in the mode byte of CountingBloomFilter headers, see
+# pybloom_live.counting.
+COUNTING_FLAG = 0x80
+# Set in the mode byte of filters written with ``tofile(f, compress=True)''
+# whose bits are encoded; an encoding byte follows the header.
+ENCODED_FLAG = 0x40
+# Encodings: the gaps between set bits as 16 or 32-bit integers, or the raw
+# bits deflated. Sparse bits are written as gaps, moderately filled bits
+# deflated, and bits filled more than ZLIB_MAX_FILL raw, as deflating them
+# saves little.
+ENCODING_SPARSE16 = 1
+ENCODING_SPARSE32 = 2
+ENCODING_ZLIB = 3
+SPARSE_MAX_FILL = 1.0 / 256
+ZLIB_MAX_FILL = 0.35
+# Filter bits are close to random, on which higher levels deflate little
+# better at several times the cost.
+ZLIB_LEVEL = 1
+DECODE_CHUNK = 1 << 20
 
-def make_hashfuncs(num_slices, num_bits):
+# Prefix of serialized headers that record a hash mode. No legacy header
+# starts with it: read as the error rate leading a `<dQQQQ' header it is
+# about -6.5e305, outside (0, 1), and as the scale leading a `<idQd'
+# ScalableBloomFilter header it is 1818392944, where legacy files hold the
+# growth factor 2 or 4. So files without it load with SALTED_HASHING.
+FILE_MAGIC = b'pybloom\xff'
+MASK64 = (1 << 64) - 1
+# Most buffers a single writev(2) accepts on Linux and the BSDs.
+IOV_MAX = 1024
+
+
+def _key_to_bytes(key):
+    if running_python_3:
+        if isinstance(key, str):
+            return key.encode('utf-8')
+        return str(key).encode('utf-8')
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    return str(key)
+
+
+def _hash_params(num_slices, num_bits):
     if num_bits >= (1 << 31):
         fmt_code, chunk_size = 'Q', 8
     elif num_bits >= (1 << 15):
@@ -43,18 +110,38 @@ def make_hashfuncs(num_slices, num_bits):
     if extra:
         num_salts += 1
     salts = tuple(hashfn(hashfn(pack('I', i)).digest()) for i in range_fn(0, num_salts))
+    return fmt, hashfn, salts
+
 
+def _make_double_hashfuncs(num_slices, num_bits):
     def _hash_maker(key):
-        if running_python_3:
-            if isinstance(key, str):
-                key = key.encode('utf-8')
-            else:
-                key = str(key).encode('utf-8')
-        else:
-            if isinstance(key, unicode):
-                key = key.encode('utf-8')
-            else:
-                key = str(key)
+        h1, h2 = unpack('<QQ', xxhash.xxh128_digest(_key_to_bytes(key)))
+        for i in range_fn(0, num_slices):
+            yield ((h1 + i * h2) & MASK64) % num_bits
+
+    return _hash_maker, xxhash.xxh128
+
+
+def _make_double_batch_hashfuncs(num_slices, num_bits):
+    slices = numpy.arange(num_slices, dtype=numpy.uint64)
+
+    def _hash_many(keys):
+        digests = b''.join(xxhash.xxh128_digest(_key_to_bytes(key))
+                           for key in keys)
+        hashes = numpy.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+        # uint64 arithmetic wraps just like the & MASK64 above.
+        return (hashes[:, :1] + slices * hashes[:, 1:]) % numpy.uint64(num_bits)
+
+    return _hash_many
+
+
+def make_hashfuncs(num_slices, num_bits, hash_mode=SALTED_HASHING):
+    if hash_mode == DOUBLE_HASHING:
+        return _make_double_hashfuncs(num_slices, num_bits)
+    fmt, hashfn, salts = _hash_params(num_slices, num_bits)
+
+    def _hash_maker(key):
+        key = _key_to_bytes(key)
         i = 0
         for salt in salts:
             h = salt.copy()
@@ -68,10 +155,307 @@ def make_hashfuncs(num_slices, num_bits):
     return _hash_maker, hashfn
 
 
+def make_batch_hashfuncs(num_slices, num_bits, hash_mode=SALTED_HASHING):
+    """Like ``make_hashfuncs'' but hashes a whole sequence of keys at once.
+
+    The returned function maps a list of n keys to an (n, num_slices)
+    array holding the same per-slice offsets ``make_hashfuncs'' yields."""
+    if hash_mode == DOUBLE_HASHING:
+        return _make_double_batch_hashfuncs(num_slices, num_bits)
+    fmt, hashfn, salts = _hash_params(num_slices, num_bits)
+    dtype = numpy.dtype(fmt[0])
+    width = len(salts) * len(fmt)
+
+    def _hash_many(keys):
+        digests = []
+        for key in keys:
+            key = _key_to_bytes(key)
+            for salt in salts:
+                h = salt.copy()
+                h.update(key)
+                digests.append(h.digest())
+        hashes = numpy.frombuffer(b''.join(digests), dtype=dtype)
+        hashes = hashes.reshape(-1, width)[:, :num_slices]
+        return hashes.astype(numpy.uint64) % numpy.uint64(num_bits)
+
+    return _hash_many
+
+
+def _map_file(f):
+    """Return a read-only memoryview of the whole file behind `f'."""
+    return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _fileno(f):
+    """Return the descriptor of `f' if it is a file or pipe opened with
+    ``open'', whose bytes are the stream's, else None. Sockets and
+    compressors have descriptors too, but not of the bytes written."""
+    raw = getattr(f, 'raw', f)
+    if isinstance(raw, io.FileIO) and not raw.closed:
+        return raw.fileno()
+    return None
+
+
+def _mappable(f):
+    return _fileno(f) is not None and f.seekable()
+
+
+def _write_chunks(f, chunks):
+    """Write the buffers in `chunks' to the stream `f' in order, without
+    seeking. Files and pipes get them in as few ``os.writev'' calls as
+    possible, other streams one ``write'' per buffer."""
+    chunks = [memoryview(chunk).cast('B') for chunk in chunks]
+    fileno = _fileno(f)
+    if fileno is None or not hasattr(os, 'writev'):
+        for chunk in chunks:
+            f.write(chunk)
+        return
+    f.flush()
+    chunks = [chunk for chunk in chunks if len(chunk)]
+    i = 0
+    while i < len(chunks):
+        written = os.writev(fileno, chunks[i:i + IOV_MAX])
+        while i < len(chunks) and written >= len(chunks[i]):
+            written -= len(chunks[i])
+            i += 1
+        if written:
+            chunks[i] = chunks[i][written:]
+    if f.seekable():
+        # Buffered files cache their position; have them look it up.
+        f.seek(0, io.SEEK_CUR)
+
+
+def _readinto(f, buf):
+    """Fill the writable buffer `buf' from the stream `f' and return it,
+    reading again after the short reads of pipes and sockets. Raises
+    ValueError if the stream ends first."""
+    view = memoryview(buf).cast('B')
+    readinto = getattr(f, 'readinto', None)
+    offset = 0
+    while offset < len(view):
+        if readinto is not None:
+            read = readinto(view[offset:])
+        else:
+            data = f.read(len(view) - offset)
+            read = len(data)
+            view[offset:offset + read] = data
+        if not read:
+            raise ValueError('Unexpected end of stream!')
+        offset += read
+    return buf
+
+
+def _read_exactly(f, n):
+    return _readinto(f, bytearray(n))
+
+
+def _bit_chunks(bits):
+    """Return the bitarray `bits' as buffers of its bytes, sharing all but
+    a trailing partial byte, which is copied to clear its unused bits."""
+    whole = len(bits) // 8
+    chunks = [memoryview(bits)[:whole]]
+    if len(bits) % 8:
+        chunks.append(bits[whole * 8:].tobytes())
+    return chunks
+
+
+class KeyDigest(object):
+    """Digest material of one key, computed lazily and shared by every
+    filter that probes the key.
+
+    Filters of the same hash mode derive their indices from the same
+    digests: DOUBLE_HASHING filters from a single xxh128, SALTED_HASHING
+    filters from the salted digests of their hash function, whose salts
+    only depend on the salt number."""
+    __slots__ = ('key', '_double', '_salted')
+
+    def __init__(self, key):
+        self.key = _key_to_bytes(key)
+        self._double = None
+        self._salted = {}
+
+    def double(self):
+        """Return (h1, h2) of the key for DOUBLE_HASHING."""
+        if self._double is None:
+            self._double = unpack('<QQ', xxhash.xxh128_digest(self.key))
+        return self._double
+
+    def salted(self, hashfn, salts):
+        """Return the key's digests under `salts', all built by `hashfn'."""
+        digests = self._salted.setdefault(hashfn, [])
+        for salt in salts[len(digests):]:
+            h = salt.copy()
+            h.update(self.key)
+            digests.append(h.digest())
+        return digests
+
+
+def make_digest_hashfuncs(num_slices, num_bits, hash_mode=SALTED_HASHING):
+    """Like ``make_hashfuncs'' but the returned function takes a
+    ``KeyDigest'' rather than a key."""
+    if hash_mode == DOUBLE_HASHING:
+        def _hashes_from(digest):
+            h1, h2 = digest.double()
+            for i in range_fn(0, num_slices):
+                yield ((h1 + i * h2) & MASK64) % num_bits
+
+        return _hashes_from
+    fmt, hashfn, salts = _hash_params(num_slices, num_bits)
+
+    def _hashes_from(digest):
+        i = 0
+        for d in digest.salted(hashfn, salts):
+            for uint in unpack(fmt, d):
+                yield uint % num_bits
+                i += 1
+                if i >= num_slices:
+                    return
+
+    return _hashes_from
+
+
+class OpCounters(object):
+    """Counts of the operations on a filter, kept once
+    ``enable_op_counters'' is called on it. Lookups of sub-filters made by
+    a ScalableBloomFilter count as lookups of the sub-filter."""
+    __slots__ = ('lookups', 'hits', 'inserts', 'hash_seconds')
+
+    def __init__(self):
+        self.lookups = 0
+        self.hits = 0
+        self.inserts = 0
+        self.hash_seconds = 0.0
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+def _timed_hashfunc(fn, op_counters, materialize=True):
+    """Wrap the hash function `fn' to add the time it takes to
+    `op_counters'. Lazily computed hashes are computed up front."""
+    def _timed(arg):
+        start = clock()
+        hashes = list(fn(arg)) if materialize else fn(arg)
+        op_counters.hash_seconds += clock() - start
+        return hashes
+
+    return _timed
+
+
+def _set_positions(bits):
+    """Return the positions of the set bits of the bitarray `bits', in
+    order, as a numpy array."""
+    data = numpy.frombuffer(bits, dtype=numpy.uint8)
+    nonzero = numpy.flatnonzero(data)
+    rows, columns = numpy.nonzero(numpy.unpackbits(
+        data[nonzero].reshape(-1, 1), axis=1, bitorder='little'))
+    return nonzero[rows] * 8 + columns
+
+
+def _encode_bits(bits, num_bits):
+    """Return the encoding chosen for the bitarray `bits' by its fill
+    ratio and the encoded bytes, or (None, None) if it is to be written
+    raw."""
+    fill = bits.count(True) / float(num_bits)
+    if fill < SPARSE_MAX_FILL:
+        gaps = numpy.diff(_set_positions(bits), prepend=0)
+        max_gap = gaps.max() if len(gaps) else 0
+        if max_gap <= 0xFFFF:
+            return ENCODING_SPARSE16, gaps.astype('<u2').tobytes()
+        if max_gap <= 0xFFFFFFFF:
+            return ENCODING_SPARSE32, gaps.astype('<u4').tobytes()
+    if fill < ZLIB_MAX_FILL:
+        return ENCODING_ZLIB, zlib.compress(bits, ZLIB_LEVEL)
+    return None, None
+
+
+def _decode_bits(data, num_bits):
+    """Return a bitarray of `num_bits' bits, rounded up to whole bytes as
+    raw bits are, decoded from `data': an encoding byte and the bytes
+    ``_encode_bits'' returned. The bits are decoded in place, without an
+    intermediate copy of the whole bitarray."""
+    data = memoryview(data)
+    encoding, = unpack_from(b'<B', data)
+    data = data[1:]
+    nbytes = (num_bits + 7) // 8
+    bits = bitarray.bitarray(8 * nbytes, endian='little')
+    bits.setall(False)
+    if encoding in (ENCODING_SPARSE16, ENCODING_SPARSE32):
+        dtype = '<u2' if encoding == ENCODING_SPARSE16 else '<u4'
+        positions = numpy.cumsum(numpy.frombuffer(data, dtype=dtype),
+                                 dtype=numpy.int64)
+        if len(positions) and positions[-1] >= num_bits:
+            raise ValueError('Bit position out of range!')
+        masks = numpy.left_shift(1, positions & 7).astype(numpy.uint8)
+        numpy.bitwise_or.at(numpy.frombuffer(bits, dtype=numpy.uint8),
+                            positions >> 3, masks)
+    elif encoding == ENCODING_ZLIB:
+        out = memoryview(bits)
+        decompressor = zlib.decompressobj()
+        offset = 0
+        chunk = decompressor.decompress(data, DECODE_CHUNK)
+        while chunk:
+            if offset + len(chunk) > nbytes:
+                raise ValueError('Bit length mismatch!')
+            out[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+            chunk = decompressor.decompress(decompressor.unconsumed_tail,
+                                            DECODE_CHUNK)
+        if offset != nbytes or not decompressor.eof:
+            raise ValueError('Bit length mismatch!')
+    else:
+        raise ValueError('Unknown bit encoding %r' % encoding)
+    return bits
+
+
+def _pack_header(fmt, hash_mode, *values):
+    header = pack(fmt, *values)
+    if hash_mode != SALTED_HASHING:
+        header = FILE_MAGIC + pack(b'<B', hash_mode) + header
+    return header
+
+
+def _read_header(f, fmt):
+    """Read a header written by ``_pack_header'' from `f'. Returns the hash
+    mode, the unpacked `fmt' values and the number of bytes consumed."""
+    headerlen = calcsize(fmt)
+    head = _read_exactly(f, len(FILE_MAGIC))
+    if head == FILE_MAGIC:
+        hash_mode, = unpack(b'<B', _read_exactly(f, 1))
+        values = unpack(fmt, _read_exactly(f, headerlen))
+        return hash_mode, values, len(FILE_MAGIC) + 1 + headerlen
+    values = unpack(fmt, head + _read_exactly(f, headerlen - len(head)))
+    return SALTED_HASHING, values, headerlen
+
+
+def slice_params(capacity, error_rate):
+    """Return (num_slices, bits_per_slice) of a partitioned filter holding
+    `capacity' keys with at most `error_rate' false positives."""
+    if not (0 < error_rate < 1):
+        raise ValueError("Error_Rate must be between 0 and 1.")
+    if not capacity > 0:
+        raise ValueError("Capacity must be > 0")
+    # given M = num_bits, k = num_slices, P = error_rate, n = capacity
+    #       k = log2(1/P)
+    # solving for m = bits_per_slice
+    # n ~= M * ((ln(2) ** 2) / abs(ln(P)))
+    # n ~= (k * m) * ((ln(2) ** 2) / abs(ln(P)))
+    # m ~= n * abs(ln(P)) / (k * (ln(2) ** 2))
+    num_slices = int(math.ceil(math.log(1.0 / error_rate, 2)))
+    bits_per_slice = int(math.ceil(
+        (capacity * abs(math.log(error_rate))) /
+        (num_slices * (math.log(2) ** 2))))
+    return num_slices, bits_per_slice
+
+
 class BloomFilter(object):
     FILE_FMT = b'<dQQQQ'
+    SALTED_HASHING = SALTED_HASHING
+    DOUBLE_HASHING = DOUBLE_HASHING
+    HASH_MODES = HASH_MODES
+    op_counters = None
 
-    def __init__(self, capacity, error_rate=0.001):
+    def __init__(self, capacity, error_rate=0.001, hash_mode=SALTED_HASHING):
         """Implements a space-efficient probabilistic data structure
 
         capacity
@@ -82,37 +466,66 @@ class BloomFilter(object):
             the error_rate of the filter returning false positives. This
             determines the filters capacity. Inserting more than capacity
             elements greatly increases the chance of false positives.
+        hash_mode
+            can be either BloomFilter.SALTED_HASHING or
+            BloomFilter.DOUBLE_HASHING. DOUBLE_HASHING computes one xxhash
+            per key however many slices the filter has, but filters using
+            it can not be read by older versions of this module.
         """
-        if not (0 < error_rate < 1):
-            raise ValueError("Error_Rate must be between 0 and 1.")
-        if not capacity > 0:
-            raise ValueError("Capacity must be > 0")
-        # given M = num_bits, k = num_slices, P = error_rate, n = capacity
-        #       k = log2(1/P)
-        # solving for m = bits_per_slice
-        # n ~= M * ((ln(2) ** 2) / abs(ln(P)))
-        # n ~= (k * m) * ((ln(2) ** 2) / abs(ln(P)))
-        # m ~= n * abs(ln(P)) / (k * (ln(2) ** 2))
-        num_slices = int(math.ceil(math.log(1.0 / error_rate, 2)))
-        bits_per_slice = int(math.ceil(
-            (capacity * abs(math.log(error_rate))) /
-            (num_slices * (math.log(2) ** 2))))
-        self._setup(error_rate, num_slices, bits_per_slice, capacity, 0)
+        self._check_hash_mode(hash_mode)
+        num_slices, bits_per_slice = slice_params(capacity, error_rate)
+        self._setup(error_rate, num_slices, bits_per_slice, capacity, 0,
+                    hash_mode)
         self.bitarray = bitarray.bitarray(self.num_bits, endian='little')
         self.bitarray.setall(False)
 
-    def _setup(self, error_rate, num_slices, bits_per_slice, capacity, count):
+    @classmethod
+    def _check_hash_mode(cls, hash_mode):
+        if hash_mode not in cls.HASH_MODES:
+            raise ValueError("Unknown hash mode %r for %s" %
+                             (hash_mode, cls.__name__))
+
+    def _setup(self, error_rate, num_slices, bits_per_slice, capacity, count,
+               hash_mode=SALTED_HASHING):
         self.error_rate = error_rate
         self.num_slices = num_slices
         self.bits_per_slice = bits_per_slice
         self.capacity = capacity
         self.num_bits = num_slices * bits_per_slice
         self.count = count
-        self.make_hashes, self.hashfn = make_hashfuncs(self.num_slices, self.bits_per_slice)
+        self.hash_mode = hash_mode
+        self.op_counters = None
+        self._make_hashfuncs()
+
+    def _make_hashfuncs(self):
+        self.make_hashes, self.hashfn = make_hashfuncs(
+            self.num_slices, self.bits_per_slice, self.hash_mode)
+        self.make_hashes_many = make_batch_hashfuncs(
+            self.num_slices, self.bits_per_slice, self.hash_mode)
+        self.hashes_from_digest = make_digest_hashfuncs(
+            self.num_slices, self.bits_per_slice, self.hash_mode)
+
+    def enable_op_counters(self):
+        """Start counting lookups, hits, inserts and the time spent hashing
+        in ``op_counters''. Counting costs a little on every operation, so
+        it is off by default."""
+        if self.op_counters is None:
+            self.op_counters = OpCounters()
+            self._time_hashfuncs()
+
+    def _time_hashfuncs(self):
+        self.make_hashes = _timed_hashfunc(self.make_hashes, self.op_counters)
+        self.hashes_from_digest = _timed_hashfunc(self.hashes_from_digest,
+                                                  self.op_counters)
+        self.make_hashes_many = _timed_hashfunc(
+            self.make_hashes_many, self.op_counters, materialize=False)
 
     def __contains__(self, key):
         """Tests a key's membership in this bloom filter.
         """
+        op_counters = self.op_counters
+        if op_counters is not None:
+            op_counters.lookups += 1
         bits_per_slice = self.bits_per_slice
         bitarray = self.bitarray
         hashes = self.make_hashes(key)
@@ -121,6 +534,8 @@ class BloomFilter(object):
             if not bitarray[offset + k]:
                 return False
             offset += bits_per_slice
+        if op_counters is not None:
+            op_counters.hits += 1
         return True
 
     def __len__(self):
@@ -144,6 +559,8 @@ class BloomFilter(object):
             self.bitarray[offset + k] = True
             offset += bits_per_slice
 
+        if self.op_counters is not None:
+            self.op_counters.inserts += 1
         if skip_check:
             self.count += 1
             return False
@@ -152,11 +569,95 @@ class BloomFilter(object):
             return False
         else:
             return True
-    
+
+    def _contains_digest(self, digest):
+        """Like ``__contains__'' for a key's ``KeyDigest''."""
+        op_counters = self.op_counters
+        if op_counters is not None:
+            op_counters.lookups += 1
+        bits_per_slice = self.bits_per_slice
+        bitarray = self.bitarray
+        offset = 0
+        for k in self.hashes_from_digest(digest):
+            if not bitarray[offset + k]:
+                return False
+            offset += bits_per_slice
+        if op_counters is not None:
+            op_counters.hits += 1
+        return True
+
+    def _digest_positions(self, digest):
+        """Return the bit positions a key's ``KeyDigest'' maps to."""
+        bits_per_slice = self.bits_per_slice
+        return [i * bits_per_slice + k for i, k in
+                enumerate(self.hashes_from_digest(digest))]
+
+    def _bit_indices(self, keys):
+        """Return the absolute bit positions of `keys' as an (n, k) array."""
+        offsets = numpy.arange(self.num_slices, dtype=numpy.uint64)
+        offsets *= numpy.uint64(self.bits_per_slice)
+        return self.make_hashes_many(keys) + offsets
+
+    def _test_bits(self, indices):
+        bits = numpy.frombuffer(self.bitarray, dtype=numpy.uint8)
+        masks = numpy.left_shift(1, indices & 7).astype(numpy.uint8)
+        return (bits[indices >> 3] & masks).all(axis=-1)
+
+    def contains_many(self, keys, batch_size=4096):
+        """Tests the membership of every key in the iterable `keys'.
+        Returns a boolean numpy array in the order of `keys'.
+        """
+        results = [self._test_bits(self._bit_indices(batch))
+                   for batch in chunked(keys, batch_size)]
+        if not results:
+            return numpy.zeros(0, dtype=bool)
+        results = numpy.concatenate(results)
+        if self.op_counters is not None:
+            self.op_counters.lookups += len(results)
+            self.op_counters.hits += int(results.sum())
+        return results
+
+    def add_many(self, keys, skip_check=False, batch_size=4096):
+        """Adds every key in the iterable `keys' to this bloom filter.
+        Returns a boolean numpy array which is True for every key that
+        already existed in the filter, as ``add'' does for a single key.
+        Raises IndexError, leaving the filter untouched by that batch, if a
+        batch would take the filter past its capacity.
+        """
+        results = []
+        for batch in chunked(keys, batch_size):
+            indices = self._bit_indices(batch)
+            if skip_check:
+                found = numpy.zeros(len(batch), dtype=bool)
+                added = len(batch)
+            else:
+                found = self._test_bits(indices)
+                # Keys repeated within a batch are only new the first time.
+                new_rows = indices[~found]
+                _, first = numpy.unique(new_rows, axis=0, return_index=True)
+                repeated = numpy.ones(len(new_rows), dtype=bool)
+                repeated[first] = False
+                found[numpy.flatnonzero(~found)[repeated]] = True
+                added = len(first)
+            if self.count + added > self.capacity:
+                raise IndexError("BloomFilter is at capacity")
+            bits = numpy.frombuffer(self.bitarray, dtype=numpy.uint8)
+            indices = indices.ravel()
+            masks = numpy.left_shift(1, indices & 7).astype(numpy.uint8)
+            numpy.bitwise_or.at(bits, indices >> 3, masks)
+            self.count += added
+            if self.op_counters is not None:
+                self.op_counters.inserts += len(batch)
+            results.append(found)
+        if not results:
+            return numpy.zeros(0, dtype=bool)
+        return numpy.concatenate(results)
+
     def copy(self):
         """Return a copy of this bloom filter.
         """
-        new_filter = BloomFilter(self.capacity, self.error_rate)
+        new_filter = self.__class__(self.capacity, self.error_rate,
+                                    self.hash_mode)
         new_filter.bitarray = self.bitarray.copy()
         return new_filter
 
@@ -167,6 +668,9 @@ class BloomFilter(object):
                         self.error_rate != other.error_rate:
             raise ValueError(
                 "Unioning filters requires both filters to have both the same capacity and error rate")
+        if self.hash_mode != other.hash_mode:
+            raise ValueError(
+                "Unioning filters requires both filters to have the same hash mode")
         new_bloom = self.copy()
         new_bloom.bitarray = new_bloom.bitarray | other.bitarray
         return new_bloom
@@ -181,6 +685,9 @@ class BloomFilter(object):
                         self.error_rate != other.error_rate:
             raise ValueError(
                 "Intersecting filters requires both filters to have equal capacity and error rate")
+        if self.hash_mode != other.hash_mode:
+            raise ValueError(
+                "Intersecting filters requires both filters to have the same hash mode")
         new_bloom = self.copy()
         new_bloom.bitarray = new_bloom.bitarray & other.bitarray
         return new_bloom
@@ -188,56 +695,216 @@ class BloomFilter(object):
     def __and__(self, other):
         return self.intersection(other)
 
-    def tofile(self, f):
+    def tofile(self, f, compress=False):
         """Write the bloom filter to file object `f'. Underlying bits
         are written as machine values. This is much more space
-        efficient than pickling the object."""
-        f.write(pack(self.FILE_FMT, self.error_rate, self.num_slices,
-                     self.bits_per_slice, self.capacity, self.count))
-        (f.write(self.bitarray.tobytes()) if is_string_io(f)
-         else self.bitarray.tofile(f))
+        efficient than pickling the object. Filters using a hash mode
+        other than SALTED_HASHING are prefixed with FILE_MAGIC and the
+        mode.
+
+        With `compress' sparse bits are written as the gaps between set
+        bits and moderately filled bits deflated, with ENCODED_FLAG set in
+        the mode; bits filled too much to gain are written raw. Encoded
+        bits are decoded into memory when loaded, also with `mmap'.
+
+        The filter is written sequentially, so `f' can be a pipe, socket
+        or compressor."""
+        _write_chunks(f, self._chunks(compress))
+
+    def _chunks(self, compress=False):
+        """Return the buffers ``tofile'' writes, in order. Raw bits are not
+        copied."""
+        encoding, data = (_encode_bits(self.bitarray, self.num_bits)
+                          if compress else (None, None))
+        if encoding is not None:
+            return [_pack_header(self.FILE_FMT, ENCODED_FLAG | self.hash_mode,
+                                 self.error_rate, self.num_slices,
+                                 self.bits_per_slice, self.capacity,
+                                 self.count),
+                    pack(b'<B', encoding), data]
+        return [_pack_header(self.FILE_FMT, self.hash_mode, self.error_rate,
+                             self.num_slices, self.bits_per_slice,
+                             self.capacity, self.count)] + \
+            _bit_chunks(self.bitarray)
 
     @classmethod
-    def fromfile(cls, f, n=-1):
+    def fromfile(cls, f, n=-1, mmap=False):
         """Read a bloom filter from file-object `f' serialized with
-        ``BloomFilter.tofile''. If `n' > 0 read only so many bytes."""
+        ``BloomFilter.tofile''. If `n' > 0 read only so many bytes.
+
+        With `mmap' the bits are not read but backed by a read-only memory
+        map of the file (see ``frombuffer''), so the filter can not be
+        added to and the file must not be rewritten in place while it is
+        in use. Streams that can not be mapped are read as usual.
+
+        Raw bits are read straight into the new bitarray, and only as many
+        bytes as the header describes, so `f' can be a pipe or socket and
+        hold more after the filter. Encoded bits without `n' are read to
+        the end of `f'."""
         headerlen = calcsize(cls.FILE_FMT)
 
         if 0 < n < headerlen:
             raise ValueError('n too small!')
 
+        if mmap and _mappable(f):
+            view = _map_file(f)
+            start = f.tell()
+            end = start + n if n > 0 else len(view)
+            f.seek(end)
+            return cls.frombuffer(view[start:end])
+
         filter = cls(1)  # Bogus instantiation, we will `_setup'.
-        filter._setup(*unpack(cls.FILE_FMT, f.read(headerlen)))
-        filter.bitarray = bitarray.bitarray(endian='little')
-        if n > 0:
-            (filter.bitarray.frombytes(f.read(n - headerlen)) if is_string_io(f)
-             else filter.bitarray.fromfile(f, n - headerlen))
-        else:
-            (filter.bitarray.frombytes(f.read()) if is_string_io(f)
-             else filter.bitarray.fromfile(f))
-        if filter.num_bits != len(filter.bitarray) and \
-                (filter.num_bits + (8 - filter.num_bits % 8) != len(filter.bitarray)):
-            raise ValueError('Bit length mismatch!')
+        hash_mode, header, headerlen = _read_header(f, cls.FILE_FMT)
+        cls._check_hash_mode(hash_mode & ~ENCODED_FLAG)
+        filter._setup(*header, hash_mode=hash_mode & ~ENCODED_FLAG)
+        if hash_mode & ENCODED_FLAG:
+            filter.bitarray = _decode_bits(
+                _read_exactly(f, n - headerlen) if n > 0 else f.read(),
+                filter.num_bits)
+            return filter
+        size = n - headerlen if n > 0 else (filter.num_bits + 7) // 8
+        filter.bitarray = bitarray.bitarray(size * 8, endian='little')
+        filter._check_bit_length()
+        _readinto(f, filter.bitarray)
+        return filter
 
+    @classmethod
+    def frombuffer(cls, buf):
+        """Return a bloom filter over `buf', an object supporting the buffer
+        protocol that holds exactly one filter serialized with
+        ``BloomFilter.tofile''. The bits are not copied: the filter shares
+        memory with `buf' and is read-only if `buf' is. Encoded bits are
+        decoded into a new bitarray instead. Requires bitarray >= 2.3."""
+        buf = memoryview(buf)
+        head = buf[:len(FILE_MAGIC) + 1 + calcsize(cls.FILE_FMT)].tobytes()
+        filter = cls(1)  # Bogus instantiation, we will `_setup'.
+        hash_mode, header, headerlen = _read_header(io.BytesIO(head),
+                                                    cls.FILE_FMT)
+        cls._check_hash_mode(hash_mode & ~ENCODED_FLAG)
+        filter._setup(*header, hash_mode=hash_mode & ~ENCODED_FLAG)
+        if hash_mode & ENCODED_FLAG:
+            filter.bitarray = _decode_bits(buf[headerlen:], filter.num_bits)
+            return filter
+        filter.bitarray = bitarray.bitarray(buffer=buf[headerlen:],
+                                            endian='little')
+        filter._check_bit_length()
         return filter
 
+    def _check_bit_length(self):
+        if self.num_bits != len(self.bitarray) and \
+                (self.num_bits + (8 - self.num_bits % 8) != len(self.bitarray)):
+            raise ValueError('Bit length mismatch!')
+
+    def _estimated_fpr(self):
+        """Return the chance that a key never added tests present, given
+        the bits set now: the product of the fill ratios of the slices."""
+        bits_per_slice = self.bits_per_slice
+        fpr = 1.0
+        for i in range_fn(0, self.num_slices):
+            fpr *= self.bitarray.count(True, i * bits_per_slice,
+                                       (i + 1) * bits_per_slice)
+            fpr /= bits_per_slice
+        return fpr
+
+    def stats(self):
+        """Return a dict describing the size and fill of this filter, and
+        the ``op_counters'' if they are enabled. `estimated_fpr' is the
+        false positive rate the filter has now; above `error_rate' it is
+        holding more keys than it was sized for."""
+        bits_set = self.bitarray.count(True, 0, self.num_bits)
+        stats = {
+            'capacity': self.capacity,
+            'count': self.count,
+            'error_rate': self.error_rate,
+            'hash_mode': self.hash_mode,
+            'num_hashes': self.num_slices,
+            'num_bits': self.num_bits,
+            'bits_set': bits_set,
+            'fill_ratio': bits_set / float(self.num_bits),
+            'estimated_fpr': self._estimated_fpr(),
+        }
+        if self.op_counters is not None:
+            stats.update(self.op_counters.as_dict())
+        return stats
+
     def __getstate__(self):
         d = self.__dict__.copy()
         del d['make_hashes']
+        del d['make_hashes_many']
+        del d['hashes_from_digest']
         return d
 
     def __setstate__(self, d):
+        d.setdefault('hash_mode', SALTED_HASHING)
+        d.setdefault('op_counters', None)
         self.__dict__.update(d)
-        self.make_hashes, self.hashfn = make_hashfuncs(self.num_slices, self.bits_per_slice)
+        self._make_hashfuncs()
+        if self.op_counters is not None:
+            self._time_hashfuncs()
+
+
+class _LazyFilter(object):
+    """A sub-filter of a ScalableBloomFilter loaded with `lazy'. Only its
+    header is read; it loads itself from `buf' and takes its own place in
+    `filters' the first time anything but its size is asked of it."""
+
+    def __init__(self, filters, index, filter_class, buf, mmap):
+        self._filters = filters
+        self._index = index
+        self._filter_class = filter_class
+        self._buf = buf
+        self._mmap = mmap
+        self._op_counters = False
+        _, header, _ = _read_header(
+            io.BytesIO(buf[:len(FILE_MAGIC) + 1 +
+                           calcsize(filter_class.FILE_FMT)].tobytes()),
+            filter_class.FILE_FMT)
+        self._header = header
+
+    @property
+    def error_rate(self):
+        filter = self._filters[self._index]
+        return self._header[0] if filter is self else filter.error_rate
+
+    @property
+    def capacity(self):
+        filter = self._filters[self._index]
+        return self._header[3] if filter is self else filter.capacity
+
+    @property
+    def count(self):
+        filter = self._filters[self._index]
+        return self._header[4] if filter is self else filter.count
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def _load(self):
+        filter = self._filters[self._index]
+        if filter is self:
+            filter = (self._filter_class.frombuffer(self._buf) if self._mmap
+                      else self._filter_class.fromfile(
+                          io.BytesIO(self._buf), len(self._buf)))
+            if self._op_counters:
+                filter.enable_op_counters()
+            self._filters[self._index] = filter
+        return filter
+
+    def enable_op_counters(self):
+        self._op_counters = True
 
 
 class ScalableBloomFilter(object):
     SMALL_SET_GROWTH = 2  # slower, but takes up less memory
     LARGE_SET_GROWTH = 4  # faster, but takes up more memory faster
     FILE_FMT = '<idQd'
+    FILTER_CLASS = BloomFilter
+    op_counters = None
 
     def __init__(self, initial_capacity=100, error_rate=0.001,
-                 mode=LARGE_SET_GROWTH):
+                 mode=LARGE_SET_GROWTH, hash_mode=SALTED_HASHING):
         """Implements a space-efficient probabilistic data structure that
         grows as more items are added while maintaining a steady false
         positive rate
@@ -253,23 +920,36 @@ class ScalableBloomFilter(object):
             ScalableBloomFilter.LARGE_SET_GROWTH. SMALL_SET_GROWTH is slower
             but uses less memory. LARGE_SET_GROWTH is faster but consumes
             memory faster.
+        hash_mode
+            the hash mode of the underlying bloom filters, either
+            BloomFilter.SALTED_HASHING or BloomFilter.DOUBLE_HASHING.
         """
         if not error_rate or error_rate < 0:
             raise ValueError("Error_Rate must be a decimal less than 0.")
-        self._setup(mode, 0.9, initial_capacity, error_rate)
+        self.FILTER_CLASS._check_hash_mode(hash_mode)
+        self._setup(mode, 0.9, initial_capacity, error_rate, hash_mode)
         self.filters = []
 
-    def _setup(self, mode, ratio, initial_capacity, error_rate):
+    def _setup(self, mode, ratio, initial_capacity, error_rate,
+               hash_mode=SALTED_HASHING):
         self.scale = mode
         self.ratio = ratio
         self.initial_capacity = initial_capacity
         self.error_rate = error_rate
+        self.hash_mode = hash_mode
 
     def __contains__(self, key):
-        """Tests a key's membership in this bloom filter.
+        """Tests a key's membership in this bloom filter. The key is hashed
+        once and every sub-filter derives its indices from that digest.
         """
+        op_counters = self.op_counters
+        if op_counters is not None:
+            op_counters.lookups += 1
+        digest = KeyDigest(key)
         for f in reversed(self.filters):
-            if key in f:
+            if f._contains_digest(digest):
+                if op_counters is not None:
+                    op_counters.hits += 1
                 return True
         return False
 
@@ -278,22 +958,159 @@ class ScalableBloomFilter(object):
         If the key already exists in this filter it will return True.
         Otherwise False.
         """
-        if key in self:
-            return True
+        if self.op_counters is not None:
+            self.op_counters.inserts += 1
+        digest = KeyDigest(key)
+        positions = None
+        for f in reversed(self.filters):
+            if positions is None:
+                # The newest filter is where the key goes unless it is full,
+                # so keep its positions around for the insert.
+                positions = f._digest_positions(digest)
+                bitarray = f.bitarray
+                if all(bitarray[p] for p in positions):
+                    return True
+            elif f._contains_digest(digest):
+                return True
+        newest = self.filters[-1] if self.filters else None
+        filter = self._filter_for_insert()
+        if filter is not newest:
+            positions = filter._digest_positions(digest)
+        bitarray = filter.bitarray
+        for p in positions:
+            bitarray[p] = True
+        filter.count += 1
+        return False
+
+    def _filter_for_insert(self, grow=False):
+        """Return the newest filter, first adding a larger one if it is
+        full or `grow' is set."""
         if not self.filters:
-            filter = BloomFilter(
+            filter = self.FILTER_CLASS(
                 capacity=self.initial_capacity,
-                error_rate=self.error_rate * self.ratio)
+                error_rate=self.error_rate * self.ratio,
+                hash_mode=self.hash_mode)
             self.filters.append(filter)
         else:
             filter = self.filters[-1]
-            if filter.count >= filter.capacity:
-                filter = BloomFilter(
+            if isinstance(filter, _LazyFilter):
+                filter = filter._load()
+            if grow or filter.count >= filter.capacity:
+                filter = self.FILTER_CLASS(
                     capacity=filter.capacity * self.scale,
-                    error_rate=filter.error_rate * self.ratio)
+                    error_rate=filter.error_rate * self.ratio,
+                    hash_mode=self.hash_mode)
                 self.filters.append(filter)
-        filter.add(key, skip_check=True)
-        return False
+            else:
+                return filter
+        if self.op_counters is not None:
+            filter.enable_op_counters()
+        return filter
+
+    def enable_op_counters(self):
+        """Start counting lookups, hits and inserts in ``op_counters'', and
+        the lookups, hits and hashing time of every sub-filter in theirs.
+        """
+        if self.op_counters is None:
+            self.op_counters = OpCounters()
+            for f in self.filters:
+                f.enable_op_counters()
+
+    def stats(self):
+        """Return a dict describing this filter, with the stats of every
+        sub-filter, oldest first, under `sub_filters'. `estimated_fpr' is
+        the chance that any sub-filter reports a false positive. With
+        ``op_counters'' enabled, `probes' counts the sub-filter lookups
+        made, `hits_by_filter' which sub-filters lookups were answered by,
+        and `hash_seconds' the time the sub-filters spent hashing."""
+        filters = [f.stats() for f in self.filters]
+        num_bits = sum(f['num_bits'] for f in filters)
+        bits_set = sum(f['bits_set'] for f in filters)
+        no_fp = 1.0
+        for f in filters:
+            no_fp *= 1.0 - f['estimated_fpr']
+        stats = {
+            'capacity': self.capacity,
+            'count': len(self),
+            'error_rate': self.error_rate,
+            'hash_mode': self.hash_mode,
+            'mode': self.scale,
+            'filters': len(filters),
+            'num_bits': num_bits,
+            'bits_set': bits_set,
+            'fill_ratio': bits_set / float(num_bits) if num_bits else 0.0,
+            'estimated_fpr': 1.0 - no_fp,
+            'sub_filters': filters,
+        }
+        if self.op_counters is not None:
+            stats.update(self.op_counters.as_dict())
+            stats['probes'] = sum(f['lookups'] for f in filters)
+            stats['hits_by_filter'] = [f['hits'] for f in filters]
+            stats['hash_seconds'] = sum(f['hash_seconds'] for f in filters)
+        return stats
+
+    def contains_many(self, keys, batch_size=4096):
+        """Tests the membership of every key in the iterable `keys', as
+        ``BloomFilter.contains_many'' does. Returns a boolean numpy array in
+        the order of `keys'.
+        """
+        results = []
+        for batch in chunked(keys, batch_size):
+            found = numpy.zeros(len(batch), dtype=bool)
+            for f in reversed(self.filters):
+                rest = numpy.flatnonzero(~found)
+                if not len(rest):
+                    break
+                found[rest] = f.contains_many([batch[i] for i in rest],
+                                              batch_size)
+            results.append(found)
+        if not results:
+            return numpy.zeros(0, dtype=bool)
+        results = numpy.concatenate(results)
+        if self.op_counters is not None:
+            self.op_counters.lookups += len(results)
+            self.op_counters.hits += int(results.sum())
+        return results
+
+    def add_many(self, keys, batch_size=4096):
+        """Adds every key in the iterable `keys' to this bloom filter, a
+        batch at a time through ``BloomFilter.add_many''. Returns a boolean
+        numpy array which is True for every key that already existed in the
+        filter, as ``add'' does for a single key.
+        """
+        results = []
+        for batch in chunked(keys, batch_size):
+            if self.op_counters is not None:
+                self.op_counters.inserts += len(batch)
+            found = numpy.zeros(len(batch), dtype=bool)
+            # The newest filter is checked by its own add_many, unless it is
+            # full and the batch goes to a new one.
+            checked = self.filters[:-1]
+            if self.filters and \
+                    self.filters[-1].count >= self.filters[-1].capacity:
+                checked = self.filters
+            for f in checked:
+                rest = numpy.flatnonzero(~found)
+                found[rest] = f.contains_many([batch[i] for i in rest],
+                                              batch_size)
+            pending = numpy.flatnonzero(~found)
+            while len(pending):
+                filter = self._filter_for_insert()
+                take = pending[:filter.capacity - filter.count]
+                pending = pending[len(take):]
+                found[take] = filter.add_many([batch[i] for i in take],
+                                              batch_size=batch_size)
+                if len(pending) and filter.count >= filter.capacity:
+                    # The rest goes to a new filter; drop the keys this one
+                    # now holds.
+                    held = filter.contains_many([batch[i] for i in pending],
+                                                batch_size)
+                    found[pending[held]] = True
+                    pending = pending[~held]
+            results.append(found)
+        if not results:
+            return numpy.zeros(0, dtype=bool)
+        return numpy.concatenate(results)
 
     def union(self, other):
         """ Calculates the union of the underlying classic bloom filters and returns
@@ -304,6 +1121,9 @@ class ScalableBloomFilter(object):
                 self.error_rate != other.error_rate:
             raise ValueError("Unioning two scalable bloom filters requires \
             both filters to have both the same mode, initial capacity and error rate")
+        if self.hash_mode != other.hash_mode:
+            raise ValueError(
+                "Unioning two scalable bloom filters requires both filters to have the same hash mode")
         if len(self.filters) > len(other.filters):
             larger_sbf = copy.deepcopy(self)
             smaller_sbf = other
@@ -332,51 +1152,118 @@ class ScalableBloomFilter(object):
     def count(self):
         return len(self)
 
-    def tofile(self, f):
+    def tofile(self, f, compress=False):
         """Serialize this ScalableBloomFilter into the file-object
-        `f'."""
-        f.write(pack(self.FILE_FMT, self.scale, self.ratio,
-                     self.initial_capacity, self.error_rate))
-
-        # Write #-of-filters
-        f.write(pack(b'<l', len(self.filters)))
-
-        if len(self.filters) > 0:
-            # Then each filter directly, with a header describing
-            # their lengths.
-            headerpos = f.tell()
-            headerfmt = b'<' + b'Q' * (len(self.filters))
-            f.write(b'.' * calcsize(headerfmt))
-            filter_sizes = []
-            for filter in self.filters:
-                begin = f.tell()
-                filter.tofile(f)
-                filter_sizes.append(f.tell() - begin)
-
-            f.seek(headerpos)
-            f.write(pack(headerfmt, *filter_sizes))
+        `f'. `compress' is passed on to the ``tofile'' of every sub-filter,
+        which picks an encoding by its own fill ratio.
+
+        The sub-filters' lengths are known before they are written, so
+        the filter is written sequentially and `f' can be a pipe, socket
+        or compressor."""
+        _write_chunks(f, self._chunks(compress))
+
+    def _chunks(self, compress=False):
+        """Return the buffers ``tofile'' writes, in order: the header, the
+        number of sub-filters, a table of their lengths and each of them."""
+        filters = [filter._chunks(compress=compress)
+                   for filter in self.filters]
+        chunks = [_pack_header(self.FILE_FMT, self.hash_mode, self.scale,
+                               self.ratio, self.initial_capacity,
+                               self.error_rate),
+                  pack(b'<l', len(filters))]
+        if filters:
+            chunks.append(pack(b'<' + b'Q' * len(filters),
+                               *[sum(memoryview(chunk).nbytes
+                                     for chunk in filter_chunks)
+                                 for filter_chunks in filters]))
+            for filter_chunks in filters:
+                chunks.extend(filter_chunks)
+        return chunks
 
     @classmethod
-    def fromfile(cls, f):
-        """Deserialize the ScalableBloomFilter in file object `f'."""
+    def fromfile(cls, f, mmap=False, lazy=False):
+        """Deserialize the ScalableBloomFilter in file object `f'.
+
+        With `mmap' the file is mapped once and every sub-filter is backed
+        by its slice of the read-only map, as in ``BloomFilter.fromfile''.
+        Such a filter can be probed but not added to.
+
+        With `lazy' the file is mapped but only the headers of the
+        sub-filters are read. Each sub-filter is loaded from the map the
+        first time a probe reaches it: backed by the map with `mmap',
+        copied from it otherwise. Lookups mostly stop at the newest
+        sub-filter, so the older ones may never be loaded. Streams that can
+        not be mapped, such as pipes and sockets, are read as usual, one
+        sub-filter after the other."""
         filter = cls()
-        filter._setup(*unpack(cls.FILE_FMT, f.read(calcsize(cls.FILE_FMT))))
-        nfilters, = unpack(b'<l', f.read(calcsize(b'<l')))
+        hash_mode, header, _ = _read_header(f, cls.FILE_FMT)
+        cls.FILTER_CLASS._check_hash_mode(hash_mode)
+        filter._setup(*header, hash_mode=hash_mode)
+        nfilters, = unpack(b'<l', _read_exactly(f, calcsize(b'<l')))
         if nfilters > 0:
             header_fmt = b'<' + b'Q' * nfilters
-            bytes = f.read(calcsize(header_fmt))
+            bytes = _read_exactly(f, calcsize(header_fmt))
             filter_lengths = unpack(header_fmt, bytes)
-            for fl in filter_lengths:
-                filter.filters.append(BloomFilter.fromfile(f, fl))
+            if lazy and _mappable(f):
+                view = _map_file(f)
+                offset = f.tell()
+                for fl in filter_lengths:
+                    filter.filters.append(_LazyFilter(
+                        filter.filters, len(filter.filters),
+                        cls.FILTER_CLASS, view[offset:offset + fl], mmap))
+                    offset += fl
+                f.seek(offset)
+            elif mmap and _mappable(f):
+                view = _map_file(f)
+                offset = f.tell()
+                for fl in filter_lengths:
+                    filter.filters.append(
+                        cls.FILTER_CLASS.frombuffer(view[offset:offset + fl]))
+                    offset += fl
+                f.seek(offset)
+            else:
+                for fl in filter_lengths:
+                    filter.filters.append(cls.FILTER_CLASS.fromfile(f, fl))
         else:
             filter.filters = []
 
         return filter
 
+    @classmethod
+    def frombuffer(cls, buf):
+        """Return a ScalableBloomFilter over `buf', an object supporting the
+        buffer protocol that holds one filter serialized with
+        ``ScalableBloomFilter.tofile''. Sub-filters share memory with `buf'
+        as in ``BloomFilter.frombuffer''."""
+        buf = memoryview(buf)
+        headerlen = len(FILE_MAGIC) + 1 + calcsize(cls.FILE_FMT)
+        filter = cls()
+        hash_mode, header, offset = _read_header(
+            io.BytesIO(buf[:headerlen].tobytes()), cls.FILE_FMT)
+        cls.FILTER_CLASS._check_hash_mode(hash_mode)
+        filter._setup(*header, hash_mode=hash_mode)
+        nfilters, = unpack_from(b'<l', buf, offset)
+        offset += calcsize(b'<l')
+        if nfilters > 0:
+            header_fmt = b'<' + b'Q' * nfilters
+            filter_lengths = unpack_from(header_fmt, buf, offset)
+            offset += calcsize(header_fmt)
+            for fl in filter_lengths:
+                filter.filters.append(
+                    cls.FILTER_CLASS.frombuffer(buf[offset:offset + fl]))
+                offset += fl
+        return filter
+
     def __len__(self):
         """Returns the total number of elements stored in this SBF"""
         return sum(f.count for f in self.filters)
 
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        d['filters'] = [f._load() if isinstance(f, _LazyFilter) else f
+                        for f in self.filters]
+        return d
+
 
 if __name__ == "__main__":
     import doctest
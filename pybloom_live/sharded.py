@@ -0,0 +1,260 @@
+"""This module implements a ShardedBloomFilter, which partitions keys across
+shard filters by consistent hashing. Every shard is an ordinary filter in
+a file of its own, so a node can load and serve just the shards it owns
+while clients route keys with the ring alone.
+
+A directory of shards holds ``shard-<id>.blm'' files and a manifest naming
+the shards, the number of ring points per shard and the shard class. The
+manifest is replaced last, so readers never see it name a shard that has
+not been written yet.
+"""
+from __future__ import absolute_import
+
+import errno
+import json
+import os
+
+import numpy
+import xxhash
+
+from pybloom_live.journal import atomic_file, publish
+from pybloom_live.pybloom import ScalableBloomFilter, _key_to_bytes
+from pybloom_live.utils import chunked
+
+VNODES = 128  # ring points per shard
+ROUTING_SEED = 0x5EED  # keeps routing independent of the shards' hashes
+MANIFEST_NAME = 'shards.json'
+
+
+def route_hashes(keys):
+    """Return the 64-bit routing hashes of the keys in the list `keys' as
+    a uint64 numpy array."""
+    return numpy.fromiter(
+        (xxhash.xxh3_64_intdigest(_key_to_bytes(key), ROUTING_SEED)
+         for key in keys), dtype=numpy.uint64, count=len(keys))
+
+
+def shard_path(directory, shard_id):
+    return os.path.join(directory, 'shard-%d.blm' % shard_id)
+
+
+class HashRing(object):
+    def __init__(self, shard_ids, vnodes=VNODES):
+        """A consistent hash ring of `vnodes' points for every shard id in
+        `shard_ids'. Adding or removing a shard only moves the keys of the
+        ring arcs it gains or loses, about 1 / N of them."""
+        shard_ids = sorted(set(shard_ids))
+        if not shard_ids:
+            raise ValueError("A hash ring needs at least one shard")
+        points = sorted(
+            (xxhash.xxh3_64_intdigest(b'shard-%d-%d' % (shard_id, i),
+                                      ROUTING_SEED), shard_id)
+            for shard_id in shard_ids for i in range(vnodes))
+        self.shard_ids = shard_ids
+        self.vnodes = vnodes
+        self._points = numpy.array([p for p, _ in points], dtype=numpy.uint64)
+        self._owners = numpy.array([s for _, s in points], dtype=numpy.int64)
+
+    def shards_of_hashes(self, hashes):
+        """Return the shard id owning every routing hash in the uint64
+        numpy array `hashes': the first ring point at or after it."""
+        index = numpy.searchsorted(self._points, hashes, side='left')
+        return self._owners[index % len(self._points)]
+
+    def shard_of(self, key):
+        return int(self.shards_of_hashes(route_hashes([key]))[0])
+
+
+class ShardedBloomFilter(object):
+    def __init__(self, num_shards=4, filter_class=ScalableBloomFilter,
+                 vnodes=VNODES, **options):
+        """Partitions keys across `num_shards' filters by consistent hashing
+
+        filter_class
+            the class of the shards, a ScalableBloomFilter by default.
+            Every shard is created as ``filter_class(**options)'', so size
+            them for their share of the keys.
+        vnodes
+            the number of ring points per shard; more points spread the
+            keys more evenly.
+        """
+        if num_shards < 1:
+            raise ValueError("num_shards must be >= 1")
+        self.filter_class = filter_class
+        self.options = options
+        self.ring = HashRing(range(num_shards), vnodes)
+        self.shards = dict((shard_id, filter_class(**options))
+                           for shard_id in self.ring.shard_ids)
+
+    @property
+    def num_shards(self):
+        return len(self.ring.shard_ids)
+
+    def route(self, keys):
+        """Return the shard id of every key in the list `keys' as an int64
+        numpy array, for clients dispatching keys to the nodes serving the
+        shards."""
+        return self.ring.shards_of_hashes(route_hashes(keys))
+
+    def _shard(self, shard_id):
+        try:
+            return self.shards[shard_id]
+        except KeyError:
+            raise KeyError("Shard %d is not loaded" % shard_id)
+
+    def _by_shard(self, batch):
+        """Yield (shard id, indices into `batch') for every shard that
+        owns keys of `batch'."""
+        owners = self.route(batch)
+        order = numpy.argsort(owners, kind='stable')
+        shard_ids, starts = numpy.unique(owners[order], return_index=True)
+        for shard_id, indices in zip(shard_ids.tolist(),
+                                     numpy.split(order, starts[1:])):
+            yield shard_id, indices
+
+    def __contains__(self, key):
+        """Tests a key's membership in the shard that owns it. Raises
+        KeyError if that shard is not loaded."""
+        return key in self._shard(self.ring.shard_of(key))
+
+    def add(self, key):
+        """Adds a key to the shard that owns it. Returns True if the key
+        already existed there."""
+        return self._shard(self.ring.shard_of(key)).add(key)
+
+    def _many(self, method, keys, batch_size):
+        results = []
+        for batch in chunked(keys, batch_size):
+            found = numpy.zeros(len(batch), dtype=bool)
+            for shard_id, indices in self._by_shard(batch):
+                shard = self._shard(shard_id)
+                found[indices] = getattr(shard, method)(
+                    [batch[i] for i in indices], batch_size=batch_size)
+            results.append(found)
+        if not results:
+            return numpy.zeros(0, dtype=bool)
+        return numpy.concatenate(results)
+
+    def contains_many(self, keys, batch_size=4096):
+        """Tests the membership of every key in the iterable `keys', one
+        ``contains_many'' per shard and batch. Returns a boolean numpy array
+        in the order of `keys'."""
+        return self._many('contains_many', keys, batch_size)
+
+    def add_many(self, keys, batch_size=4096):
+        """Adds every key in the iterable `keys' to its shard, one
+        ``add_many'' per shard and batch. Returns a boolean numpy array
+        which is True for every key that already existed."""
+        return self._many('add_many', keys, batch_size)
+
+    def __len__(self):
+        """Return the number of keys in the loaded shards."""
+        return sum(len(shard) for shard in self.shards.values())
+
+    def stats(self):
+        """Return a dict describing the loaded shards, with the stats of
+        every loaded shard, in order of id, under `sub_filters'. `estimated_fpr' is the
+        mean of the shards', as every key is looked up in one shard."""
+        shards = [self.shards[shard_id].stats()
+                  for shard_id in sorted(self.shards)]
+        return {
+            'count': len(self),
+            'filters': len(shards),
+            'num_bits': sum(s.get('num_bits', 0) for s in shards),
+            'estimated_fpr': (sum(s['estimated_fpr'] for s in shards) /
+                              len(shards) if shards else 0.0),
+            'sub_filters': shards,
+        }
+
+    def rebalance(self, num_shards, keys, batch_size=4096):
+        """Repartition the keys across `num_shards' shards. Filters can not
+        list their keys, so `keys' must yield every key added, such as the
+        records they were imported from. Keys whose shard changes are added
+        to their new shard; shards past the new count are dropped. The bits
+        a key leaves behind in its old shard only add to that shard's false
+        positive rate. Returns the sorted ids of the shards that changed,
+        the only ones that need to be saved again."""
+        if num_shards < 1:
+            raise ValueError("num_shards must be >= 1")
+        missing = set(self.ring.shard_ids) - set(self.shards)
+        if missing:
+            raise ValueError("Rebalancing needs every shard loaded, "
+                             "missing %s" % sorted(missing))
+        old_ring = self.ring
+        self.ring = HashRing(range(num_shards), old_ring.vnodes)
+        for shard_id in self.ring.shard_ids:
+            if shard_id not in self.shards:
+                self.shards[shard_id] = self.filter_class(**self.options)
+        changed = set(self.ring.shard_ids) - set(old_ring.shard_ids)
+        for batch in chunked(keys, batch_size):
+            hashes = route_hashes(batch)
+            owners = self.ring.shards_of_hashes(hashes)
+            moved = numpy.flatnonzero(
+                owners != old_ring.shards_of_hashes(hashes))
+            for shard_id in numpy.unique(owners[moved]).tolist():
+                indices = moved[owners[moved] == shard_id]
+                self.shards[shard_id].add_many([batch[i] for i in indices],
+                                               batch_size=batch_size)
+                changed.add(shard_id)
+        for shard_id in set(self.shards) - set(self.ring.shard_ids):
+            del self.shards[shard_id]
+        return sorted(changed)
+
+    def save(self, directory, shard_ids=None):
+        """Write the shards in `shard_ids', every loaded one by default, to
+        their files in `directory' and then the manifest, each atomically.
+        Files of shards the manifest no longer names are removed."""
+        if shard_ids is None:
+            shard_ids = sorted(self.shards)
+        try:
+            old_ids = self._read_manifest(directory)['shards']
+        except (IOError, OSError, ValueError):
+            old_ids = []
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for shard_id in shard_ids:
+            publish(self._shard(shard_id), shard_path(directory, shard_id))
+        manifest = {
+            'shards': self.ring.shard_ids,
+            'vnodes': self.ring.vnodes,
+            'filter_class': self.filter_class.__name__,
+            'options': self.options,
+        }
+        with atomic_file(os.path.join(directory, MANIFEST_NAME)) as f:
+            f.write(json.dumps(manifest).encode('utf-8'))
+        for shard_id in set(old_ids) - set(self.ring.shard_ids):
+            try:
+                os.unlink(shard_path(directory, shard_id))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    @staticmethod
+    def _read_manifest(directory):
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            return json.load(f)
+
+    @classmethod
+    def load(cls, directory, filter_class=ScalableBloomFilter, mmap=False,
+             shard_ids=None):
+        """Load the sharded filter saved in `directory'. Only the shards in
+        `shard_ids' are loaded, all by default, so that a node can serve
+        its own shards; with none loaded the filter still routes keys.
+        `mmap' is passed on to the shards' ``fromfile''."""
+        manifest = cls._read_manifest(directory)
+        if manifest['filter_class'] != filter_class.__name__:
+            raise ValueError("Shards are %s, not %s" % (
+                manifest['filter_class'], filter_class.__name__))
+        filter = cls.__new__(cls)
+        filter.filter_class = filter_class
+        filter.options = manifest['options']
+        filter.ring = HashRing(manifest['shards'], manifest['vnodes'])
+        if shard_ids is None:
+            shard_ids = filter.ring.shard_ids
+        filter.shards = {}
+        for shard_id in shard_ids:
+            if shard_id not in filter.ring.shard_ids:
+                raise ValueError("No shard %d in %s" % (shard_id, directory))
+            with open(shard_path(directory, shard_id), 'rb') as f:
+                filter.shards[shard_id] = filter_class.fromfile(f, mmap=mmap)
+        return filter
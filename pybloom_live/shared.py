@@ -0,0 +1,276 @@
+"""This module places the bits of filters in shared memory, so that worker
+processes probe one copy of a filter instead of each loading their own.
+
+The owner process creates a shared filter from an ordinary one and keeps
+adding to it. Its writes land in the shared segment, so readers that
+attached by name see them at once, without copying anything. Pickling a
+shared filter, e.g. to pass it to a worker, pickles its name only; it is
+attached again when unpickled. Only the process that created a shared
+filter can add to it, even if forked workers inherit the filter itself.
+
+A SharedBloomFilter segment holds ``<QQ'' the key count and the length
+of the filter, then the filter as written by ``BloomFilter.tofile''. A
+SharedScalableBloomFilter has a control segment with ``<QQ'' the number
+of sub-filters and the length of its header, then the header as written
+by ``ScalableBloomFilter.tofile''; sub-filter i is the SharedBloomFilter
+named ``<name>-<i>''. Readers attach sub-filters the owner added the next
+time they probe.
+
+Before Python 3.13, attaching registers a segment with the process'
+resource tracker, which unlinks it when the tracker exits. Readers should
+therefore be multiprocessing children of the owner, which share its
+tracker, as forked workers do.
+"""
+from __future__ import absolute_import
+
+import io
+import os
+from struct import calcsize, pack_into, unpack_from
+
+from pybloom_live.pybloom import (BloomFilter, ScalableBloomFilter,
+                                  _pack_header, _read_header)
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+SEGMENT_FMT = '<QQ'
+COUNT_FMT = '<Q'
+CONTROL_FMT = '<QQ'
+CONTROL_SIZE = 128
+
+
+def _create_segment(name, size):
+    if shared_memory is None:
+        raise NotImplementedError("Shared memory needs Python 3.8 or later")
+    return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+
+def _attach_segment(name):
+    if shared_memory is None:
+        raise NotImplementedError("Shared memory needs Python 3.8 or later")
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def _sub_name(name, index):
+    return '%s-%d' % (name, index)
+
+
+def _check_owner(filter):
+    # Forked workers inherit the owner's filter, writable mapping included.
+    if filter._owner_pid != os.getpid():
+        raise TypeError("Only the process that created a shared filter "
+                        "can add to it")
+
+
+class SharedBloomFilter(BloomFilter):
+    shm = None
+    _buf = None
+    _owner_pid = None
+
+    @property
+    def count(self):
+        if self._buf is None:
+            return self.__dict__.get('_count', 0)
+        return unpack_from(COUNT_FMT, self._buf)[0]
+
+    @count.setter
+    def count(self, value):
+        if self._buf is None:
+            self.__dict__['_count'] = value
+        else:
+            pack_into(COUNT_FMT, self._buf, 0, value)
+
+    @classmethod
+    def create(cls, filter, name=None):
+        """Copy the BloomFilter `filter' into a new shared memory segment
+        named `name', a random name by default, and return a filter over
+        the segment. Keys added to it are visible to every process that
+        ``attach''es to it."""
+        image = io.BytesIO()
+        filter.tofile(image)
+        image = image.getvalue()
+        start = calcsize(SEGMENT_FMT)
+        shm = _create_segment(name, start + len(image))
+        pack_into(SEGMENT_FMT, shm.buf, 0, filter.count, len(image))
+        shm.buf[start:start + len(image)] = image
+        shared = cls._over(shm, shm.buf)
+        shared._owner_pid = os.getpid()
+        return shared
+
+    @classmethod
+    def attach(cls, name):
+        """Return a read-only filter over the shared segment `name'."""
+        shm = _attach_segment(name)
+        return cls._over(shm, shm.buf.toreadonly())
+
+    @classmethod
+    def _over(cls, shm, buf):
+        start = calcsize(SEGMENT_FMT)
+        _, length = unpack_from(SEGMENT_FMT, buf)
+        filter = cls.frombuffer(buf[start:start + length])
+        filter.shm = shm
+        filter._buf = buf
+        return filter
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def add(self, key, skip_check=False):
+        _check_owner(self)
+        return super(SharedBloomFilter, self).add(key, skip_check)
+
+    def add_many(self, keys, skip_check=False, batch_size=4096):
+        _check_owner(self)
+        return super(SharedBloomFilter, self).add_many(keys, skip_check,
+                                                       batch_size)
+
+    def close(self):
+        """Detach from the segment; the filter can not be used after."""
+        if self.shm is not None:
+            self.__dict__['_count'] = self.count
+            self.bitarray = None
+            self._buf = None
+            self.shm.close()
+            self.shm = None
+
+    def unlink(self):
+        """Free the segment once every process closed it. Owner only."""
+        shm = self.shm
+        self.close()
+        shm.unlink()
+
+    def __reduce__(self):
+        return self.attach, (self.name,)
+
+
+class SharedScalableBloomFilter(ScalableBloomFilter):
+    control = None
+    _owner_pid = None
+
+    @classmethod
+    def create(cls, filter, name=None):
+        """Copy the ScalableBloomFilter `filter' into shared memory: a
+        control segment named `name', a random name by default, and a
+        segment per sub-filter. Sub-filters the returned filter grows are
+        created in shared memory too."""
+        header = _pack_header(cls.FILE_FMT, filter.hash_mode, filter.scale,
+                              filter.ratio, filter.initial_capacity,
+                              filter.error_rate)
+        control = _create_segment(name, CONTROL_SIZE)
+        pack_into(CONTROL_FMT, control.buf, 0, 0, len(header))
+        start = calcsize(CONTROL_FMT)
+        control.buf[start:start + len(header)] = header
+        shared = cls._over(control)
+        shared._owner_pid = os.getpid()
+        try:
+            for f in filter.filters:
+                shared._share(f)
+        except BaseException:
+            shared.unlink()
+            raise
+        return shared
+
+    @classmethod
+    def attach(cls, name):
+        """Return a read-only filter over the shared filter `name'."""
+        return cls._over(_attach_segment(name))
+
+    @classmethod
+    def _over(cls, control):
+        nfilters, length = unpack_from(CONTROL_FMT, control.buf)
+        start = calcsize(CONTROL_FMT)
+        filter = cls()
+        hash_mode, header, _ = _read_header(
+            io.BytesIO(bytes(control.buf[start:start + length])),
+            cls.FILE_FMT)
+        filter._setup(*header, hash_mode=hash_mode)
+        filter.control = control
+        filter._refresh()
+        return filter
+
+    @property
+    def name(self):
+        return self.control.name
+
+    def _share(self, filter):
+        """Append a shared copy of `filter' and publish it to readers."""
+        shared = SharedBloomFilter.create(
+            filter, _sub_name(self.name, len(self.filters)))
+        if self.op_counters is not None:
+            shared.enable_op_counters()
+        self.filters.append(shared)
+        pack_into(COUNT_FMT, self.control.buf, 0, len(self.filters))
+        return shared
+
+    def _refresh(self):
+        """Attach the sub-filters the owner added since the last call."""
+        nfilters, = unpack_from(COUNT_FMT, self.control.buf)
+        while len(self.filters) < nfilters:
+            sub = SharedBloomFilter.attach(_sub_name(self.name,
+                                                     len(self.filters)))
+            if self.op_counters is not None:
+                sub.enable_op_counters()
+            self.filters.append(sub)
+
+    def add(self, key):
+        _check_owner(self)
+        return super(SharedScalableBloomFilter, self).add(key)
+
+    def add_many(self, keys, batch_size=4096):
+        _check_owner(self)
+        return super(SharedScalableBloomFilter, self).add_many(keys,
+                                                               batch_size)
+
+    def _filter_for_insert(self, grow=False):
+        filter = super(SharedScalableBloomFilter,
+                       self)._filter_for_insert(grow)
+        if not isinstance(filter, SharedBloomFilter):
+            # A new sub-filter: move it into its own segment.
+            self.filters.pop()
+            filter = self._share(filter)
+        return filter
+
+    def __contains__(self, key):
+        self._refresh()
+        return super(SharedScalableBloomFilter, self).__contains__(key)
+
+    def contains_many(self, keys, batch_size=4096):
+        self._refresh()
+        return super(SharedScalableBloomFilter, self).contains_many(
+            keys, batch_size)
+
+    def __len__(self):
+        self._refresh()
+        return super(SharedScalableBloomFilter, self).__len__()
+
+    def stats(self):
+        self._refresh()
+        return super(SharedScalableBloomFilter, self).stats()
+
+    def close(self):
+        """Detach from the segments; the filter can not be used after."""
+        for f in self.filters:
+            f.close()
+        self.filters = []
+        if self.control is not None:
+            self.control.close()
+            self.control = None
+
+    def unlink(self):
+        """Free the segments once every process closed them. Owner only."""
+        self._refresh()
+        for f in self.filters:
+            f.unlink()
+        self.filters = []
+        control = self.control
+        self.close()
+        control.unlink()
+
+    def __reduce__(self):
+        return self.attach, (self.name,)
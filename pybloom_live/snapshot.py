@@ -0,0 +1,109 @@
+"""This module implements a ConcurrentBloomFilter, a filter that threads can
+probe while others add to it. Readers probe an immutable snapshot and take
+no lock. Writers queue their keys; a batch of them is added to a copy of
+the snapshot, which then replaces it with a single attribute assignment.
+
+A ScalableBloomFilter snapshot is copied on write a sub-filter at a time:
+only the newest sub-filter is written to, so the new snapshot shares the
+older ones with the previous snapshot.
+"""
+from __future__ import absolute_import
+
+import copy
+import threading
+
+from pybloom_live.pybloom import ScalableBloomFilter
+
+
+def _copy_for_write(filter):
+    """Return a copy of `filter' that keys can be added to without changing
+    `filter'."""
+    if not isinstance(filter, ScalableBloomFilter):
+        return copy.deepcopy(filter)
+    new = copy.copy(filter)
+    new.filters = list(filter.filters)
+    if new.filters and new.filters[-1].count < new.filters[-1].capacity:
+        new.filters[-1] = copy.deepcopy(new.filters[-1])
+    return new
+
+
+class ConcurrentBloomFilter(object):
+    def __init__(self, filter=None, batch_size=1024, max_delay=None):
+        """Wraps `filter', a BloomFilter or ScalableBloomFilter (a new
+        ScalableBloomFilter by default), for concurrent use. `filter'
+        becomes the first snapshot and must not be changed afterwards; a
+        read-only filter loaded with mmap is fine.
+
+        batch_size
+            the number of queued keys that publishes a new snapshot
+        max_delay
+            if set, queued keys are published at most this many seconds
+            after the first of them was queued, by a timer thread.
+            Otherwise only by a full batch or ``flush''.
+        """
+        self._snapshot = filter if filter is not None else ScalableBloomFilter()
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.snapshots = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def snapshot(self):
+        """Return the current snapshot. It never changes, so several
+        lookups against it see a consistent filter; don't add to it."""
+        return self._snapshot
+
+    def __contains__(self, key):
+        return key in self._snapshot
+
+    def contains_many(self, keys, batch_size=4096):
+        return self._snapshot.contains_many(keys, batch_size)
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def add(self, key):
+        """Queue `key' to be added with the next snapshot."""
+        self.add_many([key])
+
+    def add_many(self, keys):
+        """Queue every key in `keys', publishing a snapshot once a batch is
+        full."""
+        with self._lock:
+            self._pending.extend(keys)
+            if len(self._pending) >= self.batch_size:
+                self._publish()
+            elif self._pending and self.max_delay is not None and \
+                    self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Publish a snapshot holding every queued key. Returns once lookups
+        see them."""
+        with self._lock:
+            self._publish()
+
+    def _publish(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        snapshot = _copy_for_write(self._snapshot)
+        snapshot.add_many(self._pending)
+        self._pending = []
+        self._snapshot = snapshot
+        self.snapshots += 1
+
+    @property
+    def pending(self):
+        """The number of keys queued and not yet visible to lookups."""
+        return len(self._pending)
+
+    def tofile(self, f, compress=False):
+        """Flush, then write the snapshot to file object `f'."""
+        self.flush()
+        self._snapshot.tofile(f, compress=compress)
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+from pybloom_live.benchmarks import compare, main, run_suite
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_run_suite(self):
+        current = run_suite('quick', match='capacity=1000,', out=None)
+        self.assertEqual('quick', current['meta']['scale'])
+        names = sorted(current['results'])
+        self.assertEqual(8, len(names))
+        for result in current['results'].values():
+            self.assertTrue(result['ops_per_sec'] > 0)
+        json.dumps(current)
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'ops_per_sec': 100.0},
+                                'b': {'ops_per_sec': 100.0},
+                                'gone': {'ops_per_sec': 1.0}}}
+        current = {'results': {'a': {'ops_per_sec': 79.0},
+                               'b': {'ops_per_sec': 81.0},
+                               'new': {'ops_per_sec': 1.0}}}
+        rows, regressions = compare(current, baseline, threshold=0.2)
+        self.assertEqual(['a', 'b'], [row[0] for row in rows])
+        self.assertEqual(['a'], regressions)
+
+    def test_main_writes_and_compares(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'baseline.json')
+            self.assertEqual(0, main(['--scale', 'quick', '--match', 'union',
+                                      '--json', path]))
+            with open(path) as f:
+                baseline = json.load(f)
+            for result in baseline['results'].values():
+                result['ops_per_sec'] *= 100
+            with open(path, 'w') as f:
+                json.dump(baseline, f)
+            self.assertEqual(1, main(['--scale', 'quick', '--match', 'union',
+                                      '--baseline', path]))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
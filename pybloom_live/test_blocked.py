@@ -0,0 +1,162 @@
+from __future__ import absolute_import
+
+from pybloom_live.blocked import (BLOCK_BITS, BlockedBloomFilter,
+                                  ScalableBlockedBloomFilter,
+                                  blocked_error_rate)
+from pybloom_live.pybloom import BloomFilter, KeyDigest, ScalableBloomFilter
+from pybloom_live.utils import range_fn
+
+import io
+import tempfile
+import unittest
+
+import pytest
+
+
+class TestBlockedBloomFilter(unittest.TestCase):
+    def test_sizing_meets_error_rate(self):
+        for error_rate in (0.1, 0.01, 0.001):
+            bloom = BlockedBloomFilter(10000, error_rate)
+            self.assertEqual(0, bloom.num_bits % BLOCK_BITS)
+            self.assertTrue(blocked_error_rate(10000, bloom.num_hashes,
+                                               bloom.num_blocks) <= error_rate)
+            classic = BloomFilter(10000, error_rate)
+            self.assertTrue(bloom.num_bits >= classic.num_bits)
+
+    def test_key_bits_share_one_block(self):
+        bloom = BlockedBloomFilter(1000, 0.001)
+        for key in range_fn(0, 100):
+            blocks = set(p // BLOCK_BITS for p in bloom.make_hashes(key))
+            self.assertEqual(1, len(blocks))
+
+    def test_hash_paths_agree(self):
+        bloom = BlockedBloomFilter(1000, 0.001)
+        keys = ['a', u'\xe9t\xe9', 42, 3.5]
+        expected = [list(bloom.make_hashes(key)) for key in keys]
+        self.assertEqual(expected, bloom.make_hashes_many(keys).tolist())
+        self.assertEqual(expected, [bloom._digest_positions(KeyDigest(key))
+                                    for key in keys])
+
+    def test_membership_and_false_positives(self):
+        bloom = BlockedBloomFilter(2000, 0.01)
+        for i in range_fn(0, 2000):
+            self.assertFalse(bloom.add(i, skip_check=True))
+        self.assertTrue(bloom.add(0))
+        self.assertEqual(2000, len(bloom))
+        for i in range_fn(0, 2000):
+            self.assertTrue(i in bloom)
+        false_positives = sum(1 for i in range_fn(2000, 22000) if i in bloom)
+        self.assertTrue(false_positives < 400)
+
+    def test_add_many_matches_add(self):
+        bloom_one = BlockedBloomFilter(1000, 0.001)
+        bloom_two = BlockedBloomFilter(1000, 0.001)
+        for i in range_fn(0, 500):
+            bloom_one.add(i)
+        bloom_two.add_many(range_fn(0, 500))
+        self.assertEqual(bloom_one.bitarray, bloom_two.bitarray)
+        self.assertTrue(bloom_two.contains_many(range_fn(0, 500)).all())
+
+    def test_union_intersection(self):
+        bloom_one = BlockedBloomFilter(100, 0.001)
+        bloom_two = BlockedBloomFilter(100, 0.001)
+        chars = [chr(i) for i in range_fn(97, 123)]
+        for char in chars[:13]:
+            bloom_one.add(char)
+            bloom_two.add(char)
+        for char in chars[13:]:
+            bloom_one.add(char)
+        union = bloom_one | bloom_two
+        self.assertTrue(isinstance(union, BlockedBloomFilter))
+        for char in chars:
+            self.assertTrue(char in union)
+        intersection = bloom_one & bloom_two
+        for char in chars[:13]:
+            self.assertTrue(char in intersection)
+
+    def test_union_with_classic_fails(self):
+        def _run():
+            BlockedBloomFilter(100, 0.001).union(BloomFilter(100, 0.001))
+        self.assertRaises(ValueError, _run)
+
+    def test_files_are_not_interchangeable(self):
+        f = io.BytesIO()
+        BlockedBloomFilter(100).tofile(f)
+        f.seek(0)
+        self.assertRaises(ValueError, BloomFilter.fromfile, f)
+        f = io.BytesIO()
+        BloomFilter(100).tofile(f)
+        f.seek(0)
+        self.assertRaises(ValueError, BlockedBloomFilter.fromfile, f)
+
+    def test_stats(self):
+        bloom = BlockedBloomFilter(10000, 0.01)
+        bloom.enable_op_counters()
+        for i in range_fn(0, 10000):
+            bloom.add(i)
+        self.assertTrue(1 in bloom)
+        stats = bloom.stats()
+        self.assertEqual(10000, stats['inserts'])
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(bloom.bitarray.count(True), stats['bits_set'])
+        self.assertTrue(0.005 < stats['estimated_fpr'] < 0.02)
+
+class TestScalableBlockedBloomFilter(unittest.TestCase):
+    def test_growth(self):
+        sbf = ScalableBlockedBloomFilter(
+            initial_capacity=50, mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        for i in range_fn(0, 2000):
+            sbf.add(i)
+        self.assertTrue(len(sbf.filters) > 3)
+        for filter in sbf.filters:
+            self.assertTrue(isinstance(filter, BlockedBloomFilter))
+        for i in range_fn(0, 2000):
+            self.assertTrue(i in sbf)
+        self.assertTrue(sbf.add(0))
+
+    def test_union(self):
+        sbf_one = ScalableBlockedBloomFilter()
+        sbf_two = ScalableBlockedBloomFilter()
+        for i in range_fn(0, 300):
+            sbf_one.add(i)
+        for i in range_fn(300, 1000):
+            sbf_two.add(i)
+        union = sbf_one | sbf_two
+        for i in range_fn(0, 1000):
+            self.assertTrue(i in union)
+
+
+class TestSerialization:
+    SIZE = 5000
+
+    @pytest.mark.parametrize("cls,args", [
+        (BlockedBloomFilter, (SIZE,)),
+        (ScalableBlockedBloomFilter, ()),
+    ])
+    @pytest.mark.parametrize("mmap", [False, True])
+    def test_serialization(self, cls, args, mmap):
+        filter = cls(*args)
+        for item in range_fn(0, self.SIZE):
+            filter.add(item)
+
+        f = tempfile.TemporaryFile()
+        filter.tofile(f)
+        f.seek(0)
+        loaded = cls.fromfile(f, mmap=mmap)
+        assert type(loaded) is cls
+        assert len(loaded) == len(filter)
+        for item in range_fn(0, self.SIZE):
+            assert item in loaded
+
+    def test_scalable_files_are_not_interchangeable(self):
+        sbf = ScalableBlockedBloomFilter()
+        sbf.add('a')
+        f = io.BytesIO()
+        sbf.tofile(f)
+        f.seek(0)
+        with pytest.raises(ValueError):
+            ScalableBloomFilter.fromfile(f)
+
+
+if __name__ == '__main__':
+    unittest.main()
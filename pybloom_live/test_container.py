@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+
+from pybloom_live.blocked import BlockedBloomFilter
+from pybloom_live.container import FilterContainer, write_container
+from pybloom_live.counting import ScalableCountingBloomFilter
+from pybloom_live.pybloom import (DOUBLE_HASHING, BloomFilter,
+                                  ScalableBloomFilter)
+from pybloom_live.utils import range_fn
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytest
+
+
+def make_filters():
+    features = ScalableBloomFilter(hash_mode=DOUBLE_HASHING)
+    plates = BloomFilter(1000)
+    blocked = BlockedBloomFilter(1000)
+    counting = ScalableCountingBloomFilter()
+    for i in range_fn(0, 500):
+        features.add('feature-%d' % i)
+        plates.add('plate-%d' % i)
+        blocked.add(i)
+        counting.add(i)
+    return [('Tire_Size', features), (u'Lic\xe9nse_Plate', plates),
+            ('blocked', blocked), ('counting', counting),
+            ('empty', ScalableBloomFilter())]
+
+
+class TestContainer:
+    def setup_method(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'features.blc')
+        with open(self.path, 'wb') as f:
+            write_container(f, make_filters())
+
+    def teardown_method(self):
+        shutil.rmtree(self.dir)
+
+    @pytest.mark.parametrize("mmap", [False, True])
+    def test_read_named_filters(self, mmap):
+        with FilterContainer(self.path, mmap=mmap) as container:
+            assert len(container) == 5
+            assert 'Tire_Size' in container
+            features = container['Tire_Size']
+            plates = container[u'Lic\xe9nse_Plate']
+            loaded = container.load(['blocked', 'counting', 'empty'])
+        assert isinstance(features, ScalableBloomFilter)
+        assert features.hash_mode == DOUBLE_HASHING
+        assert isinstance(plates, BloomFilter)
+        assert isinstance(loaded['blocked'], BlockedBloomFilter)
+        assert isinstance(loaded['counting'], ScalableCountingBloomFilter)
+        assert len(loaded['empty']) == 0
+        for i in range_fn(0, 500):
+            assert 'feature-%d' % i in features
+            assert 'plate-%d' % i in plates
+            assert i in loaded['blocked']
+            assert i in loaded['counting']
+
+    def test_missing_name(self):
+        with FilterContainer(self.path) as container:
+            assert container.get('missing') is None
+            with pytest.raises(KeyError):
+                container['missing']
+
+    def test_names_keep_order(self):
+        with FilterContainer(self.path) as container:
+            assert container.names() == [name for name, _ in make_filters()]
+
+    def test_write_mapping_and_position(self):
+        f = io.BytesIO()
+        f.write(b'prefix')
+        write_container(f, {'a': BloomFilter(10)})
+        assert f.tell() == len(f.getvalue())
+
+    def test_not_a_container(self):
+        with open(self.path, 'wb') as f:
+            BloomFilter(10).tofile(f)
+        with pytest.raises(ValueError):
+            FilterContainer(self.path)
+
+    def test_unsupported_class(self):
+        with pytest.raises(ValueError):
+            write_container(io.BytesIO(), [('a', set())])
+
+
+if __name__ == '__main__':
+    pytest.main([__file__])
@@ -0,0 +1,171 @@
+from __future__ import absolute_import
+
+from pybloom_live.counting import (CountingBloomFilter,
+                                   ScalableCountingBloomFilter)
+from pybloom_live.pybloom import (DOUBLE_HASHING, SALTED_HASHING, BloomFilter,
+                                  ScalableBloomFilter)
+from pybloom_live.utils import range_fn
+
+import io
+import tempfile
+import unittest
+
+import pytest
+
+
+class TestCountingBloomFilter(unittest.TestCase):
+    def test_add_remove(self):
+        bloom = CountingBloomFilter(1000, 0.001)
+        for i in range_fn(0, 1000):
+            bloom.add(i)
+        self.assertEqual(1000, len(bloom))
+        for i in range_fn(0, 500):
+            bloom.remove(i)
+        self.assertEqual(500, len(bloom))
+        for i in range_fn(500, 1000):
+            self.assertTrue(i in bloom)
+        removed = sum(1 for i in range_fn(0, 500) if i in bloom)
+        self.assertTrue(removed < 5)
+
+    def test_remove_missing_key(self):
+        bloom = CountingBloomFilter(100, 0.001)
+        self.assertRaises(KeyError, bloom.remove, 'missing')
+
+    def test_add_is_counted_twice(self):
+        bloom = CountingBloomFilter(100, 0.001)
+        self.assertFalse(bloom.add('a'))
+        self.assertTrue(bloom.add('a'))
+        bloom.remove('a')
+        self.assertTrue('a' in bloom)
+        bloom.remove('a')
+        self.assertFalse('a' in bloom)
+
+    def test_counters_saturate(self):
+        bloom = CountingBloomFilter(100, 0.001)
+        for _ in range_fn(0, 20):
+            bloom.add('a')
+        for _ in range_fn(0, 20):
+            bloom.remove('a')
+        # Saturated counters are never decremented.
+        self.assertTrue('a' in bloom)
+
+    def test_to_bloom_filter(self):
+        for hash_mode in (SALTED_HASHING, DOUBLE_HASHING):
+            bloom = CountingBloomFilter(1000, 0.001, hash_mode)
+            reference = BloomFilter(1000, 0.001, hash_mode)
+            for i in range_fn(0, 600):
+                bloom.add(i)
+                if i >= 100:
+                    reference.add(i)
+            for i in range_fn(0, 100):
+                bloom.remove(i)
+            exported = bloom.to_bloom_filter()
+            self.assertEqual(reference.bitarray, exported.bitarray)
+            self.assertEqual(500, len(exported))
+            self.assertEqual(hash_mode, exported.hash_mode)
+
+    def test_files_are_not_interchangeable(self):
+        f = io.BytesIO()
+        CountingBloomFilter(100).tofile(f)
+        f.seek(0)
+        self.assertRaises(ValueError, BloomFilter.fromfile, f)
+        f = io.BytesIO()
+        BloomFilter(100).tofile(f)
+        f.seek(0)
+        self.assertRaises(ValueError, CountingBloomFilter.fromfile, f)
+
+    def test_stats_match_exported_filter(self):
+        bloom = CountingBloomFilter(1000, 0.01)
+        for i in range_fn(0, 1000):
+            bloom.add(i)
+        for i in range_fn(0, 500):
+            bloom.remove(i)
+        stats = bloom.stats()
+        exported = bloom.to_bloom_filter().stats()
+        for key in ('bits_set', 'fill_ratio', 'estimated_fpr', 'count'):
+            self.assertAlmostEqual(exported[key], stats[key])
+
+    def test_counters_are_not_compressed(self):
+        self.assertRaises(ValueError, CountingBloomFilter(100).tofile,
+                          io.BytesIO(), compress=True)
+
+    def test_unsupported(self):
+        bloom = ScalableCountingBloomFilter()
+        self.assertRaises(TypeError, bloom.union, ScalableCountingBloomFilter())
+        self.assertRaises(TypeError, bloom.enable_op_counters)
+
+
+class TestScalableCountingBloomFilter(unittest.TestCase):
+    def test_add_remove_across_filters(self):
+        sbf = ScalableCountingBloomFilter(
+            initial_capacity=50, mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        for i in range_fn(0, 1000):
+            sbf.add(i)
+        self.assertTrue(len(sbf.filters) > 3)
+        self.assertEqual(1000, len(sbf))
+        for i in range_fn(0, 1000):
+            if i % 2:
+                sbf.remove(i)
+        self.assertEqual(500, len(sbf))
+        for i in range_fn(0, 1000):
+            if not i % 2:
+                self.assertTrue(i in sbf)
+        self.assertRaises(KeyError, sbf.remove, 'missing')
+
+    def test_add_many_counts_every_key(self):
+        sbf = ScalableCountingBloomFilter(initial_capacity=50)
+        found = sbf.add_many(['a', 'b', 'a'])
+        self.assertEqual([False, False, True], found.tolist())
+        self.assertEqual(3, len(sbf))
+        sbf.remove('a')
+        self.assertEqual([True, True, False],
+                         sbf.contains_many(['a', 'b', 'c']).tolist())
+
+    def test_to_bloom_filter(self):
+        sbf = ScalableCountingBloomFilter(initial_capacity=50)
+        for i in range_fn(0, 500):
+            sbf.add(i)
+        sbf.remove(0)
+        exported = sbf.to_bloom_filter()
+        self.assertTrue(isinstance(exported, ScalableBloomFilter))
+        self.assertEqual(len(sbf.filters), len(exported.filters))
+        self.assertEqual(499, len(exported))
+        for i in range_fn(1, 500):
+            self.assertTrue(i in exported)
+        f = io.BytesIO()
+        exported.tofile(f)
+        f.seek(0)
+        self.assertEqual(499, len(ScalableBloomFilter.fromfile(f)))
+
+
+class TestSerialization:
+    SIZE = 2000
+
+    @pytest.mark.parametrize("cls,args", [
+        (CountingBloomFilter, (SIZE,)),
+        (CountingBloomFilter, (SIZE, 0.001, DOUBLE_HASHING)),
+        (ScalableCountingBloomFilter, ()),
+    ])
+    @pytest.mark.parametrize("stream_factory", [
+        lambda: tempfile.TemporaryFile,
+        lambda: io.BytesIO,
+    ])
+    def test_serialization(self, cls, args, stream_factory):
+        filter = cls(*args)
+        for item in range_fn(0, self.SIZE):
+            filter.add(item)
+        filter.remove(0)
+
+        f = stream_factory()()
+        filter.tofile(f)
+        f.seek(0)
+        loaded = cls.fromfile(f)
+        assert len(loaded) == self.SIZE - 1
+        for item in range_fn(1, self.SIZE):
+            assert item in loaded
+        loaded.remove(1)
+        assert len(loaded) == self.SIZE - 2
+
+
+if __name__ == '__main__':
+    unittest.main()
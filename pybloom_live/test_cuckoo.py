@@ -0,0 +1,190 @@
+from __future__ import absolute_import
+
+from pybloom_live.cuckoo import (BUCKET_SIZE, CuckooFilter,
+                                 ScalableCuckooFilter, cuckoo_params)
+from pybloom_live.pybloom import BloomFilter, ScalableBloomFilter
+from pybloom_live.utils import range_fn
+
+import io
+import pickle
+import tempfile
+import unittest
+
+import pytest
+
+
+class TestCuckooFilter(unittest.TestCase):
+    def test_params(self):
+        self.assertEqual((13, 264), cuckoo_params(1000, 0.001))
+        self.assertRaises(ValueError, cuckoo_params, 1000, 0)
+        self.assertRaises(ValueError, cuckoo_params, 0, 0.1)
+        self.assertRaises(ValueError, cuckoo_params, 1000, 1e-10)
+
+    def test_add_remove(self):
+        cf = CuckooFilter(1000, 0.001)
+        for i in range_fn(0, 1000):
+            cf.add(i, skip_check=True)
+        self.assertEqual(1000, len(cf))
+        for i in range_fn(0, 1000):
+            self.assertTrue(i in cf)
+        self.assertTrue(cf.add(0))
+        self.assertEqual(1000, len(cf))
+        for i in range_fn(0, 500):
+            cf.remove(i)
+        self.assertEqual(500, len(cf))
+        for i in range_fn(500, 1000):
+            self.assertTrue(i in cf)
+        self.assertTrue(sum(i in cf for i in range_fn(0, 500)) < 5)
+        self.assertRaises(KeyError, cf.remove, 'missing')
+
+    def test_false_positive_rate(self):
+        cf = CuckooFilter(10000, 0.01)
+        cf.add_many(range_fn(0, 10000), skip_check=True)
+        false_positives = cf.contains_many(range_fn(10000, 60000)).sum()
+        self.assertTrue(false_positives < 0.01 * 50000)
+        self.assertTrue(0.9 < cf.stats()['load_factor'] <= 0.95)
+
+    def test_full(self):
+        cf = CuckooFilter(100, 0.01)
+        added = 0
+        with self.assertRaises(IndexError):
+            while True:
+                cf.add('key-%d' % added, skip_check=True)
+                added += 1
+        self.assertTrue(added >= 100)
+        self.assertEqual(added, len(cf))
+        self.assertEqual(added, sum(1 for slot in cf.buckets if slot))
+        for i in range_fn(0, added):
+            self.assertTrue('key-%d' % i in cf)
+
+    def test_contains_many(self):
+        cf = CuckooFilter(1000, 0.001)
+        found = cf.add_many(range_fn(0, 800))
+        self.assertFalse(found.any())
+        self.assertTrue(cf.add_many([1, 2]).all())
+        keys = list(range_fn(0, 2000))
+        self.assertEqual([k in cf for k in keys],
+                         cf.contains_many(keys, batch_size=300).tolist())
+
+    def test_copy_and_pickle(self):
+        cf = CuckooFilter(100)
+        cf.add('a')
+        for copied in (cf.copy(), pickle.loads(pickle.dumps(cf))):
+            copied.add('b')
+            self.assertTrue('a' in copied and 'b' in copied)
+        self.assertFalse('b' in cf)
+
+    def test_files_are_not_interchangeable(self):
+        f = io.BytesIO()
+        CuckooFilter(100).tofile(f)
+        f.seek(0)
+        self.assertRaises(ValueError, BloomFilter.fromfile, f)
+        f = io.BytesIO()
+        BloomFilter(100).tofile(f)
+        f.seek(0)
+        self.assertRaises(ValueError, CuckooFilter.fromfile, f)
+
+    def test_union(self):
+        self.assertRaises(TypeError, CuckooFilter(100).union,
+                          CuckooFilter(100))
+
+
+class TestScalableCuckooFilter(unittest.TestCase):
+    def test_growth(self):
+        scf = ScalableCuckooFilter(
+            initial_capacity=50, mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        for i in range_fn(0, 2000):
+            scf.add(i)
+        self.assertTrue(len(scf.filters) > 3)
+        for f in scf.filters:
+            self.assertTrue(isinstance(f, CuckooFilter))
+        for i in range_fn(0, 2000):
+            self.assertTrue(i in scf)
+        self.assertTrue(scf.add(0))
+        self.assertTrue(scf.contains_many(range_fn(0, 2000)).all())
+
+    def test_grows_when_full(self):
+        scf = ScalableCuckooFilter(initial_capacity=10)
+        scf.add('a')
+        scf.filters[0].capacity = 10 ** 6  # only a failed insert grows it
+        for i in range_fn(0, 100):
+            scf.add(i)
+        self.assertEqual(2, len(scf.filters))
+        for i in range_fn(0, 100):
+            self.assertTrue(i in scf)
+
+    def test_remove(self):
+        scf = ScalableCuckooFilter(initial_capacity=50)
+        scf.add_many(range_fn(0, 500))
+        self.assertTrue(len(scf.filters) > 1)
+        count = len(scf)
+        for i in range_fn(0, 500):
+            if i % 2:
+                scf.remove(i)
+        self.assertEqual(count - 250, len(scf))
+        for i in range_fn(0, 500):
+            if not i % 2:
+                self.assertTrue(i in scf)
+        self.assertRaises(KeyError, scf.remove, 'missing')
+
+    def test_stats(self):
+        scf = ScalableCuckooFilter(initial_capacity=100)
+        scf.enable_op_counters()
+        scf.add_many(range_fn(0, 200))
+        self.assertTrue(0 in scf)
+        stats = scf.stats()
+        self.assertEqual(len(scf.filters), stats['filters'])
+        self.assertEqual(200, stats['inserts'])
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, sum(stats['hits_by_filter']))
+        self.assertTrue(0 < stats['estimated_fpr'] < 0.01)
+
+    def test_union(self):
+        self.assertRaises(TypeError, ScalableCuckooFilter().union,
+                          ScalableCuckooFilter())
+
+
+class TestSerialization:
+    @pytest.mark.parametrize("error_rate", [0.01, 0.001, 1e-7])
+    @pytest.mark.parametrize("keys", [0, 1, 3000])
+    def test_cuckoo_filter(self, error_rate, keys):
+        cf = CuckooFilter(3000, error_rate)
+        cf.add_many(range_fn(0, keys))
+        f = io.BytesIO()
+        cf.tofile(f)
+        assert len(f.getvalue()) < (cf.num_buckets * BUCKET_SIZE *
+                                    cf.fingerprint_bits // 8 + 64)
+        f.seek(0)
+        loaded = CuckooFilter.fromfile(f)
+        assert loaded.buckets == cf.buckets
+        assert len(loaded) == len(cf)
+        assert loaded.fingerprint_bits == cf.fingerprint_bits
+        loaded = CuckooFilter.frombuffer(f.getvalue())
+        assert loaded.buckets == cf.buckets
+        loaded.add('new key')
+        assert 'new key' in loaded
+
+    def test_truncated(self):
+        f = io.BytesIO()
+        CuckooFilter(100).tofile(f)
+        with pytest.raises(ValueError):
+            CuckooFilter.frombuffer(f.getvalue()[:-1])
+
+    @pytest.mark.parametrize("mmap", [False, True])
+    def test_scalable(self, mmap):
+        scf = ScalableCuckooFilter(initial_capacity=100)
+        scf.add_many(range_fn(0, 1000))
+        f = tempfile.TemporaryFile()
+        scf.tofile(f)
+        f.seek(0)
+        loaded = ScalableCuckooFilter.fromfile(f, mmap=mmap)
+        assert len(loaded.filters) == len(scf.filters)
+        assert len(loaded) == len(scf)
+        for i in range_fn(0, 1000):
+            assert i in loaded
+        loaded.add('new key')
+        assert 'new key' in loaded
+
+
+if __name__ == '__main__':
+    unittest.main()
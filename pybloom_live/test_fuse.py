@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+
+from pybloom_live.fuse import (BinaryFuseBuilder, BinaryFuseFilter,
+                               fuse_params, key_hashes)
+from pybloom_live.pybloom import BloomFilter
+from pybloom_live.utils import range_fn
+
+import io
+import pickle
+import tempfile
+import unittest
+
+import pytest
+
+
+class TestBinaryFuseFilter(unittest.TestCase):
+    def test_params(self):
+        self.assertEqual((4, 1), fuse_params(0))
+        segment_length, segment_count = fuse_params(1000000)
+        self.assertEqual(1 << 13, segment_length)
+        self.assertTrue((segment_count + 2) * segment_length < 1.14e6)
+
+    def test_false_positive_rate(self):
+        bff = BinaryFuseFilter(range_fn(0, 20000))
+        self.assertTrue(bff.contains_many(range_fn(0, 20000)).all())
+        false_positives = bff.contains_many(range_fn(20000, 120000)).sum()
+        self.assertTrue(false_positives < 2 * 100000 / 256.0)
+        self.assertTrue(bff.stats()['bits_per_key'] < 10)
+
+    def test_sixteen_bits(self):
+        bff = BinaryFuseFilter(range_fn(0, 20000), fingerprint_bits=16)
+        self.assertTrue(bff.contains_many(range_fn(0, 20000)).all())
+        self.assertTrue(bff.contains_many(range_fn(20000, 120000)).sum() < 10)
+        self.assertTrue(bff.stats()['bits_per_key'] < 20)
+
+    def test_contains_many(self):
+        bff = BinaryFuseFilter(['a', b'b', 3])
+        keys = ['a', b'b', 3, 'c', 'd'] + list(range_fn(0, 1000))
+        self.assertEqual([k in bff for k in keys],
+                         bff.contains_many(keys, batch_size=300).tolist())
+
+    def test_duplicates(self):
+        bff = BinaryFuseFilter(['a', 'a', 'b'])
+        self.assertEqual(2, len(bff))
+        self.assertTrue('a' in bff and 'b' in bff)
+
+    def test_invalid_fingerprint_bits(self):
+        self.assertRaises(ValueError, BinaryFuseFilter, ['a'], 12)
+        self.assertRaises(ValueError, BinaryFuseBuilder, 32)
+
+    def test_builder(self):
+        builder = BinaryFuseBuilder()
+        builder.add_many(range_fn(0, 5000))
+        for i in range_fn(5000, 10000):
+            builder.add(i)
+        builder.add(0)
+        self.assertEqual(10001, len(builder))
+        bff = builder.build()
+        self.assertEqual(10000, len(bff))
+        self.assertTrue(bff.contains_many(range_fn(0, 10000)).all())
+        self.assertTrue((key_hashes(['a', 'b']) ==
+                         key_hashes(iter(['a', 'b']), batch_size=1)).all())
+
+    def test_pickle(self):
+        bff = BinaryFuseFilter(range_fn(0, 100), fingerprint_bits=16)
+        loaded = pickle.loads(pickle.dumps(bff))
+        self.assertEqual(bff.fingerprints.tolist(),
+                         loaded.fingerprints.tolist())
+        self.assertTrue(loaded.contains_many(range_fn(0, 100)).all())
+
+    def test_files_are_not_interchangeable(self):
+        f = io.BytesIO()
+        BinaryFuseFilter(['a']).tofile(f)
+        f.seek(0)
+        self.assertRaises(ValueError, BloomFilter.fromfile, f)
+        f = io.BytesIO()
+        BloomFilter(100).tofile(f)
+        f.seek(0)
+        self.assertRaises(ValueError, BinaryFuseFilter.fromfile, f)
+
+
+class TestSerialization:
+    @pytest.mark.parametrize("fingerprint_bits", [8, 16])
+    @pytest.mark.parametrize("keys", [0, 1, 10, 3000])
+    def test_binary_fuse_filter(self, fingerprint_bits, keys):
+        bff = BinaryFuseFilter(range_fn(0, keys), fingerprint_bits)
+        f = io.BytesIO()
+        bff.tofile(f)
+        assert len(f.getvalue()) < bff.num_bits // 8 + 64
+        f.seek(0)
+        for loaded in (BinaryFuseFilter.fromfile(f),
+                       BinaryFuseFilter.frombuffer(f.getvalue())):
+            assert loaded.fingerprints.tolist() == bff.fingerprints.tolist()
+            assert len(loaded) == keys
+            assert loaded.contains_many(range_fn(0, keys)).all()
+
+    def test_mmap(self):
+        bff = BinaryFuseFilter(range_fn(0, 1000))
+        f = tempfile.TemporaryFile()
+        f.write(b'prefix')
+        bff.tofile(f)
+        end = f.tell()
+        f.write(b'suffix')
+        f.seek(6)
+        loaded = BinaryFuseFilter.fromfile(f, n=end - 6, mmap=True)
+        assert f.tell() == end
+        assert loaded.fingerprints.readonly
+        for i in range_fn(0, 1000):
+            assert i in loaded
+
+    def test_truncated(self):
+        f = io.BytesIO()
+        BinaryFuseFilter(range_fn(0, 100)).tofile(f)
+        with pytest.raises(ValueError):
+            BinaryFuseFilter.frombuffer(f.getvalue()[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
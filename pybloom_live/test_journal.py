@@ -0,0 +1,189 @@
+from __future__ import absolute_import
+
+from pybloom_live.journal import (FilterJournal, JournalCompactor,
+                                  atomic_file, publish, read_log)
+from pybloom_live.pybloom import BloomFilter, ScalableBloomFilter
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class TestFilterJournal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'a.blm')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_missing(self):
+        self.assertRaises(IOError, FilterJournal(self.path).load)
+        self.assertFalse(FilterJournal(self.path).compact())
+
+    def test_log_without_snapshot(self):
+        journal = FilterJournal(self.path)
+        journal.append('a')
+        journal.append_many(['b', 1, u'é'])
+        self.assertEqual(['a', 'b', '1', u'é'], read_log(journal.log_path))
+        filter = journal.load()
+        for key in ('a', 'b', 1, u'é'):
+            self.assertTrue(key in filter)
+        self.assertFalse('c' in filter)
+
+    def test_replays_onto_snapshot(self):
+        filter = ScalableBloomFilter()
+        filter.add('a')
+        publish(filter, self.path)
+        journal = FilterJournal(self.path)
+        journal.append('b')
+        loaded = journal.load(mmap=True)
+        self.assertTrue('a' in loaded and 'b' in loaded)
+        loaded.add('c')
+
+    def test_compact(self):
+        journal = FilterJournal(self.path)
+        journal.append_many(['key-%d' % i for i in range(1000)])
+        self.assertTrue(journal.log_size() > 0)
+        self.assertTrue(journal.compact())
+        self.assertEqual(0, journal.log_size())
+        self.assertFalse(journal.compact())
+        journal.append('more')
+        self.assertTrue(journal.compact())
+        with open(self.path, 'rb') as f:
+            filter = ScalableBloomFilter.fromfile(f)
+        for i in range(1000):
+            self.assertTrue('key-%d' % i in filter)
+        self.assertTrue('more' in filter)
+        self.assertTrue(990 < len(filter) <= 1001)  # adds of false positives are skipped
+
+    def test_interrupted_compaction(self):
+        journal = FilterJournal(self.path)
+        journal.append('a')
+        os.rename(journal.log_path, journal.compacting_path)
+        journal.append('b')
+        filter = journal.load()
+        self.assertTrue('a' in filter and 'b' in filter)
+        self.assertTrue(journal.compact())  # folds the leftover log
+        self.assertTrue(journal.compact())  # then the current one
+        self.assertEqual(0, journal.log_size())
+        filter = journal.load()
+        self.assertTrue('a' in filter and 'b' in filter)
+
+    def test_delete(self):
+        journal = FilterJournal(self.path)
+        journal.append('a')
+        self.assertTrue(journal.compact())
+        journal.append('b')
+        os.rename(journal.log_path, journal.compacting_path)
+        journal.append('c')
+        journal.delete()
+        self.assertEqual([], os.listdir(self.dir))
+        self.assertRaises(IOError, journal.load)
+        journal.delete()  # nothing left to remove
+
+    def test_torn_record(self):
+        journal = FilterJournal(self.path)
+        journal.append_many(['a', 'b'])
+        with open(journal.log_path, 'r+b') as f:
+            f.truncate(os.path.getsize(journal.log_path) - 1)
+        self.assertEqual(['a'], read_log(journal.log_path))
+
+    def test_filter_class(self):
+        filter = BloomFilter(100, 0.01)
+        publish(filter, self.path)
+        journal = FilterJournal(self.path, BloomFilter)
+        journal.append('a')
+        journal.compact()
+        loaded = journal.load()
+        self.assertTrue(isinstance(loaded, BloomFilter))
+        self.assertTrue('a' in loaded)
+
+    def test_compact_lock(self):
+        journal = FilterJournal(self.path)
+        journal.append('a')
+        with journal.compact_lock():
+            self.assertFalse(journal.compact())
+            self.assertTrue(journal.compact(lock_held=True))
+        self.assertEqual(0, journal.log_size())
+        self.assertTrue('a' in journal.load())
+
+    def test_appends_during_compaction(self):
+        journal = FilterJournal(self.path)
+        keys = ['key-%d' % i for i in range(2000)]
+
+        def append():
+            for key in keys:
+                FilterJournal(self.path).append(key)
+
+        writer = threading.Thread(target=append)
+        writer.start()
+        while writer.is_alive():
+            journal.compact()
+        writer.join()
+        journal.compact()
+        with open(self.path, 'rb') as f:
+            filter = ScalableBloomFilter.fromfile(f)
+        for key in keys:
+            self.assertTrue(key in filter)
+
+    def test_publish_keeps_permissions(self):
+        publish(BloomFilter(100), self.path)
+        os.chmod(self.path, 0o644)
+        with open(self.path, 'rb') as reader:
+            publish(BloomFilter(100), self.path)
+            self.assertEqual(0o644, os.stat(self.path).st_mode & 0o777)
+            # A reader of the old file keeps reading it.
+            self.assertTrue(BloomFilter.fromfile(reader) is not None)
+
+    def test_atomic_file_failure(self):
+        publish(BloomFilter(100), self.path)
+        with open(self.path, 'rb') as f:
+            before = f.read()
+
+        def fail():
+            with atomic_file(self.path) as f:
+                f.write(b'partial')
+                raise RuntimeError()
+
+        self.assertRaises(RuntimeError, fail)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(before, f.read())
+        self.assertEqual(['a.blm'], os.listdir(self.dir))
+
+
+class TestJournalCompactor(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_compact_all(self):
+        paths = [os.path.join(self.dir, '%s.blm' % name) for name in 'ab']
+        FilterJournal(paths[0]).append('a')
+        compactor = JournalCompactor(paths, min_log_bytes=0)
+        compactor.compact_all()
+        self.assertEqual(1, compactor.compactions)
+        self.assertTrue(os.path.exists(paths[0]))
+        self.assertFalse(os.path.exists(paths[1]))
+
+    def test_thread(self):
+        path = os.path.join(self.dir, 'a.blm')
+        FilterJournal(path).append('a')
+        compactor = JournalCompactor([path], interval=0.01)
+        compactor.start()
+        try:
+            for _ in range(500):
+                if compactor.compactions:
+                    break
+                threading.Event().wait(0.01)
+        finally:
+            compactor.stop()
+        self.assertEqual(1, compactor.compactions)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+from __future__ import absolute_import
+
+from pybloom_live.blocked import ScalableBlockedBloomFilter
+from pybloom_live.journal import FilterJournal, publish, read_log
+from pybloom_live.manager import FilterManager, FilterWatcher
+from pybloom_live.pybloom import ScalableBloomFilter, _LazyFilter
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class TestFilterManager(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, keys, cls=ScalableBloomFilter):
+        path = os.path.join(self.dir, name)
+        filter = cls()
+        for key in keys:
+            filter.add(key)
+        with open(path, 'wb') as f:
+            filter.tofile(f)
+        return path, os.path.getsize(path)
+
+    def test_hits_and_misses(self):
+        path, _ = self.write('a.blm', ['a', 'b'])
+        manager = FilterManager()
+        first = manager.get(path)
+        self.assertTrue('a' in first)
+        self.assertTrue(manager.get(path) is first)
+        stats = manager.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['entries'])
+
+    def test_reloads_changed_file(self):
+        path, _ = self.write('a.blm', ['a'])
+        manager = FilterManager()
+        first = manager.get(path)
+        self.write('a.blm', ['a', 'b', 'c'])
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+        second = manager.get(path)
+        self.assertFalse(second is first)
+        self.assertTrue('c' in second)
+        self.assertEqual(2, manager.stats()['misses'])
+        self.assertEqual(os.path.getsize(path), manager.nbytes)
+
+    def test_lru_eviction(self):
+        path_a, size = self.write('a.blm', ['a'])
+        path_b, _ = self.write('b.blm', ['b'])
+        path_c, _ = self.write('c.blm', ['c'])
+        manager = FilterManager(max_bytes=2 * size)
+        manager.get(path_a)
+        manager.get(path_b)
+        manager.get(path_a)
+        manager.get(path_c)
+        self.assertTrue(path_a in manager)
+        self.assertFalse(path_b in manager)
+        self.assertTrue(path_c in manager)
+        self.assertEqual(1, manager.stats()['evictions'])
+        self.assertTrue(manager.nbytes <= manager.max_bytes)
+
+    def test_oversized_filter_is_not_cached(self):
+        path, size = self.write('a.blm', ['a'])
+        manager = FilterManager(max_bytes=size - 1)
+        self.assertTrue('a' in manager.get(path))
+        self.assertEqual(0, len(manager))
+        self.assertEqual(0, manager.nbytes)
+
+    def test_missing_file(self):
+        manager = FilterManager()
+        self.assertRaises(OSError, manager.get,
+                          os.path.join(self.dir, 'missing.blm'))
+
+    def test_filter_class_and_mmap(self):
+        path, _ = self.write('a.blm', ['a'], ScalableBlockedBloomFilter)
+        manager = FilterManager(filter_class=ScalableBlockedBloomFilter,
+                                mmap=True)
+        filter = manager.get(path)
+        self.assertTrue(isinstance(filter, ScalableBlockedBloomFilter))
+        self.assertTrue('a' in filter)
+
+    def test_invalidate_and_clear(self):
+        path, _ = self.write('a.blm', ['a'])
+        manager = FilterManager()
+        manager.get(path)
+        manager.invalidate(path)
+        self.assertEqual(0, len(manager))
+        self.assertEqual(0, manager.nbytes)
+        manager.get(path)
+        manager.clear()
+        self.assertEqual(0, len(manager))
+
+    def test_journaled_reloads_on_append(self):
+        path, _ = self.write('a.blm', ['a'])
+        manager = FilterManager(journaled=True, mmap=True)
+        first = manager.get(path)
+        self.assertTrue(manager.get(path) is first)
+        FilterJournal(path).append('b')
+        second = manager.get(path)
+        self.assertFalse(second is first)
+        self.assertTrue('a' in second and 'b' in second)
+
+    def test_journaled_log_without_snapshot(self):
+        path = os.path.join(self.dir, 'new.blm')
+        manager = FilterManager(journaled=True)
+        self.assertRaises(OSError, manager.get, path)
+        FilterJournal(path).append('a')
+        self.assertTrue('a' in manager.get(path))
+
+    def test_op_counters(self):
+        path, _ = self.write('a.blm', ['a'])
+        manager = FilterManager(op_counters=True)
+        self.assertTrue('a' in manager.get(path))
+        self.assertEqual({path: manager.get(path)}, manager.filters())
+        self.assertEqual(1, manager.get(path).stats()['hits'])
+
+    def test_lazy(self):
+        path, _ = self.write('a.blm', range(1000))
+        for journaled in (False, True):
+            manager = FilterManager(mmap=True, journaled=journaled, lazy=True,
+                                    op_counters=True)
+            filter = manager.get(path)
+            self.assertTrue(999 in filter)
+            self.assertTrue(isinstance(filter.filters[0], _LazyFilter))
+            self.assertEqual(1, filter.stats()['hits'])
+
+    def test_refresh(self):
+        path, _ = self.write('a.blm', ['a'])
+        manager = FilterManager(mmap=True, revalidate=False)
+        self.assertFalse(manager.refresh(path))
+        first = manager.get(path)
+        filter = ScalableBloomFilter()
+        filter.add_many(['a', 'b', 'c'])
+        publish(filter, path)
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+        self.assertTrue(manager.get(path) is first)
+        self.assertTrue(manager.refresh(path))
+        self.assertFalse(manager.refresh(path))
+        second = manager.get(path)
+        self.assertTrue('c' in second)
+        # Lookups on the filter swapped out still work on the old file.
+        self.assertTrue('a' in first and 'c' not in first)
+        self.assertEqual(1, manager.stats()['reloads'])
+        self.assertEqual(os.path.getsize(path), manager.nbytes)
+        os.remove(path)
+        self.assertFalse(manager.refresh(path))
+        self.assertEqual(0, len(manager))
+        self.assertEqual(0, manager.nbytes)
+
+    def test_add_many(self):
+        path, _ = self.write('a.blm', ['a'])
+        manager = FilterManager(journaled=True)
+        self.assertRaises(ValueError, FilterManager(mmap=True).add_many,
+                          path, ['b'])
+        first = manager.get(path)
+        manager.add_many(path, ['b', 'c'])
+        self.assertTrue(manager.get(path) is first)
+        self.assertTrue('b' in first and 'c' in first)
+        self.assertFalse(manager.refresh(path))
+        # A key another writer logged meanwhile needs a reload.
+        FilterJournal(path).append('d')
+        manager.add_many(path, ['e'])
+        self.assertTrue(manager.refresh(path))
+        self.assertTrue('d' in manager.get(path) and 'e' in manager.get(path))
+        self.assertEqual(['b', 'c', 'd', 'e'],
+                         read_log(FilterJournal(path).log_path))
+
+    def test_concurrent_add_many(self):
+        path, _ = self.write('a.blm', [])
+        manager = FilterManager(journaled=True)
+        filter = manager.get(path)
+        keys = [['%d-%d' % (i, j) for j in range(400)] for i in range(8)]
+
+        def add(keys):
+            for start in range(0, len(keys), 10):
+                manager.add_many(path, keys[start:start + 10])
+
+        threads = [threading.Thread(target=add, args=(k,)) for k in keys]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Every add went to the cached filter, which grew along the way.
+        self.assertTrue(manager.get(path) is filter)
+        self.assertTrue(len(filter.filters) > 1)
+        self.assertTrue(all(key in filter for k in keys for key in k))
+        self.assertEqual(3200, len(read_log(FilterJournal(path).log_path)))
+
+    def test_watcher(self):
+        path, _ = self.write('a.blm', ['a'])
+        manager = FilterManager(journaled=True)
+        first = manager.get(path)
+        watcher = FilterWatcher([manager], interval=0.01)
+        watcher.start()
+        try:
+            self.assertFalse(manager.revalidate)
+            FilterJournal(path).append('b')
+            for _ in range(500):
+                if 'b' in manager.get(path):
+                    break
+                threading.Event().wait(0.01)
+        finally:
+            watcher.stop()
+        self.assertTrue(manager.revalidate)
+        self.assertFalse(manager.get(path) is first)
+        self.assertTrue('b' in manager.get(path))
+        self.assertEqual(1, manager.stats()['reloads'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+from __future__ import absolute_import
+
+from pybloom_live.metrics import prometheus_text
+from pybloom_live.pybloom import BloomFilter, ScalableBloomFilter
+from pybloom_live.utils import range_fn
+
+import unittest
+
+
+def samples(text):
+    return dict(line.rsplit(' ', 1) for line in text.splitlines()
+                if not line.startswith('#'))
+
+
+class TestPrometheusText(unittest.TestCase):
+    def test_filters(self):
+        bloom = BloomFilter(100, 0.01)
+        bloom.add('a')
+        sbf = ScalableBloomFilter(initial_capacity=10,
+                                  mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        sbf.enable_op_counters()
+        sbf.add_many(range_fn(0, 50))
+        self.assertTrue(0 in sbf)
+        text = prometheus_text({'bloom': bloom, 'sbf': sbf})
+        values = samples(text)
+        self.assertEqual('1', values['pybloom_keys{filter="bloom"}'])
+        self.assertEqual(str(len(sbf.filters)),
+                         values['pybloom_sub_filters{filter="sbf"}'])
+        self.assertEqual('1', values['pybloom_hits_total{filter="sbf"}'])
+        self.assertEqual(
+            '1', values['pybloom_sub_filter_hits_total{filter="sbf",index="0"}'])
+        self.assertFalse('pybloom_lookups_total{filter="bloom"}' in values)
+        self.assertTrue('# TYPE pybloom_lookups_total counter' in text)
+        self.assertTrue('# TYPE pybloom_fill_ratio gauge' in text)
+        self.assertEqual(1, text.count('# TYPE pybloom_fill_ratio gauge'))
+        for value in values.values():
+            float(value)
+
+    def test_label_escaping_and_prefix(self):
+        text = prometheus_text({'a"b\\c\nd': BloomFilter(10).stats()},
+                               prefix='auth')
+        self.assertTrue('auth_keys{filter="a\\"b\\\\c\\nd"} 0' in text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+
+from pybloom_live.blocked import BlockedBloomFilter, ScalableBlockedBloomFilter
+from pybloom_live.parallel import build_parallel, parallel_add
+from pybloom_live.pybloom import (DOUBLE_HASHING, BloomFilter,
+                                  ScalableBloomFilter)
+from pybloom_live.utils import range_fn
+
+import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class TestParallelBuild(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.executor = ProcessPoolExecutor(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def test_matches_sequential_build(self):
+        for filter_class, hash_mode in [(BloomFilter, None),
+                                        (BloomFilter, DOUBLE_HASHING),
+                                        (BlockedBloomFilter, None)]:
+            keys = ['key-%d' % i for i in range_fn(0, 3000)]
+            expected = (filter_class(5000, 0.001) if hash_mode is None else
+                        filter_class(5000, 0.001, hash_mode=hash_mode))
+            expected.add_many(keys, skip_check=True)
+            built = build_parallel(iter(keys), 5000, 0.001,
+                                   hash_mode=hash_mode,
+                                   filter_class=filter_class, workers=2,
+                                   chunk_size=700, executor=self.executor)
+            self.assertTrue(isinstance(built, filter_class))
+            self.assertEqual(expected.bitarray, built.bitarray)
+            self.assertEqual(3000, built.count)
+
+    def test_capacity_fail(self):
+        bloom = BloomFilter(100, 0.001)
+        self.assertRaises(IndexError, parallel_add, bloom, range_fn(0, 101),
+                          workers=2, executor=self.executor)
+        self.assertEqual(100, bloom.count)
+
+    def test_scalable(self):
+        for cls in (ScalableBloomFilter, ScalableBlockedBloomFilter):
+            sbf = cls(initial_capacity=100,
+                      mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+            sbf.add('existing')
+            parallel_add(sbf, range_fn(0, 1499), workers=2,
+                         executor=self.executor)
+            # 100 + 200 + 400 + 800 holds exactly the 1500 keys.
+            self.assertEqual([100, 200, 400, 800],
+                             [f.capacity for f in sbf.filters])
+            self.assertEqual(1500, len(sbf))
+            self.assertTrue('existing' in sbf)
+            for i in range_fn(0, 1499):
+                self.assertTrue(i in sbf)
+            parallel_add(sbf, [], workers=2, executor=self.executor)
+            self.assertEqual(4, len(sbf.filters))
+
+    def test_own_pool_and_threads(self):
+        bloom = build_parallel(range_fn(0, 200), 200, workers=2)
+        self.assertEqual(200, bloom.count)
+        with ThreadPoolExecutor(2) as executor:
+            bloom = build_parallel(range_fn(0, 200), 200, executor=executor)
+        for i in range_fn(0, 200):
+            self.assertTrue(i in bloom)
+
+
+if __name__ == '__main__':
+    unittest.main()
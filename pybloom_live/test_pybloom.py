@@ -1,6 +1,13 @@
 from __future__ import absolute_import
 
-from pybloom_live.pybloom import (BloomFilter, ScalableBloomFilter,
+from pybloom_live.counting import ScalableCountingBloomFilter
+from pybloom_live.cuckoo import ScalableCuckooFilter
+from pybloom_live.pybloom import (DOUBLE_HASHING, ENCODING_SPARSE16,
+                                  ENCODING_SPARSE32, ENCODING_ZLIB,
+                                  SALTED_HASHING, BloomFilter, KeyDigest,
+                                  ScalableBloomFilter, _encode_bits,
+                                  _LazyFilter,
+                                  make_batch_hashfuncs, make_digest_hashfuncs,
                                   make_hashfuncs)
 from pybloom_live.utils import range_fn, running_python_3
 
@@ -10,10 +17,16 @@ try:
 except ImportError:
     pass
 
+import gzip
 import io
+import os
+import pickle
 import random
+import socket
 import tempfile
+import threading
 import unittest
+from struct import calcsize, pack
 
 import pytest
 
@@ -31,6 +44,183 @@ class TestMakeHashFuncs(unittest.TestCase):
         make_hashes, hashfn = make_hashfuncs(5, 1)
         self.assertEqual('xxh3_128', hashfn.__name__)
 
+    def test_make_hashfuncs_double_hashing(self):
+        make_hashes, hashfn = make_hashfuncs(100, 20, DOUBLE_HASHING)
+        self.assertEqual('xxh3_128', hashfn.__name__)
+        hashes = list(make_hashes('key'))
+        self.assertEqual(100, len(hashes))
+        self.assertTrue(all(0 <= h < 20 for h in hashes))
+        self.assertEqual(hashes, list(make_hashes('key')))
+
+
+class TestKeyDigest(unittest.TestCase):
+    def test_digest_hashfuncs_match_make_hashfuncs(self):
+        for hash_mode in (SALTED_HASHING, DOUBLE_HASHING):
+            for num_slices, num_bits in [(5, 1), (10, 2), (20, 3), (100, 20)]:
+                make_hashes, _ = make_hashfuncs(num_slices, num_bits, hash_mode)
+                hashes_from = make_digest_hashfuncs(num_slices, num_bits,
+                                                    hash_mode)
+                digest = KeyDigest('key')
+                self.assertEqual(list(make_hashes('key')),
+                                 list(hashes_from(digest)))
+                # A second derivation from the cached digests agrees too.
+                self.assertEqual(list(make_hashes('key')),
+                                 list(hashes_from(digest)))
+
+    def test_scalable_add_matches_per_filter_hashing(self):
+        for hash_mode in (SALTED_HASHING, DOUBLE_HASHING):
+            sbf = ScalableBloomFilter(initial_capacity=50,
+                                      mode=ScalableBloomFilter.SMALL_SET_GROWTH,
+                                      hash_mode=hash_mode)
+            # Reference built by hashing the key separately in every filter.
+            reference = []
+            for i in range_fn(0, 1000):
+                found = any(i in f for f in reference)
+                self.assertEqual(found, sbf.add(i))
+                if found:
+                    continue
+                if not reference or reference[-1].count >= reference[-1].capacity:
+                    capacity = reference[-1].capacity * 2 if reference else 50
+                    error_rate = (reference[-1].error_rate if reference
+                                  else sbf.error_rate) * sbf.ratio
+                    reference.append(BloomFilter(capacity, error_rate, hash_mode))
+                reference[-1].add(i, skip_check=True)
+            self.assertTrue(len(sbf.filters) > 3)
+            self.assertEqual([f.bitarray for f in reference],
+                             [f.bitarray for f in sbf.filters])
+            self.assertEqual([f.count for f in reference],
+                             [f.count for f in sbf.filters])
+            for i in range_fn(0, 1000):
+                self.assertTrue(i in sbf)
+
+
+class TestHashModes(unittest.TestCase):
+    def test_double_hashing_membership(self):
+        bloom = BloomFilter(1000, 0.0001, BloomFilter.DOUBLE_HASHING)
+        for i in range_fn(0, 1000):
+            bloom.add(i)
+        for i in range_fn(0, 1000):
+            self.assertTrue(i in bloom)
+        false_positives = sum(1 for i in range_fn(1000, 11000) if i in bloom)
+        self.assertTrue(false_positives < 10)
+
+    def test_legacy_header_is_unchanged(self):
+        bloom = BloomFilter(100, 0.001)
+        f = io.BytesIO()
+        bloom.tofile(f)
+        self.assertEqual(pack(BloomFilter.FILE_FMT, 0.001, bloom.num_slices,
+                              bloom.bits_per_slice, 100, 0),
+                         f.getvalue()[:calcsize(BloomFilter.FILE_FMT)])
+
+    def test_hash_mode_roundtrip(self):
+        sbf = ScalableBloomFilter(hash_mode=BloomFilter.DOUBLE_HASHING)
+        f = io.BytesIO()
+        sbf.tofile(f)
+        f.seek(0)
+        self.assertEqual(BloomFilter.DOUBLE_HASHING,
+                         ScalableBloomFilter.fromfile(f).hash_mode)
+        for i in range_fn(0, 500):
+            sbf.add(i)
+        f = io.BytesIO()
+        sbf.tofile(f)
+        f.seek(0)
+        loaded = ScalableBloomFilter.fromfile(f)
+        self.assertEqual(len(sbf.filters), len(loaded.filters))
+        for filter in loaded.filters:
+            self.assertEqual(BloomFilter.DOUBLE_HASHING, filter.hash_mode)
+        for i in range_fn(0, 500):
+            self.assertTrue(i in loaded)
+
+    def test_union_hash_mode_fail(self):
+        bloom_one = BloomFilter(100, 0.001)
+        bloom_two = BloomFilter(100, 0.001, BloomFilter.DOUBLE_HASHING)
+        def _run():
+            bloom_one.union(bloom_two)
+        self.assertRaises(ValueError, _run)
+
+
+class TestBatchOperations(unittest.TestCase):
+    def test_make_batch_hashfuncs_matches_make_hashfuncs(self):
+        for hash_mode in (SALTED_HASHING, DOUBLE_HASHING):
+            for num_slices, num_bits in [(5, 1), (10, 2), (20, 3), (7, 1 << 16)]:
+                make_hashes, _ = make_hashfuncs(num_slices, num_bits, hash_mode)
+                make_hashes_many = make_batch_hashfuncs(num_slices, num_bits,
+                                                        hash_mode)
+                keys = ['a', u'\xe9t\xe9', 42, 3.5]
+                expected = [list(make_hashes(key)) for key in keys]
+                self.assertEqual(expected, make_hashes_many(keys).tolist())
+
+    def test_add_many_matches_add(self):
+        bloom_one = BloomFilter(1000, 0.001)
+        bloom_two = BloomFilter(1000, 0.001)
+        keys = [i for i in range_fn(0, 500)]
+        for key in keys:
+            bloom_one.add(key)
+        found = bloom_two.add_many(keys, batch_size=64)
+        self.assertFalse(found.any())
+        self.assertEqual(bloom_one.bitarray, bloom_two.bitarray)
+        self.assertEqual(len(bloom_one), len(bloom_two))
+
+    def test_add_many_reports_existing_keys(self):
+        bloom = BloomFilter(100, 0.001)
+        bloom.add('a')
+        found = bloom.add_many(['a', 'b', 'b', 'c'])
+        self.assertEqual([True, False, True, False], found.tolist())
+        self.assertEqual(3, len(bloom))
+
+    def test_add_many_capacity_fail(self):
+        bloom = BloomFilter(10, 0.001)
+        def _run():
+            bloom.add_many(range_fn(0, 20))
+        self.assertRaises(IndexError, _run)
+        self.assertEqual(0, len(bloom))
+
+    def test_contains_many(self):
+        bloom = BloomFilter(1000, 0.001)
+        bloom.add_many(range_fn(0, 500))
+        result = bloom.contains_many(range_fn(0, 1000), batch_size=100)
+        self.assertEqual(1000, len(result))
+        self.assertTrue(result[:500].all())
+        self.assertEqual([i in bloom for i in range_fn(0, 1000)],
+                         result.tolist())
+        self.assertEqual(0, len(bloom.contains_many([])))
+
+    def test_scalable_add_many_matches_add(self):
+        for hash_mode in (SALTED_HASHING, DOUBLE_HASHING):
+            sbf_one = ScalableBloomFilter(
+                initial_capacity=50, mode=ScalableBloomFilter.SMALL_SET_GROWTH,
+                hash_mode=hash_mode)
+            sbf_two = ScalableBloomFilter(
+                initial_capacity=50, mode=ScalableBloomFilter.SMALL_SET_GROWTH,
+                hash_mode=hash_mode)
+            keys = [i for i in range_fn(0, 2000)] + [7, 1500]
+            expected = [sbf_one.add(key) for key in keys]
+            found = sbf_two.add_many(keys, batch_size=128)
+            self.assertEqual(expected, found.tolist())
+            self.assertEqual([f.count for f in sbf_one.filters],
+                             [f.count for f in sbf_two.filters])
+            self.assertEqual([f.bitarray for f in sbf_one.filters],
+                             [f.bitarray for f in sbf_two.filters])
+
+    def test_scalable_add_many_newest_filter_full(self):
+        sbf = ScalableBloomFilter(initial_capacity=10)
+        keys = ['k%d' % i for i in range_fn(0, 10)]
+        sbf.add_many(keys)
+        self.assertEqual(sbf.filters[-1].capacity, sbf.filters[-1].count)
+        self.assertEqual([True, False], sbf.add_many(['k3', 'new']).tolist())
+        self.assertEqual(11, len(sbf))
+        self.assertEqual([True], sbf.add_many(['k3']).tolist())
+        self.assertEqual(11, len(sbf))
+
+    def test_scalable_contains_many(self):
+        sbf = ScalableBloomFilter(initial_capacity=50)
+        sbf.add_many(range_fn(0, 500))
+        result = sbf.contains_many(range_fn(0, 1000), batch_size=100)
+        self.assertEqual([i in sbf for i in range_fn(0, 1000)],
+                         result.tolist())
+        self.assertTrue(result[:500].all())
+        self.assertEqual([False], ScalableBloomFilter().contains_many(['a']).tolist())
+
 
 class TestUnionIntersection(unittest.TestCase):
     def test_union(self):
@@ -101,13 +291,73 @@ class TestUnionIntersection(unittest.TestCase):
             self.assertTrue(number in new_bloom)
 
 
+class TestStats(unittest.TestCase):
+    def test_bloom_filter_stats(self):
+        bloom = BloomFilter(1000, 0.01)
+        stats = bloom.stats()
+        self.assertEqual(0, stats['bits_set'])
+        self.assertEqual(0.0, stats['estimated_fpr'])
+        self.assertFalse('lookups' in stats)
+        bloom.add_many(range_fn(0, 1000))
+        stats = bloom.stats()
+        self.assertEqual(bloom.bitarray.count(True), stats['bits_set'])
+        self.assertEqual(stats['bits_set'] / float(bloom.num_bits),
+                         stats['fill_ratio'])
+        # At capacity the estimate is close to the error rate.
+        self.assertTrue(0.005 < stats['estimated_fpr'] < 0.02)
+
+    def test_op_counters(self):
+        bloom = BloomFilter(1000, 0.001)
+        bloom.enable_op_counters()
+        bloom.add('a')
+        bloom.add_many(['b', 'c'])
+        self.assertTrue('a' in bloom)
+        self.assertFalse('z' in bloom)
+        bloom.contains_many(['b', 'y'])
+        stats = bloom.stats()
+        self.assertEqual(3, stats['inserts'])
+        self.assertEqual(4, stats['lookups'])
+        self.assertEqual(2, stats['hits'])
+        self.assertTrue(stats['hash_seconds'] > 0)
+        copy = pickle.loads(pickle.dumps(bloom))
+        self.assertTrue('a' in copy)
+        self.assertEqual(5, copy.stats()['lookups'])
+
+    def test_scalable_stats(self):
+        sbf = ScalableBloomFilter(initial_capacity=100,
+                                  mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        sbf.add('first')
+        sbf.enable_op_counters()
+        sbf.add_many(range_fn(0, 1000))
+        self.assertTrue('first' in sbf)
+        self.assertTrue(999 in sbf)
+        self.assertFalse('missing' in sbf)
+        stats = sbf.stats()
+        self.assertEqual(len(sbf.filters), stats['filters'])
+        self.assertEqual([f.num_bits for f in sbf.filters],
+                         [s['num_bits'] for s in stats['sub_filters']])
+        self.assertEqual(sum(s['bits_set'] for s in stats['sub_filters']),
+                         stats['bits_set'])
+        self.assertEqual(1000, stats['inserts'])
+        self.assertEqual(3, stats['lookups'])
+        self.assertEqual(2, stats['hits'])
+        # 'first' is in the oldest filter, 999 in the newest.
+        self.assertEqual(1, stats['hits_by_filter'][0])
+        self.assertEqual(1, stats['hits_by_filter'][-1])
+        self.assertTrue(stats['probes'] >= 3)
+        self.assertTrue(0 < stats['estimated_fpr'] < 0.01)
+
+
 class TestSerialization:
     SIZE = 12345
     EXPECTED = set([random.randint(0, 10000100) for _ in range_fn(0, SIZE)])
 
     @pytest.mark.parametrize("cls,args", [
         (BloomFilter, (SIZE,)),
+        (BloomFilter, (SIZE, 0.001, BloomFilter.DOUBLE_HASHING)),
         (ScalableBloomFilter, ()),
+        (ScalableBloomFilter, (100, 0.001, ScalableBloomFilter.LARGE_SET_GROWTH,
+                               BloomFilter.DOUBLE_HASHING)),
     ])
     @pytest.mark.parametrize("stream_factory", [
         lambda: tempfile.TemporaryFile,
@@ -134,5 +384,286 @@ class TestSerialization:
             assert item in filter
 
 
+class TestCompressedSerialization:
+    @pytest.mark.parametrize("keys,encoding", [
+        (10, ENCODING_SPARSE16),
+        (1000, ENCODING_ZLIB),
+        (10000, None),
+    ])
+    @pytest.mark.parametrize("hash_mode", [SALTED_HASHING, DOUBLE_HASHING])
+    def test_encoding_by_fill(self, keys, encoding, hash_mode):
+        filter = BloomFilter(10000, 0.001, hash_mode)
+        filter.add_many(range_fn(0, keys), skip_check=True)
+        assert _encode_bits(filter.bitarray, filter.num_bits)[0] == encoding
+        raw = io.BytesIO()
+        filter.tofile(raw)
+        f = io.BytesIO()
+        filter.tofile(f, compress=True)
+        assert len(f.getvalue()) <= len(raw.getvalue())
+        f.seek(0)
+        loaded = BloomFilter.fromfile(f)
+        assert loaded.bitarray.tobytes() == filter.bitarray.tobytes()
+        assert loaded.hash_mode == hash_mode
+        assert len(loaded) == keys
+        for loaded in (BloomFilter.frombuffer(f.getvalue()),
+                       BloomFilter.fromfile(io.BytesIO(f.getvalue()), mmap=True)):
+            assert loaded.bitarray.tobytes() == filter.bitarray.tobytes()
+        loaded.add('new key')
+
+    def test_sparse32(self):
+        filter = BloomFilter(1000000, 0.5)
+        filter.add('a')
+        assert _encode_bits(filter.bitarray,
+                            filter.num_bits)[0] == ENCODING_SPARSE32
+        f = io.BytesIO()
+        filter.tofile(f, compress=True)
+        assert 'a' in BloomFilter.frombuffer(f.getvalue())
+
+    def test_empty(self):
+        filter = BloomFilter(100)
+        f = io.BytesIO()
+        filter.tofile(f, compress=True)
+        assert not BloomFilter.frombuffer(f.getvalue()).bitarray.any()
+
+    def test_scalable(self):
+        sbf = ScalableBloomFilter(initial_capacity=1000)
+        sbf.add_many(range_fn(0, 1100))
+        raw = io.BytesIO()
+        sbf.tofile(raw)
+        f = tempfile.TemporaryFile()
+        sbf.tofile(f, compress=True)
+        assert f.tell() < len(raw.getvalue())
+        f.seek(0)
+        loaded = ScalableBloomFilter.fromfile(f, mmap=True)
+        assert len(loaded) == 1100
+        # The full filter is written raw and stays mapped.
+        assert loaded.filters[0].bitarray.readonly
+        assert not loaded.filters[1].bitarray.readonly
+        for i in range_fn(0, 1100):
+            assert i in loaded
+
+    def test_corrupt(self):
+        filter = BloomFilter(1000)
+        filter.add('a')
+        f = io.BytesIO()
+        filter.tofile(f, compress=True)
+        data = f.getvalue()
+        with pytest.raises(ValueError):
+            BloomFilter.frombuffer(data[:-1] + b'\xff')
+        filter.add_many(range_fn(0, 100))
+        f = io.BytesIO()
+        filter.tofile(f, compress=True)
+        with pytest.raises(ValueError):
+            BloomFilter.frombuffer(f.getvalue()[:-4])
+
+
+class TestMmapLoading:
+    SIZE = 5000
+    EXPECTED = set([random.randint(0, 10000100) for _ in range_fn(0, SIZE)])
+
+    @pytest.mark.parametrize("cls,args", [
+        (BloomFilter, (SIZE,)),
+        (BloomFilter, (SIZE, 0.001, BloomFilter.DOUBLE_HASHING)),
+        (ScalableBloomFilter, ()),
+    ])
+    def test_mmap_fromfile(self, cls, args):
+        filter = cls(*args)
+        for item in self.EXPECTED:
+            filter.add(item)
+
+        f = tempfile.TemporaryFile()
+        f.write(b'prefix')
+        filter.tofile(f)
+        end = f.seek(0, io.SEEK_END)
+        f.write(b'suffix')
+        f.seek(len(b'prefix'))
+        n = (end - len(b'prefix'),) if cls is BloomFilter else ()
+        loaded = cls.fromfile(f, *n, mmap=True)
+        assert f.tell() == end
+        f.close()
+
+        for item in self.EXPECTED:
+            assert item in loaded
+        assert len(loaded) == len(filter)
+        bloom = loaded if cls is BloomFilter else loaded.filters[0]
+        assert bloom.bitarray.readonly
+        with pytest.raises(TypeError):
+            bloom.add('new key')
+
+    def test_mmap_copy_is_writable(self):
+        filter = BloomFilter(100)
+        filter.add('a')
+        f = tempfile.TemporaryFile()
+        filter.tofile(f)
+        f.seek(0)
+        copied = BloomFilter.fromfile(f, mmap=True).copy()
+        copied.add('b')
+        assert 'a' in copied and 'b' in copied
+
+    def test_mmap_string_io_falls_back(self):
+        filter = ScalableBloomFilter()
+        filter.add('a')
+        f = io.BytesIO()
+        filter.tofile(f)
+        f.seek(0)
+        assert 'a' in ScalableBloomFilter.fromfile(f, mmap=True)
+
+
+class TestLazyLoading:
+    @staticmethod
+    def loaded(filter):
+        return [not isinstance(f, _LazyFilter) for f in filter.filters]
+
+    @pytest.fixture
+    def path(self):
+        sbf = ScalableBloomFilter(initial_capacity=100,
+                                  mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        sbf.add_many(range_fn(0, 1000))
+        f = tempfile.NamedTemporaryFile()
+        sbf.tofile(f)
+        f.flush()
+        yield f.name, sbf
+        f.close()
+
+    @pytest.mark.parametrize("mmap", [False, True])
+    def test_probes_load_sub_filters(self, path, mmap):
+        path, sbf = path
+        with open(path, 'rb') as f:
+            lazy = ScalableBloomFilter.fromfile(f, mmap=mmap, lazy=True)
+        assert not any(self.loaded(lazy))
+        assert len(lazy) == len(sbf)
+        assert lazy.capacity == sbf.capacity
+        assert 999 in lazy
+        assert self.loaded(lazy) == [False, False, False, True]
+        assert lazy.contains_many(range_fn(0, 1000)).all()
+        assert all(self.loaded(lazy))
+        assert lazy.filters[0].bitarray.readonly == mmap
+
+    def test_add(self, path):
+        path, sbf = path
+        with open(path, 'rb') as f:
+            lazy = ScalableBloomFilter.fromfile(f, lazy=True)
+        lazy.enable_op_counters()
+        lazy.add_many(range_fn(1000, 1100))
+        lazy.add('new key')
+        assert len(lazy) >= len(sbf) + 90
+        assert 'new key' in lazy and 1050 in lazy
+        assert lazy.stats()['inserts'] == 101
+
+    def test_copy_and_pickle(self, path):
+        path, sbf = path
+        with open(path, 'rb') as f:
+            lazy = ScalableBloomFilter.fromfile(f, lazy=True)
+        copied = pickle.loads(pickle.dumps(lazy))
+        assert all(self.loaded(copied))
+        assert copied.contains_many(range_fn(0, 1000)).all()
+
+    def test_string_io_falls_back(self):
+        filter = ScalableBloomFilter()
+        filter.add('a')
+        f = io.BytesIO()
+        filter.tofile(f)
+        f.seek(0)
+        loaded = ScalableBloomFilter.fromfile(f, lazy=True)
+        assert all(self.loaded(loaded)) and 'a' in loaded
+
+
+class TestStreaming:
+    @staticmethod
+    def write_in_thread(f, filters, compress):
+        """Write `filters' to `f' and close it from a thread, as the
+        reader may block on a full pipe or socket buffer."""
+        def _write():
+            with f:
+                for filter in filters:
+                    filter.tofile(f, compress=compress)
+        thread = threading.Thread(target=_write)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def filled(cls, *args):
+        filter = cls(*args)
+        filter.add_many(range_fn(0, 1500))
+        return filter
+
+    @pytest.mark.parametrize("cls,args,compress", [
+        (BloomFilter, (2000, 0.01), False),
+        (BloomFilter, (100000, 0.001, DOUBLE_HASHING), True),
+        (ScalableBloomFilter, (1000,), False),
+        (ScalableBloomFilter, (1000,), True),
+        (ScalableCountingBloomFilter, (1000,), False),
+        (ScalableCuckooFilter, (1000,), False),
+    ])
+    def test_pipe(self, cls, args, compress):
+        filters = [self.filled(cls, *args), cls(*args)]
+        r, w = os.pipe()
+        reader = io.open(r, 'rb')
+        thread = self.write_in_thread(io.open(w, 'wb'), filters, compress)
+        n = ()
+        if cls is BloomFilter and compress:
+            data = io.BytesIO()
+            filters[0].tofile(data, compress=True)
+            n = (len(data.getvalue()),)
+        first = cls.fromfile(reader, *n)
+        second = cls.fromfile(reader)
+        thread.join()
+        assert reader.read() == b''
+        reader.close()
+        assert len(first) == len(filters[0])
+        assert first.contains_many(range_fn(0, 1500)).all()
+        assert len(second) == 0
+
+    def test_socket_short_reads(self):
+        sbf = self.filled(ScalableBloomFilter, 100)
+        a, b = socket.socketpair()
+        thread = self.write_in_thread(a.makefile('wb'), [sbf], True)
+        a.close()
+        loaded = ScalableBloomFilter.fromfile(b.makefile('rb', buffering=0))
+        thread.join()
+        b.close()
+        assert len(loaded.filters) == len(sbf.filters)
+        assert loaded.contains_many(range_fn(0, 1500)).all()
+
+    def test_gzip(self):
+        sbf = self.filled(ScalableBloomFilter, 1000)
+        data = io.BytesIO()
+        with gzip.GzipFile(fileobj=data, mode='wb') as f:
+            sbf.tofile(f)
+        with gzip.GzipFile(fileobj=io.BytesIO(data.getvalue())) as f:
+            loaded = ScalableBloomFilter.fromfile(f)
+        assert loaded.contains_many(range_fn(0, 1500)).all()
+
+    @pytest.mark.parametrize("compress", [False, True])
+    def test_file_matches_bytes(self, compress):
+        """Vectored writes to a file produce the bytes of plain writes."""
+        sbf = self.filled(ScalableBloomFilter, 1000)
+        sbf.add('a')
+        data = io.BytesIO()
+        sbf.tofile(data, compress=compress)
+        f = tempfile.TemporaryFile()
+        f.write(b'prefix')
+        sbf.tofile(f, compress=compress)
+        assert f.tell() == len(b'prefix') + len(data.getvalue())
+        f.write(b'suffix')
+        f.seek(0)
+        assert f.read() == b'prefix' + data.getvalue() + b'suffix'
+
+    def test_unused_bits_are_cleared(self):
+        filter = BloomFilter(1000, 0.01)
+        assert filter.num_bits % 8
+        filter.bitarray.setall(True)
+        f = io.BytesIO()
+        filter.tofile(f)
+        assert f.getvalue().endswith(filter.bitarray.tobytes())
+
+    def test_truncated(self):
+        f = io.BytesIO()
+        self.filled(ScalableBloomFilter, 1000).tofile(f)
+        for size in (4, 40, len(f.getvalue()) - 1):
+            with pytest.raises(ValueError):
+                ScalableBloomFilter.fromfile(io.BytesIO(f.getvalue()[:size]))
+
+
 if __name__ == '__main__':
     unittest.main()
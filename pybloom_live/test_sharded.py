@@ -0,0 +1,168 @@
+from __future__ import absolute_import
+
+from pybloom_live.cuckoo import ScalableCuckooFilter
+from pybloom_live.sharded import (HashRing, ShardedBloomFilter, route_hashes,
+                                  shard_path)
+from pybloom_live.utils import range_fn
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def _serve_shard(directory, shard_id, conn):
+    """A node: load one shard and answer batches of keys until None."""
+    node = ShardedBloomFilter.load(directory, mmap=True, shard_ids=[shard_id])
+    conn.send(len(node))
+    while True:
+        keys = conn.recv()
+        if keys is None:
+            break
+        conn.send(node.contains_many(keys).tolist())
+    conn.close()
+
+
+class TestHashRing(unittest.TestCase):
+    def test_balance(self):
+        ring = HashRing(range_fn(0, 4))
+        owners = ring.shards_of_hashes(route_hashes(range_fn(0, 40000)))
+        for shard_id in range_fn(0, 4):
+            self.assertTrue(6000 < (owners == shard_id).sum() < 14000)
+        self.assertEqual(int(owners[7]), ring.shard_of(7))
+        self.assertRaises(ValueError, HashRing, [])
+
+    def test_adding_a_shard_moves_few_keys(self):
+        hashes = route_hashes(list(range_fn(0, 40000)))
+        before = HashRing(range_fn(0, 4)).shards_of_hashes(hashes)
+        after = HashRing(range_fn(0, 5)).shards_of_hashes(hashes)
+        moved = before != after
+        self.assertTrue((after[moved] == 4).all())
+        self.assertTrue(moved.mean() < 0.3)
+
+
+class TestShardedBloomFilter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_add_and_lookup(self):
+        sbf = ShardedBloomFilter(3, initial_capacity=1000)
+        self.assertFalse(sbf.add('a'))
+        self.assertTrue(sbf.add('a'))
+        self.assertFalse(sbf.add_many(range_fn(0, 3000)).any())
+        self.assertEqual(3001, len(sbf))
+        self.assertTrue('a' in sbf)
+        keys = ['a', 'b'] + list(range_fn(0, 4000))
+        self.assertEqual([k in sbf for k in keys],
+                         sbf.contains_many(keys, batch_size=700).tolist())
+        self.assertTrue(sbf.contains_many(range_fn(0, 3000)).all())
+        stats = sbf.stats()
+        self.assertEqual(3, stats['filters'])
+        self.assertEqual(3001, sum(s['count'] for s in stats['sub_filters']))
+
+    def test_save_and_load(self):
+        sbf = ShardedBloomFilter(4, initial_capacity=500, error_rate=0.01)
+        sbf.add_many(range_fn(0, 2000))
+        sbf.save(self.directory)
+        for shard_id in range_fn(0, 4):
+            self.assertTrue(os.path.exists(shard_path(self.directory,
+                                                      shard_id)))
+        loaded = ShardedBloomFilter.load(self.directory, mmap=True)
+        self.assertEqual(len(sbf), len(loaded))
+        self.assertEqual(0.01, loaded.options['error_rate'])
+        self.assertTrue(loaded.contains_many(range_fn(0, 2000)).all())
+        self.assertRaises(ValueError, ShardedBloomFilter.load, self.directory,
+                          filter_class=ScalableCuckooFilter)
+
+    def test_load_one_shard(self):
+        sbf = ShardedBloomFilter(4, initial_capacity=500)
+        sbf.add_many(range_fn(0, 2000))
+        sbf.save(self.directory)
+        node = ShardedBloomFilter.load(self.directory, shard_ids=[1])
+        self.assertEqual(len(sbf.shards[1]), len(node))
+        owners = node.route(list(range_fn(0, 2000)))
+        for key in range_fn(0, 2000):
+            if owners[key] == 1:
+                self.assertTrue(key in node)
+            else:
+                self.assertRaises(KeyError, node.__contains__, key)
+        self.assertRaises(ValueError, ShardedBloomFilter.load,
+                          self.directory, shard_ids=[4])
+
+    def test_rebalance(self):
+        keys = list(range_fn(0, 4000))
+        sbf = ShardedBloomFilter(2, initial_capacity=1000)
+        sbf.add_many(keys)
+        sbf.save(self.directory)
+        changed = sbf.rebalance(4, iter(keys))
+        self.assertEqual([2, 3], changed)
+        self.assertTrue(sbf.contains_many(keys).all())
+        sbf.save(self.directory, changed)
+        loaded = ShardedBloomFilter.load(self.directory)
+        self.assertEqual(4, loaded.num_shards)
+        self.assertTrue(loaded.contains_many(keys).all())
+
+        changed = sbf.rebalance(3, keys)
+        self.assertEqual(3, sbf.num_shards)
+        self.assertTrue(sbf.contains_many(keys).all())
+        sbf.save(self.directory, changed)
+        self.assertFalse(os.path.exists(shard_path(self.directory, 3)))
+        loaded = ShardedBloomFilter.load(self.directory)
+        self.assertTrue(loaded.contains_many(keys).all())
+
+        node = ShardedBloomFilter.load(self.directory, shard_ids=[0])
+        self.assertRaises(ValueError, node.rebalance, 4, keys)
+
+    def test_cuckoo_shards(self):
+        sbf = ShardedBloomFilter(2, filter_class=ScalableCuckooFilter,
+                                 initial_capacity=1000)
+        sbf.add_many(range_fn(0, 1000))
+        sbf.save(self.directory)
+        loaded = ShardedBloomFilter.load(self.directory,
+                                         filter_class=ScalableCuckooFilter)
+        self.assertTrue(loaded.contains_many(range_fn(0, 1000)).all())
+
+    def test_nodes(self):
+        """Every shard served by its own process, keys routed by a client
+        that loads no shards."""
+        keys = ['key-%d' % i for i in range_fn(0, 3000)]
+        sbf = ShardedBloomFilter(3, initial_capacity=1000)
+        sbf.add_many(keys[:2000])
+        sbf.save(self.directory)
+
+        client = ShardedBloomFilter.load(self.directory, shard_ids=[])
+        nodes = {}
+        for shard_id in client.ring.shard_ids:
+            conn, node_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_serve_shard, args=(self.directory, shard_id,
+                                           node_conn))
+            process.start()
+            nodes[shard_id] = (conn, process)
+        try:
+            self.assertEqual(2000, sum(conn.recv()
+                                       for conn, _ in nodes.values()))
+            owners = client.route(keys)
+            found = [None] * len(keys)
+            batches = dict((shard_id, [i for i in range_fn(0, len(keys))
+                                       if owners[i] == shard_id])
+                           for shard_id in nodes)
+            for shard_id, indices in batches.items():
+                nodes[shard_id][0].send([keys[i] for i in indices])
+            for shard_id, indices in batches.items():
+                for i, hit in zip(indices, nodes[shard_id][0].recv()):
+                    found[i] = hit
+            self.assertTrue(all(found[:2000]))
+            self.assertTrue(sum(found[2000:]) < 10)
+        finally:
+            for conn, process in nodes.values():
+                conn.send(None)
+                process.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+
+from pybloom_live.pybloom import (DOUBLE_HASHING, BloomFilter,
+                                  ScalableBloomFilter)
+from pybloom_live.shared import SharedBloomFilter, SharedScalableBloomFilter
+from pybloom_live.utils import range_fn
+
+import multiprocessing
+import pickle
+import unittest
+
+
+def _probe(conn, shared, keys):
+    """A worker: answer how many of `keys' are in `shared' whenever asked,
+    until told to stop."""
+    while conn.recv():
+        conn.send((len(shared), int(shared.contains_many(keys).sum())))
+    try:
+        shared.add('worker key')
+    except (TypeError, ValueError):
+        conn.send('read-only')
+    shared.close()
+
+
+class TestSharedBloomFilter(unittest.TestCase):
+    def test_create_and_attach(self):
+        bf = BloomFilter(1000, 0.001, hash_mode=DOUBLE_HASHING)
+        bf.add_many(range_fn(0, 500))
+        shared = SharedBloomFilter.create(bf)
+        try:
+            reader = SharedBloomFilter.attach(shared.name)
+            self.assertEqual(500, len(reader))
+            self.assertEqual(DOUBLE_HASHING, reader.hash_mode)
+            self.assertTrue(reader.contains_many(range_fn(0, 500)).all())
+            self.assertTrue(reader.bitarray.readonly)
+            shared.add('new')
+            shared.add_many(range_fn(500, 600))
+            self.assertTrue('new' in reader)
+            self.assertEqual(601, len(reader))
+            self.assertRaises(TypeError, reader.add, 'other')
+            reader.close()
+        finally:
+            shared.unlink()
+
+    def test_pickle_attaches(self):
+        shared = SharedBloomFilter.create(BloomFilter(100))
+        try:
+            reader = pickle.loads(pickle.dumps(shared))
+            self.assertEqual(shared.name, reader.name)
+            shared.add('a')
+            self.assertTrue('a' in reader)
+            reader.close()
+        finally:
+            shared.unlink()
+
+
+class TestSharedScalableBloomFilter(unittest.TestCase):
+    def test_growth_is_visible(self):
+        sbf = ScalableBloomFilter(initial_capacity=100,
+                                  mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        sbf.add_many(range_fn(0, 150))
+        shared = SharedScalableBloomFilter.create(sbf)
+        try:
+            reader = SharedScalableBloomFilter.attach(shared.name)
+            self.assertEqual(2, len(reader.filters))
+            self.assertEqual(150, len(reader))
+            shared.add_many(range_fn(150, 1000))
+            for i in range_fn(1000, 1100):
+                shared.add(i)
+            self.assertTrue(len(shared.filters) > 2)
+            self.assertTrue(reader.contains_many(range_fn(0, 1100)).all())
+            self.assertEqual(len(shared.filters), len(reader.filters))
+            self.assertEqual(len(shared), len(reader))
+            self.assertEqual(shared.stats()['num_bits'],
+                             reader.stats()['num_bits'])
+            self.assertRaises(TypeError, reader.add_many,
+                              range_fn(2000, 5000))
+            reader.close()
+        finally:
+            shared.unlink()
+
+    def test_workers(self):
+        """Forked workers probe the owner's copy and see its later adds."""
+        sbf = ScalableBloomFilter(initial_capacity=1000)
+        sbf.add_many(range_fn(0, 1000))
+        shared = SharedScalableBloomFilter.create(sbf)
+        workers = []
+        try:
+            for _ in range_fn(0, 2):
+                conn, worker_conn = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_probe, args=(worker_conn, shared,
+                                         list(range_fn(0, 5000))))
+                process.start()
+                workers.append((conn, process))
+            for conn, _ in workers:
+                conn.send(True)
+                self.assertEqual(1000, conn.recv()[0])
+            shared.add_many(range_fn(1000, 5000))
+            for conn, _ in workers:
+                conn.send(True)
+                count, found = conn.recv()
+                self.assertEqual(len(shared), count)
+                self.assertEqual(5000, found)
+                conn.send(False)
+                self.assertEqual('read-only', conn.recv())
+        finally:
+            for conn, process in workers:
+                process.join(10)
+                if process.is_alive():
+                    process.terminate()
+            shared.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+
+from pybloom_live.pybloom import BloomFilter, ScalableBloomFilter
+from pybloom_live.snapshot import ConcurrentBloomFilter
+from pybloom_live.utils import range_fn
+
+import io
+import threading
+import time
+import unittest
+
+
+class TestConcurrentBloomFilter(unittest.TestCase):
+    def test_keys_are_visible_after_a_batch(self):
+        cbf = ConcurrentBloomFilter(batch_size=3)
+        cbf.add('a')
+        cbf.add('b')
+        self.assertFalse('a' in cbf)
+        self.assertEqual(2, cbf.pending)
+        cbf.add('c')
+        self.assertEqual(0, cbf.pending)
+        self.assertTrue('a' in cbf and 'b' in cbf and 'c' in cbf)
+        cbf.add('d')
+        cbf.flush()
+        self.assertTrue('d' in cbf)
+        self.assertEqual(4, len(cbf))
+        self.assertEqual(2, cbf.snapshots)
+
+    def test_snapshots_are_not_changed(self):
+        sbf = ScalableBloomFilter(initial_capacity=50,
+                                  mode=ScalableBloomFilter.SMALL_SET_GROWTH)
+        sbf.add_many(range_fn(0, 60))
+        cbf = ConcurrentBloomFilter(sbf, batch_size=10)
+        cbf.add_many(range_fn(60, 1000))
+        self.assertEqual(60, len(sbf))
+        self.assertEqual(2, len(sbf.filters))
+        self.assertFalse(999 in sbf)
+        latest = cbf.snapshot()
+        self.assertTrue(latest.filters[0] is sbf.filters[0])
+        for i in range_fn(0, 1000):
+            self.assertTrue(i in cbf)
+
+    def test_bloom_filter_from_buffer(self):
+        bloom = BloomFilter(100, 0.001)
+        bloom.add('a')
+        f = io.BytesIO()
+        bloom.tofile(f)
+        loaded = BloomFilter.frombuffer(f.getvalue())
+        cbf = ConcurrentBloomFilter(loaded, batch_size=1)
+        cbf.add('b')
+        self.assertTrue('a' in cbf and 'b' in cbf)
+        self.assertFalse('b' in loaded)
+        f = io.BytesIO()
+        cbf.tofile(f)
+        f.seek(0)
+        self.assertEqual(2, len(BloomFilter.fromfile(f)))
+
+    def test_max_delay(self):
+        cbf = ConcurrentBloomFilter(max_delay=0.01)
+        cbf.add('a')
+        for _ in range(500):
+            if 'a' in cbf:
+                break
+            time.sleep(0.01)
+        self.assertTrue('a' in cbf)
+
+    def test_readers_during_writes(self):
+        cbf = ConcurrentBloomFilter(
+            ScalableBloomFilter(initial_capacity=100), batch_size=50)
+        published = []
+        errors = []
+        done = threading.Event()
+
+        def read():
+            while not done.is_set():
+                # Every key flushed before this snapshot was taken is in it.
+                count = len(published)
+                snapshot = cbf.snapshot()
+                for i in published[:count]:
+                    if i not in snapshot:
+                        errors.append(i)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for start in range(0, 5000, 100):
+            cbf.add_many(range_fn(start, start + 100))
+            cbf.flush()
+            published.extend(range_fn(start, start + 100))
+        done.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual([], errors)
+        self.assertTrue(4990 < len(cbf) <= 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()
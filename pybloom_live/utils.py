@@ -27,3 +27,13 @@ def is_string_io(instance):
                                      cStringIO.InputType,
                                      cStringIO.OutputType))
     return False
+
+
+def chunked(iterable, size):
+    """Yield successive lists of at most `size' items from `iterable'."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -1,28 +1,14 @@
-from pybloom_live import ScalableBloomFilter
 import os
 
-def load_bloom_filter(filename):
-    try:
-        with open(f"bloom-filter/{filename}", 'rb') as f: 
-            return ScalableBloomFilter.fromfile(f)
-    except FileNotFoundError:
-        return None
-
-vehicle_features = [
-    "Vehicle_Registration_Number",
-    "Vehicle_Identification_Number",
-    "License_Plate_Number",
-    "Engine_Serial_Number",
-    "Tire_Size",
-    "Vehicle_Class",
-    "Transmission_Serial_Number",
-    "Vehicle_Weight",
-    "Axle_Ratio",
-    "Vehicle_Odometer_Reading"
-]
+from auth import filter_path, static_filter_path, vehicle_features
+from pybloom_live import FilterJournal
 
 for feature in vehicle_features:
-    filename = f"{feature}BF.blm"
-    bloom_filter = load_bloom_filter(filename)
-    if bloom_filter is not None:
-        os.remove(f"bloom-filter/{filename}")  # Fixed the file removal path
+    # The registration log goes with the snapshot, or loading would rebuild
+    # the filter from it, and so does the static filter, or it would keep
+    # answering for the removed feature
+    FilterJournal(filter_path(feature)).delete()
+    try:
+        os.remove(static_filter_path(feature))
+    except FileNotFoundError:
+        pass
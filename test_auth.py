@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import auth
+from pybloom_live import BinaryFuseFilter, FilterJournal, FilterManager
+from pybloom_live.journal import publish
+
+FEATURE = "Vehicle_Registration_Number"
+
+
+class TestStaticFilter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.manager = FilterManager(filter_class=auth.filter_class,
+                                     journaled=True)
+        bloom_filter = auth.filter_class()
+        bloom_filter.add_many(["ABC123", "XYZ789"])
+        publish(bloom_filter, auth.filter_path(FEATURE, self.dir))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def build_static(self):
+        path = auth.static_filter_path(FEATURE, self.dir)
+        publish(BinaryFuseFilter(["ABC123", "XYZ789"]), path)
+        snapshot = os.stat(auth.filter_path(FEATURE, self.dir)).st_mtime_ns
+        os.utime(path, ns=(snapshot + 10 ** 9, snapshot + 10 ** 9))
+
+    def load(self):
+        return auth.load_feature_filter(FEATURE, self.dir, self.manager)
+
+    def test_current(self):
+        self.build_static()
+        self.assertTrue(auth.static_filter_is_current(FEATURE, self.dir))
+        self.assertTrue(isinstance(self.load(), BinaryFuseFilter))
+
+    def test_registration_logged_before_build(self):
+        FilterJournal(auth.filter_path(FEATURE, self.dir)).append("REGISTERED1")
+        self.build_static()
+        self.assertFalse(auth.static_filter_is_current(FEATURE, self.dir))
+        bloom_filter = self.load()
+        self.assertFalse(isinstance(bloom_filter, BinaryFuseFilter))
+        self.assertTrue("REGISTERED1" in bloom_filter)
+
+    def test_compaction_after_build(self):
+        self.build_static()
+        journal = FilterJournal(auth.filter_path(FEATURE, self.dir))
+        journal.append("REGISTERED1")
+        journal.compact()
+        snapshot = os.stat(journal.path).st_mtime_ns + 2 * 10 ** 9
+        os.utime(journal.path, ns=(snapshot, snapshot))
+        self.assertFalse(auth.static_filter_is_current(FEATURE, self.dir))
+        self.assertTrue("REGISTERED1" in self.load())
+
+    def test_snapshot_removed(self):
+        self.build_static()
+        os.remove(auth.filter_path(FEATURE, self.dir))
+        self.assertFalse(auth.static_filter_is_current(FEATURE, self.dir))
+        self.assertIsNone(self.load())
+
+    def test_missing(self):
+        self.assertFalse(auth.static_filter_is_current(FEATURE, self.dir))
+        self.assertIsNone(auth.load_feature_filter("Colour", self.dir,
+                                                   self.manager))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import shutil
+import tempfile
+import time
+import unittest
+
+import auth
+from auth_server import MAX_OTP_ATTEMPTS, MAX_OTP_SENDS, AuthError, AuthService
+from pybloom_live import FilterManager
+from pybloom_live.journal import publish
+
+
+class StubMailer(object):
+    def __init__(self):
+        self.sent = []
+
+    def enqueue(self, recipient_email, OTP):
+        self.sent.append((recipient_email, OTP))
+
+
+class StubWriter(object):
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def answers(features):
+    return dict((feature, f"{feature}-ok") for feature in features)
+
+
+class TestAuthService(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for feature in auth.vehicle_features:
+            bloom_filter = auth.filter_class()
+            bloom_filter.add(f"{feature}-ok")
+            publish(bloom_filter, auth.filter_path(feature, self.dir))
+        self.mailer = StubMailer()
+        self.service = self.make_service()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_service(self, session_ttl=60):
+        return AuthService(filter_dir=self.dir, mailer=self.mailer,
+                           session_ttl=session_ttl,
+                           manager=FilterManager(filter_class=auth.filter_class,
+                                                 journaled=True))
+
+    def handle(self, request, service=None):
+        return asyncio.run((service or self.service).handle(request))
+
+    def passed_session(self, service=None):
+        started = self.handle({"op": "start"}, service)
+        response = self.handle({"op": "answer", "session": started["session"],
+                                "answers": answers(started["features"])},
+                               service)
+        self.assertEqual({"passed": True, "failed": []}, response)
+        return started["session"]
+
+    def email(self, session, address="driver@example.com", service=None):
+        return self.handle({"op": "email", "session": session,
+                            "email": address}, service)
+
+    def verify(self, session, otp, service=None):
+        return self.handle({"op": "verify", "session": session, "otp": otp},
+                           service)
+
+    def test_flow(self):
+        session = self.passed_session()
+        self.assertEqual({"queued": True}, self.email(session))
+        address, otp = self.mailer.sent[-1]
+        self.assertEqual("driver@example.com", address)
+        self.assertEqual({"valid": True}, self.verify(session, otp))
+        self.assertRaises(AuthError, self.verify, session, otp)
+
+    def test_wrong_answer(self):
+        started = self.handle({"op": "start"})
+        features = started["features"]
+        wrong = answers(features)
+        wrong[features[0]] = "not registered"
+        response = self.handle({"op": "answer", "session": started["session"],
+                                "answers": wrong})
+        self.assertEqual({"passed": False, "failed": [features[0]]}, response)
+        self.assertRaises(AuthError, self.email, started["session"])
+
+    def test_expiry(self):
+        service = self.make_service(session_ttl=0.5)
+        session = self.passed_session(service)
+        self.email(session, service=service)
+        time.sleep(0.3)
+        # A resend does not extend the session.
+        self.email(session, service=service)
+        time.sleep(0.3)
+        with self.assertRaisesRegex(AuthError, "expired"):
+            self.verify(session, self.mailer.sent[-1][1], service)
+
+    def test_attempt_limit_spans_resends(self):
+        session = self.passed_session()
+        self.email(session)
+        for _ in range(MAX_OTP_ATTEMPTS - 1):
+            self.assertEqual({"valid": False}, self.verify(session, "wrong"))
+        self.email(session)
+        self.assertEqual({"valid": False}, self.verify(session, "wrong"))
+        self.assertRaises(AuthError, self.verify, session,
+                          self.mailer.sent[-1][1])
+
+    def test_send_limit(self):
+        session = self.passed_session()
+        for _ in range(MAX_OTP_SENDS):
+            self.email(session)
+        with self.assertRaisesRegex(AuthError, "limit"):
+            self.email(session)
+        self.assertEqual(MAX_OTP_SENDS, len(self.mailer.sent))
+
+    def test_recipient_checks(self):
+        session = self.passed_session()
+        self.assertRaises(AuthError, self.email, session, "é@example.com")
+        self.assertRaises(AuthError, self.email, session, None)
+        self.email(session, "driver@example.com")
+        with self.assertRaisesRegex(AuthError, "another address"):
+            self.email(session, "someone@example.com")
+        self.assertEqual(1, len(self.mailer.sent))
+
+    def test_error_responses(self):
+        session = self.passed_session()
+        requests = [
+            {"op": "nope"},
+            {"op": "answer", "session": "missing", "answers": {}},
+            {"op": "answer", "session": session, "answers": {}},
+            {"op": "verify", "session": session, "otp": "1"},
+            {"op": "email", "session": session, "email": "bad address"},
+        ]
+        writer = StubWriter()
+
+        async def connection():
+            reader = asyncio.StreamReader()
+            for request in requests:
+                reader.feed_data(json.dumps(request).encode() + b"\n")
+            reader.feed_data(b"not json\n")
+            reader.feed_eof()
+            await self.service.handle_connection(reader, writer)
+
+        asyncio.run(connection())
+        responses = [json.loads(line) for line in writer.data.splitlines()]
+        self.assertEqual(len(requests) + 1, len(responses))
+        for response in responses:
+            self.assertEqual(["error"], list(response))
+        self.assertEqual("challenge already answered", responses[2]["error"])
+        self.assertEqual("no OTP sent", responses[3]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
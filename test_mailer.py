@@ -0,0 +1,144 @@
+import socketserver
+import threading
+import unittest
+from concurrent.futures import Future
+
+from mailer import OTPMailer, SMTPSettings, otp_message
+
+SENDER = "otp@example.com"
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        stub = self.server
+        with stub.lock:
+            stub.connections += 1
+        self.reply("220 stub ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii").strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO", "NOOP"):
+                self.reply("250 ok")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 ok")
+            elif verb == "RCPT":
+                address = command.split(":", 1)[1].strip().strip("<>")
+                if address in stub.refused:
+                    self.reply("550 no such user")
+                else:
+                    recipients.append(address)
+                    self.reply("250 ok")
+            elif verb == "DATA":
+                self.reply("354 end with .")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with stub.lock:
+                    stub.messages.extend(recipients)
+                    drop = stub.drop_after is not None and \
+                        len(stub.messages) >= stub.drop_after
+                    if drop:
+                        stub.drop_after = None
+                self.reply("250 queued")
+                if drop:
+                    return  # hang up, as servers dropping idle clients do
+            elif verb == "RSET":
+                recipients = []
+                self.reply("250 ok")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """An in-process SMTP server that records the recipients of the
+    messages it accepts."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPStubHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        self.refused = set()
+        self.drop_after = None
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def settings(self):
+        host, port = self.server_address
+        return SMTPSettings(host=host, port=port, sender_email=SENDER,
+                            starttls=False, timeout=5)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestOTPMailer(unittest.TestCase):
+    def setUp(self):
+        self.stub = SMTPStub()
+        self.mailer = OTPMailer(self.stub.settings(), connections=1,
+                                retry_delay=0).start()
+
+    def tearDown(self):
+        self.mailer.stop(5)
+        self.stub.close()
+
+    def send(self, address):
+        return self.mailer.enqueue(address, "123456").result(5)
+
+    def test_connection_reuse(self):
+        futures = [self.mailer.enqueue(f"user{i}@example.com", "123456")
+                   for i in range(5)]
+        self.assertEqual([True] * 5, [f.result(5) for f in futures])
+        self.assertEqual(1, self.stub.connections)
+        stats = self.mailer.stats()
+        self.assertEqual(5, stats["sent"])
+        self.assertEqual(1, stats["connects"])
+
+    def test_retry_after_dropped_connection(self):
+        self.stub.drop_after = 1
+        self.assertTrue(self.send("a@example.com"))
+        self.assertTrue(self.send("b@example.com"))
+        self.assertEqual(["a@example.com", "b@example.com"],
+                         self.stub.messages)
+        stats = self.mailer.stats()
+        self.assertEqual(2, stats["connects"])
+        self.assertEqual(1, stats["retries"])
+        self.assertEqual(0, stats["failed"])
+
+    def test_permanent_failure(self):
+        self.stub.refused.add("nobody@example.com")
+        self.assertFalse(self.send("nobody@example.com"))
+        stats = self.mailer.stats()
+        self.assertEqual(1, stats["failed"])
+        self.assertEqual(0, stats["retries"])
+        self.assertTrue(self.send("somebody@example.com"))
+
+    def test_bad_recipient(self):
+        for address in ("é@example.com", "a@example.com\r\nRCPT TO:<b@c>",
+                        "no-at-sign", None):
+            self.assertRaises(ValueError, self.mailer.enqueue, address, "1")
+        # A message that fails in an unexpected way, past enqueue, fails
+        # alone and leaves the worker running.
+        bad = Future()
+        message = otp_message(SENDER, "x@example.com", "1").as_string()
+        self.mailer._queue.put(("é@example.com", message, bad))
+        self.assertFalse(bad.result(5))
+        self.assertEqual(1, self.mailer.stats()["failed"])
+        self.assertTrue(self.send("valid@example.com"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import auth
+import membership
+from membership import (OP_CONTAINS, MembershipClient, MembershipError,
+                        MembershipServer, decode_items, encode_items)
+from pybloom_live import FilterJournal
+from pybloom_live.journal import publish, read_log
+
+FEATURES = auth.vehicle_features[:2]
+
+
+class TestEncoding(unittest.TestCase):
+    def test_items_round_trip(self):
+        items = [(0, "ABC123"), (1, "é"), (255, "")]
+        self.assertEqual(items, decode_items(encode_items(items)))
+        self.assertEqual([], decode_items(encode_items([])))
+
+    def test_malformed_items(self):
+        body = encode_items([(0, "ABC123")])
+        self.assertRaises(MembershipError, decode_items, body[:-1])
+        self.assertRaises(MembershipError, decode_items, body + b"x")
+
+
+class TestMembershipServer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        for feature in FEATURES:
+            bloom_filter = auth.filter_class()
+            bloom_filter.add_many([f"{feature}-{i}" for i in range(100)])
+            publish(bloom_filter, auth.filter_path(feature, self.dir))
+        self.server = MembershipServer(filter_dir=self.dir, names=FEATURES)
+        self.path = os.path.join(self.dir, "membership.sock")
+        started = threading.Event()
+
+        async def serve():
+            self.loop = asyncio.get_running_loop()
+            self.task = asyncio.ensure_future(self.server.serve(path=self.path))
+            started.set()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+        self.thread = threading.Thread(target=asyncio.run, args=(serve(),),
+                                       daemon=True)
+        self.thread.start()
+        started.wait(5)
+        for _ in range(500):
+            if os.path.exists(self.path):
+                break
+            time.sleep(0.01)
+        self.client = MembershipClient(path=self.path)
+
+    def tearDown(self):
+        self.client.close()
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join(5)
+        shutil.rmtree(self.dir)
+
+    def test_pipelined_round_trip(self):
+        first, second = FEATURES
+        results = self.client.pipeline([
+            [(first, f"{first}-1"), (second, f"{second}-2")],
+            [(first, "missing"), (second, f"{first}-1")],
+            [],
+        ])
+        self.assertEqual([[True, True], [False, False], []], results)
+        self.assertEqual(FEATURES, self.client.names)
+
+    def test_add_many(self):
+        first, second = FEATURES
+        items = [(first, "NEW1"), (second, "NEW2"), (first, f"{first}-3")]
+        self.assertEqual([False, False, True], self.client.add_many(items))
+        self.assertEqual([True, True, True], self.client.contains_many(items))
+        path = auth.filter_path(first, self.dir)
+        self.assertEqual(["NEW1", f"{first}-3"],
+                         read_log(FilterJournal(path).log_path))
+        # The server added the keys to its loaded filters instead of
+        # reloading them.
+        self.assertEqual(2, self.server.manager.stats()["misses"])
+        self.assertFalse(self.server.manager.refresh(path))
+
+    def test_many_keys(self):
+        first = FEATURES[0]
+        keys = [f"{first}-{i}" for i in range(100)] * 700
+        found = self.client.contains_many([(first, key) for key in keys])
+        self.assertEqual(len(keys), len(found))
+        self.assertTrue(all(found))
+
+    def test_errors(self):
+        self.assertRaises(MembershipError, self.client.contains_many,
+                          [("Colour", "red")])
+        with self.assertRaisesRegex(MembershipError, "unknown filter index"):
+            self.client._roundtrip([(OP_CONTAINS, encode_items([(9, "k")]))])
+        with self.assertRaisesRegex(MembershipError, "unknown op"):
+            self.client._roundtrip([(99, b"")])
+        with self.assertRaisesRegex(MembershipError, "truncated"):
+            self.client._roundtrip([(OP_CONTAINS, b"\x01\x00\x00\x05\x00")])
+        # The connection stays usable after error responses.
+        self.assertEqual([True], self.client.contains_many(
+            [(FEATURES[0], f"{FEATURES[0]}-1")]))
+
+    def test_unexpected_error(self):
+        first, second = FEATURES
+        path = auth.filter_path(second, self.dir)
+        os.remove(path)
+        os.mkdir(path)  # loading it raises IsADirectoryError
+        with self.assertRaisesRegex(MembershipError, "internal error"):
+            self.client._roundtrip([
+                (OP_CONTAINS, encode_items([(1, "k")])),
+                (OP_CONTAINS, encode_items([(0, f"{first}-1")])),
+            ])
+        # Both responses arrived and the connection is still up.
+        self.assertTrue(self.client._sock is not None)
+        self.assertEqual([True], self.client.contains_many(
+            [(first, f"{first}-1")]))
+
+    def test_connect_from_env(self):
+        os.environ.pop("MEMBERSHIP_ADDRESS", None)
+        self.assertIsNone(membership.connect_from_env())
+        os.environ["MEMBERSHIP_ADDRESS"] = self.path
+        try:
+            client = membership.connect_from_env()
+        finally:
+            del os.environ["MEMBERSHIP_ADDRESS"]
+        self.assertEqual(self.path, client.path)
+        self.assertTrue(client.filter(FEATURES[0]) is not None)
+        self.assertIsNone(client.filter("Colour"))
+        client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()